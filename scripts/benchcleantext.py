@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+# Compare speed of cleantext.clean_lines() to the remove_tags(),
+# trim_head_tail() and remove_noalnum() chain and check that the
+# results are identical.
+
+import sys
+
+from time import time
+
+from common import open_input
+from cleantext import iter_documents, clean_lines
+from cleantext import remove_tags, trim_head_tail, remove_noalnum
+
+
+def argparser():
+    from argparse import ArgumentParser
+    ap = ArgumentParser(description='Benchmark cleantext line cleaning')
+    ap.add_argument('-w', '--min-words', default=2, type=int,
+                    help='minimum number of lowercase words (head/tail trim)')
+    ap.add_argument('-r', '--repeat', default=3, type=int,
+                    help='number of timed runs (best is reported)')
+    ap.add_argument('-L', '--limit', default=None, type=int,
+                    help='limit number of documents')
+    ap.add_argument('file', nargs='+',
+                    help='text as for cleantext.py (e.g. extracted_texts)')
+    return ap
+
+
+def chain(sentences, options):
+    sentences = remove_tags(sentences, options)
+    sentences = trim_head_tail(sentences, options)
+    return remove_noalnum(sentences, options)
+
+
+def run(func, documents, options, repeat):
+    best, results = None, None
+    for _ in range(repeat):
+        start = time()
+        results = [func(d, options) for d in documents]
+        elapsed = time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return results, best
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+    documents = []
+    for fn in args.file:
+        with open_input(fn) as f:
+            documents.extend(sentences for sentences, _ in iter_documents(f))
+    if args.limit is not None:
+        documents = documents[:args.limit]
+    lines = sum(len(d) for d in documents)
+    print('read {} documents, {} lines'.format(len(documents), lines),
+          file=sys.stderr, flush=True)
+
+    reference, chain_time = run(chain, documents, args, args.repeat)
+    results, fused_time = run(clean_lines, documents, args, args.repeat)
+    for name, elapsed in (('chain', chain_time), ('fused', fused_time)):
+        print('{}\t{:.3f}s\t{:.0f} lines/s'.format(
+            name, elapsed, lines/max(elapsed, 1e-9)))
+    print('speedup\t{:.2f}x'.format(chain_time/max(fused_time, 1e-9)))
+    if results != reference:
+        differ = sum(r != f for r, f in zip(reference, results))
+        print('ERROR: results differ for {} documents'.format(differ),
+              file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+# Measure startup time of scripts, i.e. the time to import each script
+# module in a fresh interpreter. Scripts that are run once per input
+# file pay this cost for every file.
+
+import sys
+import os
+import subprocess
+
+from time import time
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def argparser():
+    from argparse import ArgumentParser
+    ap = ArgumentParser(description='Benchmark script import times')
+    ap.add_argument('-r', '--repeat', default=5, type=int,
+                    help='number of imports per script')
+    ap.add_argument('script', nargs='*',
+                    help='scripts to test (default all in script directory)')
+    return ap
+
+
+def script_modules(scripts):
+    if not scripts:
+        scripts = sorted(
+            fn for fn in os.listdir(SCRIPT_DIR) if fn.endswith('.py'))
+    return [os.path.splitext(os.path.basename(s))[0] for s in scripts]
+
+
+def import_time(module, command=None):
+    """Return wall time of importing module in a new interpreter, or
+    None if the import fails."""
+    if command is None:
+        command = 'import {}'.format(module)
+    start = time()
+    result = subprocess.run(
+        [sys.executable, '-c', command], cwd=SCRIPT_DIR,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    elapsed = time() - start
+    if result.returncode != 0:
+        error = result.stderr.decode('utf-8', 'replace').strip()
+        print('{}: import failed: {}'.format(
+            module, error.splitlines()[-1] if error else '?'),
+              file=sys.stderr, flush=True)
+        return None
+    return elapsed
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+    baseline = min(import_time('python', 'pass') for _ in range(args.repeat))
+    print('{}\t{:.3f}s'.format('(interpreter)', baseline))
+    for module in script_modules(args.script):
+        times = []
+        for _ in range(args.repeat):
+            t = import_time(module)
+            if t is None:
+                break
+            times.append(t)
+        if not times:
+            print('{}\tFAILED'.format(module))
+            continue
+        times.sort()
+        print('{}\t{:.3f}s\tmin {:.3f}s\tmedian {:.3f}s'.format(
+            module, times[0]-baseline, times[0], times[len(times)//2]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+# Compare speed and accuracy of language identification backends,
+# taking langdetect on full documents as reference.
+
+import sys
+
+from time import time
+
+from common import open_input
+from languageid import get_identifier, sample_sentences, sample_text
+
+
+def argparser():
+    from argparse import ArgumentParser
+    ap = ArgumentParser(description='Benchmark language identification')
+    ap.add_argument('-L', '--limit', default=None, type=int,
+                    help='limit number of documents')
+    ap.add_argument('-m', '--langid-model', default=None,
+                    help='model for nb backend (see trainlangid.py)')
+    ap.add_argument('-c', '--langid-max-chars', default=None, type=int,
+                    help='also test with at most this many chars')
+    ap.add_argument('-s', '--langid-sentences', default=None, type=int,
+                    help='also test with at most this many sentences')
+    ap.add_argument('file', nargs='+',
+                    help='documents as for filterdocs.py')
+    return ap
+
+
+def read_documents(fn, limit=None):
+    documents, sentences = [], []
+    with open_input(fn) as f:
+        for l in f:
+            l = l.rstrip()
+            if l and not l.isspace():
+                sentences.append(l)
+            elif sentences:
+                documents.append(sentences)
+                sentences = []
+            if limit is not None and len(documents) >= limit:
+                return documents
+    if sentences:
+        documents.append(sentences)
+    return documents
+
+
+def identify_all(documents, identifier, max_chars, max_sentences):
+    start = time()
+    langs = [
+        identifier.identify(sample_text(
+            ' '.join(sample_sentences(d, max_sentences)), max_chars))
+        for d in documents
+    ]
+    return langs, time()-start
+
+
+def report(name, langs, elapsed, reference):
+    tp = sum(l == 'fi' and r == 'fi' for l, r in zip(langs, reference))
+    fp = sum(l == 'fi' and r != 'fi' for l, r in zip(langs, reference))
+    fn = sum(l != 'fi' and r == 'fi' for l, r in zip(langs, reference))
+    agree = sum((l == 'fi') == (r == 'fi') for l, r in zip(langs, reference))
+    n = max(len(langs), 1)
+    print('{}\t{:.2f}s\t{:.1f} docs/s\tagree {:.2%}\tfi prec {:.2%}'
+          '\tfi rec {:.2%}'.format(
+              name, elapsed, len(langs)/max(elapsed, 1e-9), agree/n,
+              tp/max(tp+fp, 1), tp/max(tp+fn, 1)))
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+    documents = []
+    for fn in args.file:
+        documents.extend(read_documents(fn, args.limit))
+    if args.limit is not None:
+        documents = documents[:args.limit]
+    print('read {} documents'.format(len(documents)),
+          file=sys.stderr, flush=True)
+
+    configs = [('langdetect', None, None)]
+    if args.langid_max_chars is not None or args.langid_sentences is not None:
+        configs.append(('langdetect', args.langid_max_chars,
+                        args.langid_sentences))
+    if args.langid_model is not None:
+        configs.append(('nb', None, None))
+        if (args.langid_max_chars is not None or
+            args.langid_sentences is not None):
+            configs.append(('nb', args.langid_max_chars,
+                            args.langid_sentences))
+
+    reference = None
+    for backend, max_chars, max_sentences in configs:
+        identifier = get_identifier(backend, args.langid_model)
+        langs, elapsed = identify_all(documents, identifier, max_chars,
+                                      max_sentences)
+        if reference is None:
+            reference = langs
+        name = '{} (chars {}, sentences {})'.format(
+            backend, max_chars or 'all', max_sentences or 'all')
+        report(name, langs, elapsed, reference)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -8,6 +8,9 @@ import re
 
 from logging import warning
 
+from common import open_input, add_output_arguments, redirect_output
+from common import add_driver_arguments, run_files
+
 
 TAG_LINE_RE = re.compile(r'^[a-zäöå0-9, ]+$')
 
@@ -24,6 +27,8 @@ COMMENT_END = '//'
 def argparser():
     from argparse import ArgumentParser
     ap = ArgumentParser(description='Clean up STT sentences.')
+    add_output_arguments(ap)
+    add_driver_arguments(ap)
     ap.add_argument('file', nargs='+')
     return ap
 
@@ -78,7 +83,7 @@ def cleanup(sentences):
 
 
 def process(fn, options):
-    with open(fn) as f:
+    with open_input(fn) as f:
         sentences = []
         for l in f:
             l = l.rstrip()
@@ -95,8 +100,11 @@ def process(fn, options):
 
 def main(argv):
     args = argparser().parse_args(argv[1:])
-    for fn in args.file:
-        process(fn, args)
+    if args.output_dir is not None:
+        return run_files(process, args.file, args, (args,))
+    with redirect_output(args):
+        for fn in args.file:
+            process(fn, args)
     return 0
 
 
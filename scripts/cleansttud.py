@@ -5,11 +5,12 @@
 import sys
 import os
 import re
-import gzip
 
 from logging import warning
 
-from common import Word
+from common import iter_conllu, print_document, open_input
+from common import add_output_arguments, open_output
+from common import add_driver_arguments, run_files
 
 TAG_LINE_RE = re.compile(r'^[a-zäöå0-9., ]+$')
 
@@ -34,8 +35,8 @@ DOCSTART_COMMENTS = [
 def argparser():
     from argparse import ArgumentParser
     ap = ArgumentParser(description='Clean up STT sentences.')
-    ap.add_argument('-o', '--output', metavar='FILE', default=None,
-                    help='output file (default STDOUT)')
+    add_output_arguments(ap)
+    add_driver_arguments(ap)
     ap.add_argument('file', nargs='+')
     return ap
 
@@ -131,58 +132,30 @@ def process_sentences(sentences, out):
 
     # transfer document start comments if skipped
     if body and not docstart_comments(body):
-        for c in start_comments:
-            print(c, file=out)
-
-    for comments, words in body:
-        for c in comments:
-            print(c, file=out)
-        for w in words:
-            print('\t'.join(w), file=out)
-        print(file=out)
-
+        print_document(body, out, start_comments)
+    else:
+        print_document(body, out)
 
-def is_document_boundary(comment):
-    return comment.startswith('# doc_id = ') or comment.startswith('# <doc ')
-        
 
 def process_stream(f, out, options):
-    sentences, comments, words = [], [], []
-    for ln, l in enumerate(f, start=1):
-        l = l.rstrip('\n')
-        if not l or l.isspace():
-            sentences.append((comments, words))
-            comments, words = [], []
-        elif l.startswith('#'):
-            if is_document_boundary(l):
-                if sentences:
-                    process_sentences(sentences, out)
-                sentences = []
-            comments.append(l)
-        else:
-            words.append(Word(*l.split('\t')))
-    if sentences:
+    for sentences in iter_conllu(f, lazy=True):
         process_sentences(sentences, out)
 
 
 def process(fn, out, options):
-    if not fn.endswith('.gz'):
-        with open(fn) as f:
-            return process_stream(f, out, options)
-    else:
-        with gzip.open(fn, 'rt') as f:
-            return process_stream(f, out, options)
+    with open_input(fn) as f:
+        return process_stream(f, out, options)
 
 
 def main(argv):
     args = argparser().parse_args(argv[1:])
-    if args.output is None:
+    if args.output_dir is not None:
+        # out=None writes to the redirected sys.stdout
+        return run_files(process, args.file, args, (None, args))
+    with open_output(args.output, args.compresslevel,
+                     args.compress_threads) as out:
         for fn in args.file:
-            process(fn, sys.stdout, args)
-    else:
-        with open(args.output, 'w') as out:
-            for fn in args.file:
-                process(fn, out, args)
+            process(fn, out, args)
     return 0
 
 
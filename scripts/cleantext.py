@@ -1,11 +1,18 @@
 #!/usr/bin/env python3
 
 import sys
-import unicodedata
 import re
 
+from functools import lru_cache
+
 from ftfy import fix_text
 
+from common import add_dedup_arguments, drop_seen_sentences
+from common import check_dedup_arguments, close_bloom_filters
+from common import batches, parallel_map
+from common import open_input, add_output_arguments, redirect_output
+from common import add_driver_arguments, run_files, check_driver_arguments
+
 
 # Common markdown-style tags
 MARKDOWN_TAG_RE = re.compile(r'\[\/?(?:quote|muokkaa)\b[^\[\]]*\]', re.I)
@@ -18,13 +25,18 @@ FI_LC_WORD_RE = re.compile(r'\b[a-zåäö]{2,}\b')
 
 FI_ALNUM = re.compile(r'[a-zåäö0-9]', re.I)
 
-# https://stackoverflow.com/a/93029
-ALL_CHARS = (chr(i) for i in range(sys.maxunicode))
+# Unicode category Cc (control characters) is fixed as C0, DEL and C1,
+# i.e. unicodedata.category(c) == 'Cc' exactly for these ranges.
+CONTROL_CHAR_RANGES = [(0x00, 0x1f), (0x7f, 0x9f)]
 
-CONTROL_CHARS = ''.join(c for c in ALL_CHARS 
-                        if unicodedata.category(c) == 'Cc')
+CONTROL_CHAR_RE = re.compile('[{}]'.format(''.join(
+    '\\x{:02x}-\\x{:02x}'.format(s, e) for s, e in CONTROL_CHAR_RANGES)))
 
-CONTROL_CHAR_RE = re.compile('[{}]'.format(re.escape(CONTROL_CHARS)))
+# Text that ftfy.fix_text() returns unchanged: printable ASCII without
+# HTML entities, and Finnish letters that cannot form mojibake with it.
+FIX_TEXT_SAFE_RE = re.compile(r'[\x20-\x25\x27-\x7eåäöÅÄÖ]*')
+
+FIX_TEXT_CACHE_SIZE = 2**16
 
 
 def argparser():
@@ -34,6 +46,13 @@ def argparser():
                     help='minimum number of lowercase words (head/tail trim)')
     ap.add_argument('-f', '--fix-text', default=False, action='store_true',
                     help='run ftfy.fix_text() on text')
+    ap.add_argument('--workers', default=None, type=int,
+                    help='number of worker processes (default no workers)')
+    ap.add_argument('--batch-size', default=100, type=int,
+                    help='number of documents per worker batch')
+    add_dedup_arguments(ap)
+    add_output_arguments(ap)
+    add_driver_arguments(ap)
     ap.add_argument('file', nargs='+')
     return ap
 
@@ -72,39 +91,120 @@ def remove_noalnum(sentences, options):
     return [s for s in sentences if FI_ALNUM.search(s) is not None]
 
 
+def strip_tags(s):
+    # the tag regexes are applied in sequence, as removing a markdown tag
+    # can join an HTML tag (e.g. "<b[quote]>")
+    if '[' in s:
+        s = MARKDOWN_TAG_RE.sub('', s)
+    if '<' in s:
+        s = HTML_TAG_RE.sub('', s)
+    return s
+
+
+def has_min_words(s, min_words):
+    """Return lc_word_count(s) >= min_words, scanning only as needed."""
+    if min_words <= 0:
+        return True
+    for i, m in enumerate(FI_LC_WORD_RE.finditer(s), start=1):
+        if i >= min_words:
+            return True
+    return False
+
+
+def clean_lines(sentences, options):
+    """Equivalent to remove_tags(), trim_head_tail() and remove_noalnum()
+    applied in sequence, but skipping tag regexes for lines without tag
+    characters and counting words only up to --min-words."""
+    lines = []
+    for s in sentences:
+        s = strip_tags(s)
+        if s and not s.isspace():
+            lines.append(s)
+    i, j = 0, len(lines)
+    while i < j and not has_min_words(lines[i], options.min_words):
+        i += 1
+    while j > i and not has_min_words(lines[j-1], options.min_words):
+        j -= 1
+    return [s for s in lines[i:j] if FI_ALNUM.search(s) is not None]
+
+
+cached_fix_text = lru_cache(maxsize=FIX_TEXT_CACHE_SIZE)(fix_text)
+
+
 def fix_texts(sentences, options):
-    return [fix_text(s) for s in sentences]
+    return [
+        s if FIX_TEXT_SAFE_RE.fullmatch(s) else cached_fix_text(s)
+        for s in sentences
+    ]
 
 
 def strip_control_chars(sentences, options):
     return [CONTROL_CHAR_RE.sub('', s) for s in sentences]
 
 
-def process(fn, options):
+def iter_documents(f):
+    """Yield (sentences, separator line) for documents in f."""
     sentences = []
-    with open(fn) as f:
-        for ln, l in enumerate(f, start=1):
-            l = l.rstrip('\n')
-            if l and not l.isspace():
-                sentences.append(l)
-            else:
-                sentences = remove_tags(sentences, options)
-                sentences = trim_head_tail(sentences, options)
-                sentences = remove_noalnum(sentences, options)
-                if options.fix_text:
-                    sentences = fix_texts(sentences, options)
-                sentences = strip_control_chars(sentences, options)
-                if sentences:
-                    for s in sentences:
-                        print(s)
-                    print(l)
-                sentences = []
+    for l in f:
+        l = l.rstrip('\n')
+        if l and not l.isspace():
+            sentences.append(l)
+        else:
+            yield sentences, l
+            sentences = []
+
+
+def clean_sentences(sentences, options):
+    sentences = clean_lines(sentences, options)
+    if options.fix_text:
+        sentences = fix_texts(sentences, options)
+    sentences = strip_control_chars(sentences, options)
+    return sentences
+
+
+_worker_state = {}
+
+
+def init_worker(options):
+    _worker_state['options'] = options
+
+
+def clean_batch(documents):
+    # Run in worker process
+    options = _worker_state['options']
+    return [(clean_sentences(s, options), l) for s, l in documents]
+
+
+def process(fn, options):
+    with open_input(fn) as f:
+        documents = iter_documents(f)
+        if not options.workers:
+            cleaned = ((clean_sentences(s, options), l) for s, l in documents)
+        else:
+            results = parallel_map(
+                clean_batch, batches(documents, options.batch_size),
+                options.workers, init_worker, (options,))
+            cleaned = (d for batch in results for d in batch)
+        for sentences, l in cleaned:
+            # deduplicate in order in the main process
+            sentences = drop_seen_sentences(sentences, options)
+            if sentences:
+                sys.stdout.write('\n'.join(sentences + [l]) + '\n')
 
 
 def main(argv):
-    args = argparser().parse_args(argv[1:])
-    for fn in args.file:
-        process(fn, args)
+    ap = argparser()
+    args = ap.parse_args(argv[1:])
+    check_dedup_arguments(ap, args, args.jobs)
+    check_driver_arguments(ap, args)
+    try:
+        if args.output_dir is not None:
+            return run_files(process, args.file, args, (args,))
+        with redirect_output(args):
+            for fn in args.file:
+                process(fn, args)
+    finally:
+        close_bloom_filters()
     return 0
 
 
@@ -1,9 +1,19 @@
 import sys
+import os
 import re
+import io
+import json
 import pickle
 import gzip
+import hashlib
+import shutil
+import subprocess
+import traceback
+import urllib.parse
 
-from collections import namedtuple, defaultdict
+from collections import namedtuple, defaultdict, deque
+from contextlib import contextmanager, redirect_stdout, ExitStack
+from functools import lru_cache
 from logging import error
 
 
@@ -44,6 +54,30 @@ FORM_REs = [
 Word = namedtuple('Word', CONLLU_FIELDS)
 
 
+class FormClassifier(object):
+    """Classify token forms by the first matching regex in a list.
+
+    Equivalent to trying each (name, regex) pair in order with match(),
+    but uses a single regex alternating named groups and memoizes the
+    results for the most frequent forms."""
+
+    def __init__(self, form_res, default='other', cache_size=2**16):
+        self.regex = re.compile('|'.join(
+            '(?P<{}>{})'.format(k, r.pattern) for k, r in form_res), re.U)
+        self.default = default
+        self.classify = lru_cache(maxsize=cache_size)(self._classify)
+
+    def _classify(self, form):
+        m = self.regex.match(form)
+        return self.default if m is None else m.lastgroup
+
+    def __call__(self, form):
+        return self.classify(form)
+
+
+FORM_CLASSIFIER = FormClassifier(FORM_REs)
+
+
 class Example(object):
     def __init__(self, id_, class_, text):
         self.id_ = id_
@@ -77,42 +111,585 @@ def load_examples(fn):
     return examples
 
 
+DOC_ID_COMMENT = '# doc_id = '
+
+DOC_COLLECTION_RE = re.compile(r'^#\s+<doc\s+collection="([^"]+)"\s+url="(.*)">')
+
+DOC_CRAWL_RE = re.compile(r'^#\s+<doc\s+id="([^"]+)"\s.*?\burl="(.*?)"\s+langdiff="([^"]+)"\s*>')
+
+DOC_CRAWL2_RE = re.compile(r'^#\s+<doc\b.*\bfile="([^"]+)".*\burn="<(.*?)>".*>')
+
+DOC_CRAWL3_RE = re.compile(r'^#\s+<doc\b.*\burn="<(.*?)>".*\bfile="([^"]+)".*>')
+
+
 def is_document_boundary(comment):
     return comment.startswith('# doc_id = ') or comment.startswith('# <doc ')
 
 
-def read_conllu(f, fn, stats=None):
+def parse_document_comment(comment):
+    m = DOC_COLLECTION_RE.match(comment)
+    if m:
+        coll, page = m.group(1), m.group(2)
+        if coll == 'wiki':
+            page = urllib.parse.quote(page.replace(' ', '_'))
+        id_ = '{}/{}'.format(coll, page)
+        langdiff = '_'
+        return id_, langdiff
+    m = DOC_CRAWL_RE.match(comment)
+    if m:
+        id_, langdiff = '{}/{}'.format(m.group(1), m.group(2)), m.group(3)
+        return id_, langdiff
+    m = DOC_CRAWL2_RE.match(comment)
+    if m:
+        id_, langdiff = '{}/{}'.format(m.group(1), m.group(2)), '_'
+        return id_, langdiff
+    m = DOC_CRAWL3_RE.match(comment)
+    if m:
+        id_, langdiff = '{}/{}'.format(m.group(2), m.group(1)), '_'
+        return id_, langdiff
+    error('Failed to parse document comment: "{}"'.format(comment))
+    return '<UNKNOWN>', '<UNKNOWN>'
+
+
+def get_document_id(sentences):
+    """Return id from last document boundary comment of document."""
+    id_ = '<UNKNOWN>'
+    for c in (sentences[0][0] if sentences else []):
+        if c.startswith(DOC_ID_COMMENT):
+            id_ = c[len(DOC_ID_COMMENT):]
+        elif is_document_boundary(c):
+            id_, _ = parse_document_comment(c)
+    return id_
+
+
+class LazyWord(object):
+    """CoNLL-U token that splits its line into fields only when accessed.
+
+    Supports the attribute access, indexing and iteration of Word."""
+
+    __slots__ = ('line', '_fields')
+
+    def __init__(self, line):
+        self.line = line
+        self._fields = None
+
+    def fields(self):
+        if self._fields is None:
+            self._fields = self.line.split('\t')
+        return self._fields
+
+    def __getitem__(self, index):
+        return self.fields()[index]
+
+    def __iter__(self):
+        return iter(self.fields())
+
+    def __len__(self):
+        return len(self.fields())
+
+    def __repr__(self):
+        return 'LazyWord({!r})'.format(self.line)
+
+
+def _field_property(index):
+    return property(lambda self: self.fields()[index])
+
+
+for _i, _f in enumerate(CONLLU_FIELDS):
+    setattr(LazyWord, _f, _field_property(_i))
+
+
+class Document(list):
+    """List of (comments, words) sentences, optionally with the original
+    lines of the document as raw_lines (see iter_conllu())."""
+
+    __slots__ = ('raw_lines',)
+
+    def __init__(self, sentences=(), raw_lines=None):
+        super().__init__(sentences)
+        self.raw_lines = raw_lines
+
+
+def prepend_comments(sentences, comments):
+    """Insert comments at the start of document, keeping raw lines."""
+    sentences[0][0][:0] = comments
+    raw_lines = getattr(sentences, 'raw_lines', None)
+    if raw_lines is not None:
+        raw_lines[:0] = [c + '\n' for c in comments]
+
+
+def mark_modified(sentences):
+    """Discard raw lines of document after other changes to it."""
+    if isinstance(sentences, Document):
+        sentences.raw_lines = None
+
+
+def iter_conllu(f, stats=None, lazy=False, report=None,
+                report_interval=100000, raw=False):
+    """Generate documents (lists of (comments, words)) from CoNLL-U lines.
+
+    With lazy=True, tokens are LazyWord instances instead of Word. With
+    raw=True, documents keep their original lines for output without
+    reserialization unless they are not in normalized form (blank lines
+    containing space). If stats is given, counts of lines, sentences,
+    tokens and documents are stored in it. If report is given, it is
+    called with stats every report_interval lines."""
     if stats is None:
         stats = defaultdict(int)
-    documents, sentences, comments, words = [], [], [], []
+    sentences, comments, words = Document(), [], []
+    raw_lines, sentence_end, clean = [], 0, True
+    ln = 0
     for ln, l in enumerate(f, start=1):
+        if raw:
+            raw_lines.append(l)
         l = l.rstrip('\n')
         if not l or l.isspace():
             sentences.append((comments, words))
+            stats['sentences'] += 1
+            stats['tokens'] += len(words)
             comments, words = [], []
+            if raw:
+                sentence_end = len(raw_lines)
+                clean = clean and not l
         elif l.startswith('#'):
             if is_document_boundary(l):
                 if sentences:
-                    documents.append(sentences)
-                sentences = []
+                    stats['lines'] = ln
+                    stats['documents'] += 1
+                    if raw and clean:
+                        sentences.raw_lines = raw_lines[:sentence_end]
+                    yield sentences
+                sentences = Document()
+                if raw:
+                    raw_lines = raw_lines[sentence_end:]
+                    sentence_end, clean = 0, True
             comments.append(l)
+        elif lazy:
+            words.append(LazyWord(l))
         else:
             words.append(Word(*l.split('\t')))
-        if ln % 100000 == 0:
-            print('read {} lines, {} docs from {} ...'.format(
-                    ln, len(documents), fn), file=sys.stderr, flush=True)
+        if report is not None and ln % report_interval == 0:
+            stats['lines'] = ln
+            report(stats)
+    stats['lines'] = ln
     if sentences:
-        documents.append(sentences)
-    return documents
+        stats['documents'] += 1
+        if raw and clean:
+            sentences.raw_lines = raw_lines[:sentence_end]
+        yield sentences
+
+
+def read_conllu(f, fn, stats=None):
+    def report(stats):
+        print('read {} lines, {} docs from {} ...'.format(
+            stats['lines'], stats['documents'], fn),
+              file=sys.stderr, flush=True)
+    return list(iter_conllu(f, stats, report=report))
 
 
 def load_conllu(fn, stats=None):
+    """Load documents from CoNLL-U file or cache (see conllucache.py)."""
+    from conllucache import is_conllu_cache, ConlluCache
+    if is_conllu_cache(fn):
+        documents = ConlluCache(fn)
+        if stats is not None:
+            documents.update_stats(stats)
+        return documents
+    with open_input(fn) as f:
+        return read_conllu(f, fn, stats)
+
+
+# External gzip implementations in order of preference. These run in a
+# separate process, which takes (de)compression off the Python thread.
+GZIP_COMMANDS = ['pigz', 'gzip']
+
+IO_BUFFER_SIZE = 2**20
+
+
+def gzip_command():
+    for command in GZIP_COMMANDS:
+        path = shutil.which(command)
+        if path is not None:
+            return path
+    return None
+
+
+@contextmanager
+def open_input(fn):
+    """Open text file for reading, decompressing .gz in a subprocess
+    if available."""
+    command = gzip_command() if fn.endswith('.gz') else None
     if not fn.endswith('.gz'):
-        with open(fn) as f:
-            return read_conllu(f, fn, stats)
-    else:
+        with open(fn, buffering=IO_BUFFER_SIZE) as f:
+            yield f
+    elif command is None:
         with gzip.open(fn, 'rt') as f:
-            return read_conllu(f, fn, stats)
+            yield f
+    else:
+        p = subprocess.Popen([command, '-dc', fn], stdout=subprocess.PIPE,
+                             bufsize=IO_BUFFER_SIZE)
+        try:
+            yield io.TextIOWrapper(p.stdout)
+            # input not read to end (e.g. --limit) breaks the pipe
+            complete = not p.stdout.read(1)
+        finally:
+            p.stdout.close()
+            p.wait()
+        if complete and p.returncode != 0:
+            raise IOError('{}: {} exited with {}'.format(
+                fn, command, p.returncode))
+
+
+def add_output_arguments(ap):
+    ap.add_argument('-o', '--output', metavar='FILE', default=None,
+                    help='output file, gzipped if .gz (default STDOUT)')
+    ap.add_argument('--compresslevel', default=6, type=int,
+                    help='gzip compression level for .gz output')
+    ap.add_argument('--compress-threads', default=None, type=int,
+                    help='compression threads for .gz output (pigz)')
+
+
+@contextmanager
+def open_output(fn=None, compresslevel=6, threads=None):
+    """Open text file for writing, compressing .gz in a subprocess if
+    available. Yields sys.stdout if fn is None or '-'."""
+    command = gzip_command() if fn and fn.endswith('.gz') else None
+    if fn is None or fn == '-':
+        if sys.stdout.isatty():
+            yield sys.stdout
+            return
+        # write through a larger buffer than the default
+        sys.stdout.flush()
+        raw = io.FileIO(sys.stdout.fileno(), 'w', closefd=False)
+        out = io.TextIOWrapper(io.BufferedWriter(raw, IO_BUFFER_SIZE),
+                               encoding=sys.stdout.encoding,
+                               errors=sys.stdout.errors)
+        try:
+            yield out
+        finally:
+            out.close()
+    elif not fn.endswith('.gz'):
+        with open(fn, 'w', buffering=IO_BUFFER_SIZE) as f:
+            yield f
+    elif command is None:
+        with gzip.open(fn, 'wt', compresslevel=compresslevel) as f:
+            yield f
+    else:
+        args = [command, '-c', '-{}'.format(compresslevel)]
+        if threads is not None and os.path.basename(command) == 'pigz':
+            args.extend(['-p', str(threads)])
+        with open(fn, 'wb') as f:
+            p = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=f,
+                                 bufsize=IO_BUFFER_SIZE)
+            out = io.TextIOWrapper(p.stdin)
+            try:
+                yield out
+            finally:
+                out.close()
+                p.wait()
+        if p.returncode != 0:
+            raise IOError('{}: {} exited with {}'.format(
+                fn, command, p.returncode))
+
+
+@contextmanager
+def atomic_output(fn, compresslevel=6, threads=None):
+    """Open output as open_output(), writing to a temporary file in the
+    same directory that is renamed to fn when closed without error."""
+    directory, base = os.path.split(fn)
+    tmp = os.path.join(directory, '.tmp{}-{}'.format(os.getpid(), base))
+    try:
+        with open_output(tmp, compresslevel, threads) as out:
+            yield out
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, fn)
+
+
+@contextmanager
+def redirect_output(options):
+    """Redirect sys.stdout to the file given with add_output_arguments()."""
+    with open_output(options.output, options.compresslevel,
+                     options.compress_threads) as out:
+        with redirect_stdout(out):
+            yield out
+
+
+# Options that do not affect the output for an input file, ignored when
+# checking whether a file was completed with the same options
+DRIVER_IGNORED_OPTIONS = set([
+    'data', 'file', 'jobs', 'manifest', 'checksum', 'workers', 'batch_size',
+])
+
+MANIFEST_FILENAME = 'MANIFEST.jsonl'
+
+
+def add_driver_arguments(ap, output_dir=True):
+    if output_dir:
+        ap.add_argument('--output-dir', metavar='DIR', default=None,
+                        help='write output for each input file into DIR')
+    ap.add_argument('--jobs', default=None, type=int,
+                    help='number of input files to process in parallel')
+    ap.add_argument('--manifest', metavar='FILE', default=None,
+                    help='record of completed input files (default {} in'
+                    ' output directory)'.format(MANIFEST_FILENAME))
+    ap.add_argument('--checksum', default=False, action='store_true',
+                    help='record file checksums in manifest, compare'
+                    ' output checksums and input checksums when'
+                    ' modification time differs (default size and time'
+                    ' only)')
+
+
+def check_driver_arguments(ap, args):
+    """Report --workers with --jobs > 1 with ap.error(), as run_files()
+    worker processes cannot start worker processes of their own."""
+    if (getattr(args, 'workers', None) and args.jobs is not None and
+            args.jobs > 1):
+        ap.error('--workers cannot be used with --jobs > 1')
+
+
+def file_checksum(fn):
+    md5 = hashlib.md5()
+    with open(fn, 'rb') as f:
+        for block in iter(lambda: f.read(IO_BUFFER_SIZE), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def options_checksum(options):
+    values = sorted((k, v) for k, v in vars(options).items()
+                    if k not in DRIVER_IGNORED_OPTIONS)
+    return hashlib.md5(repr(values).encode('utf-8')).hexdigest()
+
+
+def load_manifest(fn):
+    """Return {input: record} for completed files in manifest."""
+    records = {}
+    if not os.path.exists(fn):
+        return records
+    with open(fn) as f:
+        for l in f:
+            try:
+                record = json.loads(l)
+            except ValueError:
+                continue    # partially written by killed job
+            records[record['input']] = record
+    return records
+
+
+def is_completed(fn, record, options_md5, checksum=False):
+    if record is None or record['options'] != options_md5:
+        return False
+    for ofn, (size, md5) in record['outputs'].items():
+        if not os.path.exists(ofn) or os.path.getsize(ofn) != size:
+            return False
+        elif checksum and md5 is not None and file_checksum(ofn) != md5:
+            return False
+    stat = os.stat(fn)
+    if stat.st_size != record['size']:
+        return False
+    elif stat.st_mtime == record['mtime']:
+        return True
+    elif checksum and record.get('md5') is not None:
+        return file_checksum(fn) == record['md5']
+    else:
+        return False
+
+
+_driver_state = {}
+
+
+def init_driver(process, args, output_filenames, options):
+    _driver_state['process'] = process
+    _driver_state['args'] = args
+    _driver_state['output_filenames'] = output_filenames
+    _driver_state['options'] = options
+
+
+def driver_outputs(fn, options, output_filenames, args):
+    """Return names of files written by run_file() for input fn."""
+    if output_filenames is None:
+        return [os.path.join(options.output_dir, os.path.basename(fn))]
+    else:
+        return output_filenames(fn, *args)
+
+
+def check_outputs(filenames, options, output_filenames, args):
+    """Return error message if outputs of two inputs are the same file or
+    an output is an input, None otherwise."""
+    inputs = { os.path.realpath(fn): fn for fn in filenames }
+    if len(inputs) != len(filenames):
+        return 'input given more than once'
+    written = {}
+    for fn in filenames:
+        for ofn in driver_outputs(fn, options, output_filenames, args):
+            path = os.path.realpath(ofn)
+            if path in inputs:
+                return 'output {} would overwrite input {}'.format(
+                    ofn, inputs[path])
+            elif path in written:
+                return 'inputs {} and {} have the same output {}'.format(
+                    written[path], fn, ofn)
+            written[path] = fn
+    return None
+
+
+def run_file(fn):
+    """Process one input file, return (fn, manifest record or None,
+    error message or None)."""
+    process, args = _driver_state['process'], _driver_state['args']
+    output_filenames = _driver_state['output_filenames']
+    options = _driver_state['options']
+    print('processing {} ...'.format(os.path.basename(fn)),
+          file=sys.stderr, flush=True)
+    try:
+        outputs = driver_outputs(fn, options, output_filenames, args)
+        if output_filenames is None:
+            with ExitStack() as stack:
+                out = stack.enter_context(atomic_output(
+                    outputs[0], getattr(options, 'compresslevel', 6),
+                    getattr(options, 'compress_threads', None)))
+                stack.enter_context(redirect_stdout(out))
+                process(fn, *args)
+        else:
+            process(fn, *args)
+        checksum = file_checksum if options.checksum else lambda fn: None
+        stat = os.stat(fn)
+        record = {
+            'input': os.path.abspath(fn),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'md5': checksum(fn),
+            'options': options_checksum(options),
+            'outputs': {
+                os.path.abspath(o): (os.path.getsize(o), checksum(o))
+                for o in outputs
+            },
+        }
+    except Exception:
+        return fn, None, traceback.format_exc().rstrip()
+    print('completed {}.'.format(os.path.basename(fn)),
+          file=sys.stderr, flush=True)
+    return fn, record, None
+
+
+def run_files(process, filenames, options, args=(), output_filenames=None,
+              manifest=None):
+    """Run process(fn, *args) for each input file, largest first, in
+    --jobs worker processes, and return exit status.
+
+    If output_filenames is None, standard output of process is written
+    to a file named as the input in --output-dir. Otherwise process
+    writes the files output_filenames(fn, *args) itself, which should be
+    opened with atomic_output(). Completed inputs are recorded in the
+    manifest, and skipped when rerun if their size and modification time
+    (or checksum, with --checksum) are unchanged."""
+    error_message = check_outputs(filenames, options, output_filenames, args)
+    if error_message is not None:
+        error(error_message)
+        return 1
+    if manifest is None:
+        manifest = options.manifest
+    if manifest is None:
+        manifest = os.path.join(options.output_dir, MANIFEST_FILENAME)
+    if output_filenames is None:
+        os.makedirs(options.output_dir, exist_ok=True)
+    options_md5 = options_checksum(options)
+    completed = load_manifest(manifest)
+    todo = []
+    for fn in filenames:
+        record = completed.get(os.path.abspath(fn))
+        if is_completed(fn, record, options_md5, options.checksum):
+            print('skipping {} (completed)'.format(os.path.basename(fn)),
+                  file=sys.stderr, flush=True)
+        else:
+            todo.append(fn)
+    todo.sort(key=os.path.getsize, reverse=True)
+    initargs = (process, args, output_filenames, options)
+    failed = 0
+    with ExitStack() as stack:
+        if not options.jobs or options.jobs < 2:
+            init_driver(*initargs)
+            results = map(run_file, todo)
+        else:
+            from multiprocessing import Pool
+            pool = stack.enter_context(
+                Pool(options.jobs, init_driver, initargs))
+            results = pool.imap_unordered(run_file, todo)
+        with open(manifest, 'a') as f:
+            for fn, record, error_message in results:
+                # --dedup filters are only used without worker processes
+                if record is None:
+                    discard_bloom_filters()
+                    error('failed {}:\n{}'.format(fn, error_message))
+                    failed += 1
+                    continue
+                print(json.dumps(record, sort_keys=True), file=f, flush=True)
+                os.fsync(f.fileno())
+                commit_bloom_filters()
+    print('completed {}/{} files ({} skipped, {} failed)'.format(
+        len(todo)-failed, len(todo), len(filenames)-len(todo), failed),
+          file=sys.stderr, flush=True)
+    return 1 if failed else 0
+
+
+def format_document(sentences, comments=()):
+    """Return document as CoNLL-U text, reusing original lines where
+    available, with optional comments prepended."""
+    raw_lines = getattr(sentences, 'raw_lines', None)
+    if raw_lines is not None:
+        return ''.join(c + '\n' for c in comments) + ''.join(raw_lines)
+    lines = list(comments)
+    for sentence_comments, words in sentences:
+        lines.extend(sentence_comments)
+        for w in words:
+            if type(w) is LazyWord:
+                lines.append(w.line)
+            else:
+                lines.append('\t'.join(w))
+        lines.append('')
+    if not lines:
+        return ''
+    lines.append('')
+    return '\n'.join(lines)
+
+
+def print_document(sentences, out=None, comments=()):
+    if out is None:
+        out = sys.stdout
+    out.write(format_document(sentences, comments))
+
+
+def batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def parallel_map(func, items, workers, initializer=None, initargs=(),
+                 max_pending=None):
+    """Map func over items in worker processes, yielding results in order.
+
+    At most max_pending items (default 2*workers) are submitted ahead of
+    the results, so items are only read as fast as they are consumed."""
+    from multiprocessing import Pool
+    if max_pending is None:
+        max_pending = 2 * workers
+    pending = deque()
+    with Pool(workers, initializer, initargs) as pool:
+        for item in items:
+            pending.append(pool.apply_async(func, (item,)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
 
 
 def featurize_document(document):
@@ -125,12 +702,7 @@ def featurize_document(document):
             if w.feats != '_':
                 for f in w.feats.split('|'):
                     w_stats['feat-{}'.format(f)] += 1
-            for k, r in FORM_REs:
-                if r.match(w.form):
-                    w_stats['form-{}'.format(k)] += 1
-                    break
-            else:
-                w_stats['form-other'] += 1
+            w_stats['form-{}'.format(form_class(w.form))] += 1
             w_total += 1
     for k, v in w_stats.items():
         w_stats[k] = v/w_total
@@ -141,16 +713,461 @@ def featurize_documents(documents):
     return [featurize_document(d) for d in documents]
 
 
-def save_model(fn, clf, vecf):
+def form_class(form):
+    return FORM_CLASSIFIER(form)
+
+
+class DelexFeaturizer(object):
+    """Delexicalized features as DictVectorizer columns.
+
+    Gives the same values as DictVectorizer.transform() applied to the
+    output of featurize_documents(), but maps token attributes directly
+    to column indices and returns scipy.sparse CSR matrices. If
+    vocabulary (feature name to column) is not given, it is learned by
+    fit_transform()."""
+
+    def __init__(self, vocabulary=None):
+        self.vocabulary = {} if vocabulary is None else vocabulary
+        self.fitting = False
+        self._clear_caches()
+
+    def _clear_caches(self):
+        # attribute value (form class for form) to column, -1 for
+        # features not in vocabulary
+        self.upos, self.dep, self.len, self.form = {}, {}, {}, {}
+        # feats value to list of columns
+        self.feats = {}
+
+    def column(self, name):
+        column = self.vocabulary.get(name)
+        if column is None:
+            if not self.fitting:
+                return -1
+            column = self.vocabulary[name] = len(self.vocabulary)
+        return column
+
+    def transform_document(self, document):
+        """Return (columns, values) for document, columns in sorted order."""
+        import numpy as np
+        columns, total = [], 0
+        upos, dep, len_, form, feats = (self.upos, self.dep, self.len,
+                                        self.form, self.feats)
+        for comments, words in document:
+            for w in words:
+                c = upos.get(w.upos)
+                if c is None:
+                    c = upos[w.upos] = self.column('upos-{}'.format(w.upos))
+                columns.append(c)
+                c = dep.get(w.deprel)
+                if c is None:
+                    c = dep[w.deprel] = self.column('dep-{}'.format(w.deprel))
+                columns.append(c)
+                n = len(w.form)
+                c = len_.get(n)
+                if c is None:
+                    c = len_[n] = self.column('len-{}'.format(n))
+                columns.append(c)
+                cs = feats.get(w.feats)
+                if cs is None:
+                    if w.feats == '_':
+                        cs = []
+                    else:
+                        cs = [self.column('feat-{}'.format(f))
+                              for f in w.feats.split('|')]
+                    feats[w.feats] = cs
+                columns.extend(cs)
+                k = form_class(w.form)
+                c = form.get(k)
+                if c is None:
+                    c = form[k] = self.column('form-{}'.format(k))
+                columns.append(c)
+                total += 1
+        columns = np.array(columns, dtype=np.int32)
+        columns, counts = np.unique(columns[columns >= 0], return_counts=True)
+        return columns, counts / total if total else counts.astype(float)
+
+    def transform(self, documents):
+        import numpy as np
+        import scipy.sparse as sp
+        from conllucache import ConlluCache
+        if isinstance(documents, ConlluCache):
+            return self.transform_cache(documents)
+        indptr, indices, data = [0], [], []
+        for document in documents:
+            columns, values = self.transform_document(document)
+            indices.append(columns)
+            data.append(values)
+            indptr.append(indptr[-1] + len(columns))
+        if not indices:
+            indices, data = [np.zeros(0, dtype=np.int32)], [np.zeros(0)]
+        return sp.csr_matrix(
+            (np.concatenate(data), np.concatenate(indices), indptr),
+            shape=(len(indptr)-1, len(self.vocabulary)))
+
+    def value_columns(self, cache_part):
+        """Return arrays mapping vocabulary ids of a cache part to columns
+        for upos, deprel, len and form class, and to lists of columns for
+        feats as (columns, starts, counts)."""
+        import numpy as np
+        def columns(values, name):
+            return np.array([self.column(name.format(v)) for v in values],
+                            dtype=np.int64)
+        forms = cache_part.vocabulary('form')
+        feats, starts, counts = [], [], []
+        for v in cache_part.vocabulary('feats'):
+            cs = [] if v == '_' else [
+                self.column('feat-{}'.format(f)) for f in v.split('|')
+            ]
+            starts.append(len(feats))
+            counts.append(len(cs))
+            feats.extend(cs)
+        return (
+            columns(cache_part.vocabulary('upos'), 'upos-{}'),
+            columns(cache_part.vocabulary('deprel'), 'dep-{}'),
+            columns((len(f) for f in forms), 'len-{}'),
+            columns((form_class(f) for f in forms), 'form-{}'),
+            (np.array(feats, dtype=np.int64), np.array(starts, dtype=np.int64),
+             np.array(counts, dtype=np.int64)),
+        )
+
+    def transform_cache(self, cache):
+        """Return transform() of documents in ConlluCache, computing
+        columns once per distinct attribute value."""
+        import numpy as np
+        import scipy.sparse as sp
+        rows, columns, totals = [], [], []
+        offset = 0
+        for part in cache.parts:
+            upos, dep, len_, form, feats = self.value_columns(part)
+            doc_tokens = part.document_tokens()
+            token_doc = np.repeat(np.arange(len(part)) + offset,
+                                  np.diff(doc_tokens))
+            form_ids = part.column('form')
+            rows.extend([token_doc] * 4)
+            columns.extend([
+                upos[part.column('upos')],
+                dep[part.column('deprel')],
+                len_[form_ids],
+                form[form_ids],
+            ])
+            feat_cols, feat_starts, feat_counts = feats
+            feat_ids = part.column('feats')
+            n = feat_counts[feat_ids]
+            index = np.repeat(feat_starts[feat_ids] - (np.cumsum(n) - n), n)
+            index += np.arange(len(index))
+            rows.append(np.repeat(token_doc, n))
+            columns.append(feat_cols[index])
+            totals.append(np.diff(doc_tokens))
+            offset += len(part)
+        if not rows:
+            rows, columns, totals = [np.zeros(0, dtype=np.int64)] * 3
+        rows, columns = np.concatenate(rows), np.concatenate(columns)
+        mask = columns >= 0
+        rows, columns = rows[mask], columns[mask]
+        X = sp.csr_matrix(
+            (np.ones(len(rows)), (rows, columns)),
+            shape=(offset, len(self.vocabulary)))
+        X.sum_duplicates()
+        X.sort_indices()
+        totals = np.concatenate(totals)
+        X.data /= np.repeat(totals, np.diff(X.indptr))
+        return X
+
+    def fit_transform(self, documents):
+        import numpy as np
+        self.vocabulary, self.fitting = {}, True
+        self._clear_caches()
+        try:
+            X = self.transform(documents)
+        finally:
+            self.fitting = False
+            self._clear_caches()
+        # sort features by name as DictVectorizer does
+        names = sorted(self.vocabulary)
+        map_index = np.zeros(len(names), dtype=np.int32)
+        for i, name in enumerate(names):
+            map_index[self.vocabulary[name]] = i
+        self.vocabulary = { name: i for i, name in enumerate(names) }
+        X.indices = map_index[X.indices]
+        X.has_sorted_indices = False
+        X.sort_indices()
+        return X
+
+    def dict_vectorizer(self):
+        """Return DictVectorizer fitted with this vocabulary."""
+        from sklearn.feature_extraction import DictVectorizer
+        vecf = DictVectorizer()
+        vecf.vocabulary_ = dict(self.vocabulary)
+        vecf.feature_names_ = sorted(self.vocabulary, key=self.vocabulary.get)
+        return vecf
+
+
+def save_model(fn, clf, vecf, compiled=False):
     with open('{}.clf'.format(fn), 'wb') as f:
         pickle.dump(clf, f)
     with open('{}.vecf'.format(fn), 'wb') as f:
         pickle.dump(vecf, f)
+    if compiled:
+        # also save memory-mappable model (see compiledmodel.py)
+        from compiledmodel import save_compiled_model, compiled_filename
+        save_compiled_model(compiled_filename(fn), clf, vecf)
 
 
-def load_model(fn):
+def load_model(fn, compiled=False):
+    if compiled:
+        from compiledmodel import load_compiled_model, compiled_filename
+        return load_compiled_model(compiled_filename(fn))
     with open('{}.clf'.format(fn), 'rb') as f:
         clf = pickle.load(f)
     with open('{}.vecf'.format(fn), 'rb') as f:
         vecf = pickle.load(f)
     return clf, vecf
+
+
+ARRAYS_MAGIC = b'DFARRAYS'
+
+ARRAYS_ALIGN = 64
+
+
+def _aligned(offset):
+    return (offset + ARRAYS_ALIGN - 1) // ARRAYS_ALIGN * ARRAYS_ALIGN
+
+
+def save_arrays(fn, arrays, meta=None):
+    """Save dict of NumPy arrays and JSON-serializable meta in one file.
+
+    The arrays are stored uncompressed and aligned so that load_arrays()
+    can memory-map them."""
+    import numpy as np
+    arrays = { k: np.ascontiguousarray(a) for k, a in arrays.items() }
+    layout, offset = {}, 0
+    for k, a in arrays.items():
+        layout[k] = {
+            'dtype': a.dtype.str,
+            'shape': list(a.shape),
+            'offset': offset,
+        }
+        offset = _aligned(offset + a.nbytes)
+    header = json.dumps({ 'meta': meta, 'arrays': layout }, sort_keys=True)
+    header = header.encode('utf-8')
+    start = _aligned(len(ARRAYS_MAGIC) + 8 + len(header))
+    with open(fn, 'wb') as f:
+        f.write(ARRAYS_MAGIC)
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(header)
+        for k, a in arrays.items():
+            f.write(b'\0' * (start + layout[k]['offset'] - f.tell()))
+            f.write(a.tobytes())
+
+
+def _read_arrays_header(f, fn):
+    # Return (header, start of array data) from file saved by save_arrays()
+    if f.read(len(ARRAYS_MAGIC)) != ARRAYS_MAGIC:
+        raise ValueError('{}: not an arrays file'.format(fn))
+    header_len = int.from_bytes(f.read(8), 'little')
+    header = json.loads(f.read(header_len).decode('utf-8'))
+    return header, _aligned(len(ARRAYS_MAGIC) + 8 + header_len)
+
+
+def load_arrays_meta(fn):
+    """Return meta saved with save_arrays() without loading the arrays."""
+    with open(fn, 'rb') as f:
+        return _read_arrays_header(f, fn)[0]['meta']
+
+
+def load_arrays(fn, mmap=True):
+    """Load arrays and meta saved with save_arrays().
+
+    With mmap=True, the arrays are read-only views of a shared memory
+    map of the file, so processes loading the same file share memory."""
+    import numpy as np
+    with open(fn, 'rb') as f:
+        header, start = _read_arrays_header(f, fn)
+        if mmap:
+            import mmap as mmap_
+            buf = mmap_.mmap(f.fileno(), 0, access=mmap_.ACCESS_READ)
+        else:
+            f.seek(0)
+            buf = f.read()
+    arrays = {}
+    for k, info in header['arrays'].items():
+        dtype = np.dtype(info['dtype'])
+        count = int(np.prod(info['shape'], dtype=np.int64))
+        if count == 0:
+            arrays[k] = np.empty(info['shape'], dtype)
+        else:
+            a = np.frombuffer(buf, dtype, count, start + info['offset'])
+            arrays[k] = a.reshape(info['shape'])
+    return arrays, header['meta']
+
+
+BLOOM_MAGIC = b'DFBLOOM1'
+
+BLOOM_HEADER_SIZE = 32    # magic, bits, hashes, count
+
+
+class BloomFilter(object):
+    """Bloom filter of strings in a memory-mapped file.
+
+    The file is created with the given number of bits and hash functions
+    if it does not exist, and otherwise the filter is resumed from it
+    (ignoring bits and hashes), so that consecutive runs can share it.
+
+    Strings added with add_pending() are only written into the filter by
+    commit(), so that the strings of a failed input can be discarded."""
+
+    def __init__(self, fn, bits=2**32, hashes=7):
+        import mmap
+        import struct
+        if not os.path.exists(fn):
+            with open(fn, 'wb') as f:
+                f.write(struct.pack('<8sQQQ', BLOOM_MAGIC, bits, hashes, 0))
+                f.truncate(BLOOM_HEADER_SIZE + (bits+7)//8)
+        self.file = open(fn, 'r+b')
+        magic, self.bits, self.hashes, self.count = struct.unpack(
+            '<8sQQQ', self.file.read(BLOOM_HEADER_SIZE))
+        if magic != BLOOM_MAGIC:
+            raise ValueError('{} is not a Bloom filter file'.format(fn))
+        self.mmap = mmap.mmap(self.file.fileno(), 0)
+        self.pending = set()
+
+    def positions(self, digest):
+        # double hashing with two 64-bit halves of MD5
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i*h2) % self.bits for i in range(self.hashes)]
+
+    def _add_digest(self, digest):
+        present = True
+        for p in self.positions(digest):
+            i, mask = BLOOM_HEADER_SIZE + (p >> 3), 1 << (p & 7)
+            byte = self.mmap[i]
+            if not byte & mask:
+                present = False
+                self.mmap[i] = byte | mask
+        if not present:
+            self.count += 1
+        return present
+
+    def _contains_digest(self, digest):
+        return all(
+            self.mmap[BLOOM_HEADER_SIZE + (p >> 3)] & (1 << (p & 7))
+            for p in self.positions(digest)
+        )
+
+    def add(self, string):
+        """Add string, return True if it was (probably) already added."""
+        return self._add_digest(hashlib.md5(string.encode('utf-8')).digest())
+
+    def add_pending(self, string):
+        """Add string to pending strings, return True if it was (probably)
+        already added to the filter or the pending strings."""
+        digest = hashlib.md5(string.encode('utf-8')).digest()
+        if digest in self.pending or self._contains_digest(digest):
+            return True
+        self.pending.add(digest)
+        return False
+
+    def commit(self):
+        """Add pending strings to the filter."""
+        for digest in self.pending:
+            self._add_digest(digest)
+        self.pending = set()
+
+    def discard(self):
+        """Forget pending strings."""
+        self.pending = set()
+
+    def __contains__(self, string):
+        return self._contains_digest(
+            hashlib.md5(string.encode('utf-8')).digest())
+
+    def false_positive_rate(self):
+        from math import exp
+        return (1 - exp(-self.hashes * self.count / self.bits)) ** self.hashes
+
+    def close(self):
+        import struct
+        self.mmap[:BLOOM_HEADER_SIZE] = struct.pack(
+            '<8sQQQ', BLOOM_MAGIC, self.bits, self.hashes, self.count)
+        self.mmap.flush()
+        self.mmap.close()
+        self.file.close()
+
+
+def add_dedup_arguments(ap):
+    ap.add_argument('--dedup', default=None, metavar='FILE',
+                    help='drop sentences seen before, saving state in FILE')
+    ap.add_argument('--dedup-bits', default=2**32, type=int,
+                    help='Bloom filter size in bits when creating FILE')
+    ap.add_argument('--dedup-hashes', default=7, type=int,
+                    help='Bloom filter hash functions when creating FILE')
+
+
+def check_dedup_arguments(ap, args, jobs):
+    """Report --dedup with files processed in parallel with ap.error().
+
+    The processes would update the Bloom filter file concurrently."""
+    if args.dedup is not None and jobs is not None and jobs > 1:
+        ap.error('--dedup cannot be used with --jobs > 1')
+
+
+def normalize_space(text):
+    return ' '.join(text.split())
+
+
+_bloom_filters = {}
+
+
+def open_bloom_filter(fn, bits, hashes):
+    """Return BloomFilter for fn, opened once per process. Scripts using
+    --dedup close the filters with close_bloom_filters()."""
+    if fn not in _bloom_filters:
+        _bloom_filters[fn] = BloomFilter(fn, bits, hashes)
+        _bloom_filters[fn].dropped = 0
+    return _bloom_filters[fn]
+
+
+def commit_bloom_filters():
+    """Add sentences of the current input to the Bloom filters once its
+    output is complete."""
+    for bloom_filter in _bloom_filters.values():
+        bloom_filter.commit()
+
+
+def discard_bloom_filters():
+    """Forget sentences of the current input, e.g. after it failed, so
+    that they are not dropped when it is processed again."""
+    for bloom_filter in _bloom_filters.values():
+        bloom_filter.discard()
+
+
+def close_bloom_filter(fn):
+    bloom_filter = _bloom_filters.pop(fn)
+    bloom_filter.commit()
+    print('{}: dropped {} seen sentences, {} in filter (est. false positive'
+          ' rate {:.2%})'.format(fn, bloom_filter.dropped, bloom_filter.count,
+                                 bloom_filter.false_positive_rate()),
+          file=sys.stderr, flush=True)
+    bloom_filter.close()
+
+
+def close_bloom_filters():
+    """Close Bloom filters opened by drop_seen_sentences()."""
+    for fn in list(_bloom_filters):
+        close_bloom_filter(fn)
+
+
+def drop_seen_sentences(sentences, options):
+    """Return sentences not seen before, as given by options.dedup.
+
+    The sentences are added to the filter by commit_bloom_filters() or
+    when the filter is closed."""
+    if options.dedup is None:
+        return sentences
+    seen = open_bloom_filter(options.dedup, options.dedup_bits,
+                             options.dedup_hashes)
+    unseen = [s for s in sentences
+              if not seen.add_pending(normalize_space(s))]
+    seen.dropped += len(sentences) - len(unseen)
+    return unseen
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+
+# Compile a TfidfVectorizer or DictVectorizer + LinearSVC model into a
+# memory-mappable feature weight table for prediction without sklearn.
+# Processes loading the same compiled model share its pages through the
+# OS page cache instead of each holding a private unpickled copy.
+
+import sys
+import re
+
+import numpy as np
+
+from functools import lru_cache
+from hashlib import md5
+from logging import warning
+
+from common import load_model, save_arrays, load_arrays
+
+
+# Odd 64-bit constant for combining token hashes into n-gram hashes
+NGRAM_HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+
+HASH_MASK = 2**64-1
+
+
+def argparser():
+    from argparse import ArgumentParser
+    ap = ArgumentParser(description='Compile model for fast prediction')
+    ap.add_argument('model', help='model saved with save_model()')
+    ap.add_argument('output', nargs='?', default=None,
+                    help='output file (default MODEL.compiled)')
+    return ap
+
+
+def compiled_filename(fn):
+    return '{}.compiled'.format(fn)
+
+
+@lru_cache(maxsize=2**20)
+def token_hash(token):
+    return int.from_bytes(md5(token.encode('utf-8')).digest()[:8], 'little')
+
+
+def feature_hash(feature):
+    # hash of n-gram feature as joined by sklearn (tokens separated by ' ')
+    tokens = feature.split(' ')
+    h = token_hash(tokens[0])
+    for t in tokens[1:]:
+        h = (h * NGRAM_HASH_MULTIPLIER + token_hash(t)) & HASH_MASK
+    return h
+
+
+def ngram_hashes(tokens, ngram_range):
+    # equivalent to feature_hash() for all n-grams in ngram_range
+    min_n, max_n = ngram_range
+    h = np.fromiter((token_hash(t) for t in tokens), dtype=np.uint64,
+                    count=len(tokens))
+    multiplier = np.uint64(NGRAM_HASH_MULTIPLIER)
+    hashes, k = [], h
+    for n in range(1, max_n+1):
+        if n > 1:
+            k = k[:-1] * multiplier + h[n-1:]
+        if n >= min_n:
+            hashes.append(k)
+    return np.concatenate(hashes)
+
+
+def check_supported(clf, vecf):
+    if clf.__class__.__name__ != 'LinearSVC':
+        raise NotImplementedError('{}'.format(clf.__class__.__name__))
+    if vecf.__class__.__name__ == 'DictVectorizer':
+        if vecf.dtype not in (np.float64, float):
+            raise NotImplementedError('dtype {}'.format(vecf.dtype))
+        return
+    if vecf.__class__.__name__ != 'TfidfVectorizer':
+        raise NotImplementedError('{}'.format(vecf.__class__.__name__))
+    if (vecf.analyzer != 'word' or vecf.preprocessor is not None or
+        vecf.tokenizer is not None or vecf.stop_words is not None or
+        vecf.strip_accents is not None):
+        raise NotImplementedError('only word n-grams with token_pattern')
+    if vecf.dtype not in (np.float64, float):
+        raise NotImplementedError('dtype {}'.format(vecf.dtype))
+    if vecf.norm not in ('l1', 'l2', None):
+        raise NotImplementedError('norm {}'.format(vecf.norm))
+
+
+def column_order(vecf):
+    # Order of columns in transformed rows, which determines the order
+    # in which sklearn sums values. This depends on the sklearn version,
+    # so check it by transforming a probe input.
+    features = sorted(vecf.vocabulary_)[:10]
+    if vecf.__class__.__name__ == 'DictVectorizer':
+        features.sort(key=lambda f: -vecf.vocabulary_[f])
+        X = vecf.transform([{ f: 1 for f in features }])
+    else:
+        X = vecf.transform([' . '.join(features)])
+    diffs = np.diff(X.indices)
+    if len(diffs) == 0:
+        return 'ascending'
+    elif np.all(diffs > 0):
+        return 'ascending'
+    elif np.all(diffs < 0):
+        return 'descending'
+    else:
+        warning('failed to determine column order, predictions may differ')
+        return 'ascending'
+
+
+def compile_model(clf, vecf):
+    """Return arrays and meta for model with rows in feature hash order."""
+    check_supported(clf, vecf)
+    vocabulary = vecf.vocabulary_
+    if vecf.__class__.__name__ == 'DictVectorizer':
+        hash_ = token_hash
+    else:
+        hash_ = feature_hash
+    keys = np.zeros(len(vocabulary), dtype=np.uint64)
+    columns = np.zeros(len(vocabulary), dtype=np.int64)
+    for i, (feature, column) in enumerate(vocabulary.items()):
+        keys[i] = hash_(feature)
+        columns[i] = column
+    order = np.argsort(keys, kind='mergesort')
+    keys, columns = keys[order], columns[order]
+    if np.any(keys[1:] == keys[:-1]):
+        raise ValueError('feature hash collision')
+    arrays = {
+        'keys': keys,
+        'columns': columns,
+        'coef': clf.coef_[:, columns],
+        'intercept': clf.intercept_,
+    }
+    meta = {
+        'classes': clf.classes_.tolist(),
+    }
+    if vecf.__class__.__name__ == 'DictVectorizer':
+        meta.update({
+            'vectorizer': 'dict',
+            'separator': vecf.separator,
+            'features': sorted(vocabulary, key=vocabulary.get),
+            'column_order': column_order(vecf),
+        })
+        return arrays, meta
+    if vecf.use_idf:
+        arrays['idf'] = vecf.idf_[columns]
+    else:
+        arrays['idf'] = np.ones(len(columns))
+    meta.update({
+        'vectorizer': 'tfidf',
+        'token_pattern': vecf.token_pattern,
+        'lowercase': vecf.lowercase,
+        'ngram_range': list(vecf.ngram_range),
+        'binary': vecf.binary,
+        'sublinear_tf': vecf.sublinear_tf,
+        'norm': vecf.norm,
+        'column_order': column_order(vecf),
+    })
+    return arrays, meta
+
+
+def lookup(keys, hashes):
+    # indices of hashes found in keys and mask of found hashes
+    if not len(keys):
+        return np.zeros(0, dtype=np.int64), np.zeros(len(hashes), dtype=bool)
+    found = np.searchsorted(keys, hashes)
+    found[found == len(keys)] = 0
+    mask = keys[found] == hashes
+    return found[mask], mask
+
+
+class CompiledVectorizer(object):
+    """Replacement for TfidfVectorizer.transform() using compiled model.
+
+    Rows of the returned "matrix" are (indices, values) pairs, where
+    indices are into the compiled arrays and values are the tf-idf
+    values in the order of the feature columns of the transformed rows
+    of the original model, so that the values are summed in the same
+    order as by sklearn and predictions are identical."""
+
+    def __init__(self, arrays, meta):
+        self.keys = arrays['keys']
+        self.columns = arrays['columns']
+        self.idf = arrays['idf']
+        self.token_re = re.compile(meta['token_pattern'])
+        self.lowercase = meta['lowercase']
+        self.ngram_range = tuple(meta['ngram_range'])
+        self.binary = meta['binary']
+        self.sublinear_tf = meta['sublinear_tf']
+        self.norm = meta['norm']
+        self.descending = meta['column_order'] == 'descending'
+
+    def transform_document(self, text):
+        if self.lowercase:
+            text = text.lower()
+        tokens = self.token_re.findall(text)
+        if not tokens:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        found, _ = lookup(self.keys, ngram_hashes(tokens, self.ngram_range))
+        indices, counts = np.unique(found, return_counts=True)
+        order = np.argsort(self.columns[indices], kind='mergesort')
+        if self.descending:
+            order = order[::-1]
+        indices, counts = indices[order], counts[order]
+        if self.binary:
+            values = np.ones(len(indices))
+        else:
+            values = counts.astype(np.float64)
+        if self.sublinear_tf:
+            values = np.log(values) + 1
+        values = values * self.idf[indices]
+        if self.norm == 'l2' and len(values):
+            norm = np.cumsum(values * values)[-1]
+            if norm != 0:
+                values = values / np.sqrt(norm)
+        elif self.norm == 'l1' and len(values):
+            norm = np.cumsum(np.abs(values))[-1]
+            if norm != 0:
+                values = values / norm
+        return indices, values
+
+    def transform(self, texts):
+        return [self.transform_document(t) for t in texts]
+
+
+class CompiledDictVectorizer(object):
+    """Replacement for DictVectorizer.transform() using compiled model.
+
+    Rows are (indices, values) pairs as for CompiledVectorizer. Also
+    accepts a matrix with the original feature columns, given by
+    vocabulary_, as created by common.DelexFeaturizer."""
+
+    def __init__(self, arrays, meta):
+        self.keys = arrays['keys']
+        self.columns = arrays['columns']
+        self.index = np.argsort(self.columns)    # column to index
+        self.separator = meta['separator']
+        self.vocabulary_ = { f: i for i, f in enumerate(meta['features']) }
+        self.descending = meta['column_order'] == 'descending'
+
+    def transform_document(self, features):
+        names, values = [], []
+        for f, v in features.items():
+            if isinstance(v, str):
+                f, v = '{}{}{}'.format(f, self.separator, v), 1
+            names.append(f)
+            values.append(v)
+        hashes = np.fromiter((token_hash(f) for f in names), dtype=np.uint64,
+                             count=len(names))
+        found, mask = lookup(self.keys, hashes)
+        values = np.array(values, dtype=np.float64)[mask]
+        return self.ordered(self.columns[found], values)
+
+    def ordered(self, columns, values):
+        order = np.argsort(columns, kind='mergesort')
+        if self.descending:
+            order = order[::-1]
+        return self.index[columns[order]], values[order]
+
+    def transform(self, X):
+        if hasattr(X, 'indptr'):
+            # CSR matrix with original columns
+            return [
+                self.ordered(X.indices[s:e], X.data[s:e])
+                for s, e in zip(X.indptr[:-1], X.indptr[1:])
+            ]
+        return [self.transform_document(f) for f in X]
+
+
+class CompiledClassifier(object):
+    """Replacement for LinearSVC.decision_function() using compiled model."""
+
+    def __init__(self, arrays, meta):
+        self.coef = arrays['coef']
+        self.intercept = arrays['intercept']
+        self.classes_ = np.array(meta['classes'])
+
+    def decision_function(self, X):
+        scores = np.empty((len(X), len(self.intercept)))
+        for i, (indices, values) in enumerate(X):
+            if len(indices):
+                products = values[:, np.newaxis] * self.coef[:, indices].T
+                scores[i] = np.cumsum(products, axis=0)[-1] + self.intercept
+            else:
+                scores[i] = 0.0 + self.intercept
+        if scores.shape[1] == 1:
+            return scores.ravel()
+        else:
+            return scores
+
+    def predict(self, X):
+        scores = self.decision_function(X)
+        if scores.ndim == 1:
+            return self.classes_[(scores > 0).astype(int)]
+        else:
+            return self.classes_[scores.argmax(axis=1)]
+
+
+def save_compiled_model(fn, clf, vecf):
+    arrays, meta = compile_model(clf, vecf)
+    save_arrays(fn, arrays, meta)
+
+
+def load_compiled_model(fn):
+    arrays, meta = load_arrays(fn)
+    if meta['vectorizer'] == 'dict':
+        vecf = CompiledDictVectorizer(arrays, meta)
+    else:
+        vecf = CompiledVectorizer(arrays, meta)
+    return CompiledClassifier(arrays, meta), vecf
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+    output = args.output
+    if output is None:
+        output = compiled_filename(args.model)
+    print('loading model from {} ...'.format(args.model),
+          file=sys.stderr, flush=True)
+    clf, vecf = load_model(args.model)
+    save_compiled_model(output, clf, vecf)
+    print('saved compiled model to {}.'.format(output),
+          file=sys.stderr, flush=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
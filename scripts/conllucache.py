@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+
+# Convert CoNLL-U data into a columnar binary cache for repeated runs.
+#
+# Each field is stored as uint32 ids into a per-field vocabulary, and
+# sentences and documents as offsets into the token, comment and
+# sentence arrays. Vocabularies and comments are UTF-8 string pools.
+# The arrays are saved with common.save_arrays() and memory-mapped when
+# loaded, so reading a cache avoids decompression and text parsing, and
+# features of token attributes can be computed once per distinct value
+# and gathered with NumPy (see DelexFeaturizer).
+
+import sys
+
+from array import array
+from bisect import bisect_right
+
+import numpy as np
+
+from common import CONLLU_FIELDS, Word, Document
+from common import iter_conllu, open_input, save_arrays, load_arrays
+from common import load_arrays_meta
+
+
+CACHE_FORMAT = 'conllu-cache-1'
+
+
+def argparser():
+    from argparse import ArgumentParser
+    ap = ArgumentParser(description='Convert CoNLL-U to binary cache')
+    ap.add_argument('data', help='CoNLL-U data (optionally gzipped)')
+    ap.add_argument('cache')
+    return ap
+
+
+def pool_arrays(strings):
+    """Return (data, offsets) arrays for string pool."""
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded)+1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded])
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return data, offsets
+
+
+class StringPool(object):
+    """Strings decoded from a string pool when accessed. With memoize,
+    decoded strings are kept for repeated access (for vocabularies)."""
+
+    def __init__(self, data, offsets, memoize=False):
+        self.data = memoryview(data)
+        self.offsets = offsets
+        self.decoded = {} if memoize else None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if self.decoded is not None:
+            value = self.decoded.get(index)
+            if value is None:
+                value = self.decoded[index] = self.decode(index)
+            return value
+        return self.decode(index)
+
+    def __iter__(self):
+        data, offsets = self.data, self.offsets.tolist()
+        for s, e in zip(offsets[:-1], offsets[1:]):
+            yield str(data[s:e], 'utf-8')
+
+    def decode(self, index):
+        start, end = self.offsets[index], self.offsets[index+1]
+        return str(self.data[start:end], 'utf-8')
+
+
+def convert(documents):
+    """Return (arrays, meta) for cache of documents."""
+    vocabularies = [{} for f in CONLLU_FIELDS]
+    columns = [array('I') for f in CONLLU_FIELDS]
+    comments = []
+    sentence_comments, sentence_tokens = array('q', [0]), array('q', [0])
+    document_sentences = array('q', [0])
+    for sentences in documents:
+        for sentence_comment_lines, words in sentences:
+            comments.extend(sentence_comment_lines)
+            for w in words:
+                fields = list(w)
+                if len(fields) != len(CONLLU_FIELDS):
+                    raise ValueError('expected {} fields, got {}: {}'.format(
+                        len(CONLLU_FIELDS), len(fields), '\t'.join(fields)))
+                for value, vocabulary, column in zip(
+                        fields, vocabularies, columns):
+                    i = vocabulary.get(value)
+                    if i is None:
+                        i = vocabulary[value] = len(vocabulary)
+                    column.append(i)
+            sentence_comments.append(len(comments))
+            sentence_tokens.append(sentence_tokens[-1] + len(words))
+        document_sentences.append(len(sentence_tokens)-1)
+    arrays = {}
+    for field, vocabulary, column in zip(
+            CONLLU_FIELDS, vocabularies, columns):
+        arrays[field] = np.frombuffer(column, dtype=np.uint32)
+        arrays[field+'_pool'], arrays[field+'_offsets'] = pool_arrays(
+            sorted(vocabulary, key=vocabulary.get))
+    arrays['comments_pool'], arrays['comments_offsets'] = pool_arrays(
+        comments)
+    arrays['sentence_comments'] = np.frombuffer(sentence_comments, np.int64)
+    arrays['sentence_tokens'] = np.frombuffer(sentence_tokens, np.int64)
+    arrays['document_sentences'] = np.frombuffer(document_sentences,
+                                                 np.int64)
+    meta = {
+        'format': CACHE_FORMAT,
+        'fields': CONLLU_FIELDS,
+    }
+    return arrays, meta
+
+
+def save_conllu_cache(fn, documents):
+    arrays, meta = convert(documents)
+    save_arrays(fn, arrays, meta)
+    return len(arrays['document_sentences'])-1
+
+
+def is_conllu_cache(fn):
+    try:
+        meta = load_arrays_meta(fn)
+    except (IOError, ValueError):
+        return False
+    return (meta or {}).get('format') == CACHE_FORMAT
+
+
+class CachePart(object):
+    """Documents of one cache file."""
+
+    def __init__(self, fn):
+        arrays, meta = load_arrays(fn)
+        if (meta or {}).get('format') != CACHE_FORMAT:
+            raise ValueError('{}: not a CoNLL-U cache'.format(fn))
+        self.filename = fn
+        self.arrays = arrays
+        self.comments = StringPool(arrays['comments_pool'],
+                                   arrays['comments_offsets'])
+        self.sentence_comments = arrays['sentence_comments']
+        self.sentence_tokens = arrays['sentence_tokens']
+        self.document_sentences = arrays['document_sentences']
+        self._vocabularies = {}
+
+    def __len__(self):
+        return len(self.document_sentences)-1
+
+    def column(self, field):
+        """Return vocabulary ids of field for all tokens."""
+        return self.arrays[field]
+
+    def vocabulary(self, field):
+        """Return StringPool of values of field, indexed by id."""
+        if field not in self._vocabularies:
+            self._vocabularies[field] = StringPool(
+                self.arrays[field+'_pool'],
+                self.arrays[field+'_offsets'], memoize=True)
+        return self._vocabularies[field]
+
+    def document_tokens(self):
+        """Return token offsets of documents."""
+        return self.sentence_tokens[self.document_sentences]
+
+    def document(self, index):
+        columns = [
+            (self.vocabulary(f), self.column(f)) for f in CONLLU_FIELDS
+        ]
+        start, end = self.document_sentences[index:index+2]
+        sentences = Document()
+        for s in range(start, end):
+            c_start, c_end = self.sentence_comments[s:s+2]
+            comments = [self.comments[i] for i in range(c_start, c_end)]
+            t_start, t_end = self.sentence_tokens[s:s+2]
+            values = [
+                [vocabulary[i] for i in ids[t_start:t_end].tolist()]
+                for vocabulary, ids in columns
+            ]
+            sentences.append((comments, [Word(*w) for w in zip(*values)]))
+        return sentences
+
+
+class ConlluCache(object):
+    """Sequence of documents in one or more cache files.
+
+    Documents are created from the memory-mapped arrays when accessed.
+    Caches can be concatenated with +."""
+
+    def __init__(self, *filenames):
+        self.parts = [CachePart(fn) for fn in filenames]
+        self._starts = [0]
+        for part in self.parts:
+            self._starts.append(self._starts[-1] + len(part))
+
+    def __len__(self):
+        return self._starts[-1]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('document index out of range')
+        p = bisect_right(self._starts, index) - 1
+        return self.parts[p].document(index - self._starts[p])
+
+    def __iter__(self):
+        for part in self.parts:
+            for i in range(len(part)):
+                yield part.document(i)
+
+    def __add__(self, other):
+        if not isinstance(other, ConlluCache):
+            return NotImplemented
+        cache = ConlluCache()
+        cache.parts = self.parts + other.parts
+        for part in cache.parts:
+            cache._starts.append(cache._starts[-1] + len(part))
+        return cache
+
+    def update_stats(self, stats):
+        for part in self.parts:
+            stats['documents'] += len(part)
+            stats['sentences'] += len(part.sentence_tokens)-1
+            stats['tokens'] += int(part.sentence_tokens[-1])
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+    def report(stats):
+        print('read {} lines, {} docs from {} ...'.format(
+            stats['lines'], stats['documents'], args.data),
+              file=sys.stderr, flush=True)
+    with open_input(args.data) as f:
+        count = save_conllu_cache(
+            args.cache, iter_conllu(f, lazy=True, report=report))
+    print('saved {} documents to {}.'.format(count, args.cache),
+          file=sys.stderr, flush=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
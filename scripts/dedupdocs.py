@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+
+# Find near-duplicate CoNLL-U documents using MinHash and banded LSH.
+#
+# Outputs a TSV line "FILE INDEX DOC_ID DECISION CLUSTER" per document,
+# where DECISION is "keep" for the first document of each cluster of
+# near-duplicates (in input order) and "drop" for the rest, and
+# CLUSTER is the running number of the kept document of the cluster.
+#
+# To scale to very large inputs, signatures, document ids and LSH band
+# hashes are spilled to files in a temporary directory, and only the
+# union-find array and the array of cluster numbers, of one integer per
+# document, are kept in memory.
+
+import sys
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from zlib import crc32
+
+from common import iter_conllu, get_document_id, open_input, open_output
+from common import add_output_arguments
+
+
+TEXT_COMMENT = '# text = '
+
+# Odd 64-bit constant for combining band values into band hashes
+BAND_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+# Number of candidate pairs whose signatures are compared at once
+COMPARE_CHUNK_SIZE = 2**16
+
+
+def argparser():
+    from argparse import ArgumentParser
+    ap = ArgumentParser(description='Find near-duplicate documents')
+    ap.add_argument('-b', '--bands', default=16, type=int,
+                    help='number of LSH bands')
+    ap.add_argument('-r', '--rows', default=8, type=int,
+                    help='number of MinHash values per band')
+    ap.add_argument('-k', '--shingle-size', default=5, type=int,
+                    help='number of tokens per shingle')
+    ap.add_argument('-t', '--threshold', default=0.8, type=float,
+                    help='minimum estimated Jaccard similarity of duplicates')
+    ap.add_argument('-p', '--partitions', default=16, type=int,
+                    help='number of spill files per band')
+    ap.add_argument('-B', '--buffer-size', default=100000, type=int,
+                    help='number of documents to buffer before spilling')
+    ap.add_argument('-s', '--seed', default=0, type=int,
+                    help='random seed for MinHash permutations')
+    ap.add_argument('-T', '--tmpdir', default=None,
+                    help='directory for spill files (default system temp)')
+    add_output_arguments(ap)
+    ap.add_argument('data', nargs='+')
+    return ap
+
+
+def get_document_text(sentences):
+    texts = []
+    for comments, words in sentences:
+        text_lines = [c for c in comments if c.startswith(TEXT_COMMENT)]
+        if text_lines:
+            texts.extend(t[len(TEXT_COMMENT):] for t in text_lines)
+        else:
+            texts.append(' '.join(w.form for w in words))
+    return ' '.join(texts)
+
+
+class MinHasher(object):
+    """MinHash over token shingles with multiply-shift hash functions."""
+
+    def __init__(self, num_perm, shingle_size, seed):
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(0, 2**63, num_perm, dtype=np.uint64) | 1
+        self.b = rng.randint(0, 2**63, num_perm, dtype=np.uint64)
+        self.shingle_size = shingle_size
+
+    def shingle_hashes(self, text):
+        tokens = text.lower().split()
+        k = min(self.shingle_size, len(tokens))
+        shingles = set(' '.join(tokens[i:i+k])
+                       for i in range(len(tokens)-k+1))
+        return np.fromiter((crc32(s.encode('utf-8')) for s in shingles),
+                           dtype=np.uint64, count=len(shingles))
+
+    def signature(self, text):
+        """Return uint32 MinHash signature, None if text has no tokens."""
+        hashes = self.shingle_hashes(text)
+        if not len(hashes):
+            return None
+        h = (self.a[:, np.newaxis] * hashes + self.b[:, np.newaxis]) >> 32
+        return h.min(axis=1).astype(np.uint32)
+
+
+def band_hashes(signature, bands, rows):
+    values = signature.reshape(bands, rows).astype(np.uint64)
+    h = np.zeros(bands, dtype=np.uint64)
+    for i in range(rows):
+        h = h * BAND_HASH_MULTIPLIER + values[:, i]
+    return h
+
+
+class SpillFiles(object):
+    """Buffered binary files of (band hash, document number) records,
+    partitioned by band and hash, and of signatures and document ids."""
+
+    def __init__(self, directory, bands, partitions, num_perm):
+        self.directory = directory
+        self.bands = bands
+        self.partitions = partitions
+        self.num_perm = num_perm
+        self.count = 0
+        self.signatures = open(self.signature_filename(), 'wb')
+        self.documents = open(self.document_filename(), 'w')
+        self.buffer = []
+
+    def signature_filename(self):
+        return os.path.join(self.directory, 'signatures.bin')
+
+    def document_filename(self):
+        return os.path.join(self.directory, 'documents.tsv')
+
+    def band_filename(self, band, partition):
+        return os.path.join(self.directory, 'band{}-{}.bin'.format(
+            band, partition))
+
+    def add(self, file_index, index, doc_id, signature):
+        if signature is None:
+            signature = np.zeros(self.num_perm, dtype=np.uint32)
+            empty = True
+        else:
+            empty = False
+        self.signatures.write(signature.tobytes())
+        doc_id = doc_id.replace('\t', ' ')
+        print('{}\t{}\t{}'.format(file_index, index, doc_id),
+              file=self.documents)
+        if not empty:
+            self.buffer.append((self.count, signature))
+        self.count += 1
+
+    def spill(self, bands, rows):
+        if not self.buffer:
+            return
+        numbers = np.array([n for n, s in self.buffer], dtype=np.uint64)
+        hashes = np.array([band_hashes(s, bands, rows)
+                           for n, s in self.buffer])
+        partitions = hashes % np.uint64(self.partitions)
+        for b in range(self.bands):
+            for p in range(self.partitions):
+                mask = partitions[:, b] == p
+                if not mask.any():
+                    continue
+                records = np.column_stack((hashes[mask, b], numbers[mask]))
+                with open(self.band_filename(b, p), 'ab') as f:
+                    f.write(records.astype(np.uint64).tobytes())
+        self.buffer = []
+
+    def close(self):
+        self.signatures.close()
+        self.documents.close()
+
+    def load_signatures(self):
+        return np.memmap(self.signature_filename(), dtype=np.uint32, mode='r',
+                         shape=(self.count, self.num_perm))
+
+    def load_band(self, band, partition):
+        fn = self.band_filename(band, partition)
+        if not os.path.exists(fn):
+            return np.zeros((0, 2), dtype=np.uint64)
+        return np.fromfile(fn, dtype=np.uint64).reshape(-1, 2)
+
+
+def find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def union(parent, i, j):
+    # root is the lowest-numbered document, i.e. the first in input order
+    i, j = find(parent, i), find(parent, j)
+    if i < j:
+        parent[j] = i
+    elif j < i:
+        parent[i] = j
+
+
+def candidate_pairs(records):
+    """Return pairs of document numbers with the same band hash, pairing
+    each document with the first document with its hash and with the
+    preceding one (in document number order), so that documents that
+    are near-duplicates of each other but not of the first document are
+    also compared."""
+    order = np.lexsort((records[:, 1], records[:, 0]))
+    hashes, numbers = records[order, 0], records[order, 1]
+    starts = np.ones(len(hashes), dtype=bool)
+    starts[1:] = hashes[1:] != hashes[:-1]
+    first = numbers[np.flatnonzero(starts)[np.cumsum(starts)-1]]
+    # preceding documents that are not the first, paired above
+    previous = ~starts[1:] & ~starts[:-1]
+    return (np.concatenate((first[~starts], numbers[:-1][previous])),
+            np.concatenate((numbers[~starts], numbers[1:][previous])))
+
+
+def similar_pairs(signatures, firsts, others, threshold):
+    """Generate pairs with estimated Jaccard similarity >= threshold,
+    comparing signatures of COMPARE_CHUNK_SIZE pairs at a time."""
+    for s in range(0, len(firsts), COMPARE_CHUNK_SIZE):
+        i = firsts[s:s+COMPARE_CHUNK_SIZE].astype(np.int64)
+        j = others[s:s+COMPARE_CHUNK_SIZE].astype(np.int64)
+        similarity = (signatures[i] == signatures[j]).mean(axis=1)
+        mask = similarity >= threshold
+        yield from zip(i[mask].tolist(), j[mask].tolist())
+
+
+def cluster(spill, options):
+    parent = np.arange(spill.count, dtype=np.int64)
+    signatures = spill.load_signatures()
+    candidates, duplicates = 0, 0
+    for b in range(options.bands):
+        for p in range(options.partitions):
+            firsts, others = candidate_pairs(spill.load_band(b, p))
+            if not len(firsts):
+                continue
+            candidates += len(firsts)
+            for i, j in similar_pairs(signatures, firsts, others,
+                                      options.threshold):
+                union(parent, i, j)
+                duplicates += 1
+        print('clustered band {}/{} ({} candidates, {} duplicates) ...'.format(
+            b+1, options.bands, candidates, duplicates),
+              file=sys.stderr, flush=True)
+    return parent
+
+
+def output_decisions(spill, parent, data, out=sys.stdout):
+    kept, dropped = 0, 0
+    # cluster numbers of kept documents, indexed by document number
+    clusters = np.zeros(spill.count, dtype=np.int64)
+    with open(spill.document_filename()) as f:
+        for n, l in enumerate(f):
+            file_index, index, doc_id = l.rstrip('\n').split('\t', 2)
+            root = find(parent, n)
+            if root == n:
+                clusters[n] = kept
+                decision = 'keep'
+                kept += 1
+            else:
+                decision = 'drop'
+                dropped += 1
+            print('{}\t{}\t{}\t{}\t{}'.format(
+                os.path.basename(data[int(file_index)]), index, doc_id,
+                decision, clusters[root]), file=out)
+    print('kept {}, dropped {} ({:.1%}) of {} documents'.format(
+        kept, dropped, dropped/max(kept+dropped, 1), kept+dropped),
+          file=sys.stderr, flush=True)
+
+
+def read_stream(f, name, file_index, minhasher, spill, options):
+    def report(stats):
+        print('{}: processed {} lines ({} docs) ...'.format(
+            os.path.basename(name), stats['lines'], stats['documents']),
+              file=sys.stderr, flush=True)
+    for index, sentences in enumerate(iter_conllu(f, lazy=True,
+                                                  report=report)):
+        signature = minhasher.signature(get_document_text(sentences))
+        spill.add(file_index, index, get_document_id(sentences), signature)
+        if len(spill.buffer) >= options.buffer_size:
+            spill.spill(options.bands, options.rows)
+
+
+def read(fn, *args):
+    with open_input(fn) as f:
+        return read_stream(f, fn, *args)
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+    num_perm = args.bands * args.rows
+    minhasher = MinHasher(num_perm, args.shingle_size, args.seed)
+    directory = tempfile.mkdtemp(prefix='dedupdocs-', dir=args.tmpdir)
+    try:
+        spill = SpillFiles(directory, args.bands, args.partitions, num_perm)
+        for file_index, fn in enumerate(args.data):
+            print('processing {} ...'.format(os.path.basename(fn)),
+                  file=sys.stderr, flush=True)
+            read(fn, file_index, minhasher, spill, args)
+        spill.spill(args.bands, args.rows)
+        spill.close()
+        parent = cluster(spill, args)
+        with open_output(args.output, args.compresslevel,
+                         args.compress_threads) as out:
+            output_decisions(spill, parent, args.data, out)
+    finally:
+        shutil.rmtree(directory)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -7,12 +7,13 @@ import os
 import re
 
 from string import punctuation
-from collections import defaultdict
+from collections import defaultdict, Counter
 
-from langdetect import detect, DetectorFactory
-
-# Make langdetect deterministic
-DetectorFactory.seed = 0
+from common import open_input, add_output_arguments, redirect_output
+from common import add_driver_arguments, run_files
+from languageid import add_langid_arguments, identify_document
+from languageid import print_cache_stats, model_key
+from languageid import check_langid_arguments
 
 # Regex definition for e.g. --min-words option
 FI_WORD_RE = re.compile(r'\b[A-ZÅÄÖ]?[a-zåäö]{2,}\b')
@@ -141,9 +142,12 @@ def argparser():
     ap.add_argument('-i', '--invert', default=False, action='store_true',
                     help='invert filter criteria')
     ap.add_argument('-l', '--langdetect', default=False, action='store_true',
-                    help='run langdetect to filter to Finnish')
+                    help='run language identification to filter to Finnish')
     ap.add_argument('-L', '--limit', default=None, type=int,
                     help='limit number of documents to process')
+    ap.add_argument('-m', '--metrics', default=False, action='store_true',
+                    help='take document metrics from DATA.metrics instead'
+                    ' of computing them (see filtermetrics.py)')
     ap.add_argument('-n', '--no-word-ratio', default=None, type=float,
                     help='maximum ratio of lines without word tokens')
     ap.add_argument('-p', '--punct-ratio', default=None, type=float,
@@ -160,6 +164,9 @@ def argparser():
                     help='maximum ratio of uppercase characters')
     ap.add_argument('-w', '--min-words', default=None, type=int,
                     help='minimum number of Finnish words')
+    add_langid_arguments(ap)
+    add_output_arguments(ap)
+    add_driver_arguments(ap)
     ap.add_argument('file', nargs='+')
     return ap
 
@@ -206,52 +213,374 @@ def frequent_ratio(sentences):
     return sum(w in FREQUENT_FI_WORDS for w in words)/len(words)
 
 
-def detect_lang(sentences):
-    try:
-        return detect(' '.join(sentences))
-    except:
+def detect_lang(sentences, options=None, stats=None):
+    return identify_document(sentences, options, stats)
+
+
+PUNCTUATION = set(punctuation)
+
+
+class DocumentMetrics(object):
+    """Metrics of a document computed on demand and cached.
+
+    Values are the same as those of the corresponding functions above,
+    but character class counts are taken in a single pass over the
+    distinct characters of the document and sentences are tokenized
+    with FI_WORD_RE only once."""
+
+    def __init__(self, sentences, stats=None):
+        self.sentences = sentences
+        self.stats = stats
+        self._toks = None
+        self._char_classes = None
+        self._words = None
+        self._lang = None
+
+    def num_sents(self):
+        return len(self.sentences)
+
+    def num_toks(self):
+        if self._toks is None:
+            self._toks = num_toks(self.sentences)
+        return self._toks
+
+    def char_count(self):
+        return char_count(self.sentences)
+
+    def char_classes(self):
+        # counts of uppercase, digit, punctuation and non-Finnish letters
+        if self._char_classes is None:
+            upper, digit, punct, foreign = 0, 0, 0, 0
+            for c, n in Counter(''.join(self.sentences)).items():
+                if c.isupper():
+                    upper += n
+                if c.isdigit():
+                    digit += n
+                if c in PUNCTUATION:
+                    punct += n
+                if NON_FI_LETTER.match(c):
+                    foreign += n
+            self._char_classes = (upper, digit, punct, foreign)
+        return self._char_classes
+
+    def uppercase_ratio(self):
+        return self.char_classes()[0]/self.char_count()
+
+    def digit_ratio(self):
+        return self.char_classes()[1]/self.char_count()
+
+    def punctuation_ratio(self):
+        return self.char_classes()[2]/self.char_count()
+
+    def foreign_ratio(self):
+        return self.char_classes()[3]/self.char_count()
+
+    def words(self):
+        # FI_WORD_RE matches for each sentence
+        if self._words is None:
+            self._words = [FI_WORD_RE.findall(s) for s in self.sentences]
+        return self._words
+
+    def num_words(self):
+        return sum(len(w) for w in self.words())
+
+    def avg_len(self):
+        return self.num_words() / len(self.sentences)
+
+    def no_word_ratio(self):
+        return sum(1 for w in self.words() if len(w) == 0)/len(self.sentences)
+
+    def frequent_ratio(self):
+        words = [w for ws in self.words() for w in ws]
+        return sum(w in FREQUENT_FI_WORDS for w in words)/len(words)
+
+    def detect_lang(self, options=None):
+        if self._lang is None:
+            self._lang = (detect_lang(self.sentences, options, self.stats),)
+        return self._lang[0]
+
+
+# Filter checks as (label, relative cost, check) in the order in which
+# they are applied, i.e. a document is reported to fail the first
+# failing check in this list. check(metrics, options) is true if the
+# check is enabled and fails.
+FILTER_CHECKS = [
+    ('avg-len', 3, lambda m, o: (
+        o.avg_len is not None and m.avg_len() < o.avg_len)),
+    ('min-sents', 0, lambda m, o: (
+        o.min_sents is not None and m.num_sents() < o.min_sents)),
+    ('max-sents', 0, lambda m, o: (
+        o.max_sents is not None and m.num_sents() > o.max_sents)),
+    ('min-toks', 1, lambda m, o: (
+        o.min_toks is not None and m.num_toks() < o.min_toks)),
+    ('max-toks', 1, lambda m, o: (
+        o.max_toks is not None and m.num_toks() > o.max_toks)),
+    ('no-word-ratio', 3, lambda m, o: (
+        o.no_word_ratio is not None and
+        m.no_word_ratio() > o.no_word_ratio)),
+    ('punct-ratio', 2, lambda m, o: (
+        o.punct_ratio is not None and
+        m.punctuation_ratio() > o.punct_ratio)),
+    ('upper-ratio', 2, lambda m, o: (
+        o.upper_ratio is not None and m.uppercase_ratio() > o.upper_ratio)),
+    ('digit-ratio', 2, lambda m, o: (
+        o.digit_ratio is not None and m.digit_ratio() > o.digit_ratio)),
+    ('foreign-ratio', 2, lambda m, o: (
+        o.foreign_ratio is not None and
+        m.foreign_ratio() > o.foreign_ratio)),
+    ('min-words', 3, lambda m, o: (
+        o.min_words is not None and m.num_words() < o.min_words)),
+    ('frequent-ratio', 3, lambda m, o: (
+        o.frequent_ratio is not None and
+        m.frequent_ratio() < o.frequent_ratio)),
+    ('langdetect', 10, lambda m, o: (
+        o.langdetect and m.detect_lang(o) != 'fi')),
+]
+
+# Indices of FILTER_CHECKS cheapest first
+FILTER_CHECK_ORDER = sorted(range(len(FILTER_CHECKS)),
+                            key=lambda i: FILTER_CHECKS[i][1])
+
+
+def filter_sentences(sentences, options, metrics=None, stats=None):
+    """Return label of first failing check for document or None if all pass.
+
+    Checks are evaluated cheapest first, skipping those that cannot
+    change the result, i.e. those after an already failed check."""
+    if metrics is None:
+        metrics = DocumentMetrics(sentences, stats)
+    failed, error = len(FILTER_CHECKS), None
+    for i in FILTER_CHECK_ORDER:
+        if i > failed:
+            continue
+        label, cost, check = FILTER_CHECKS[i]
+        try:
+            fail = check(metrics, options)
+        except ZeroDivisionError as e:
+            # only raised if all preceding checks pass, as when the
+            # checks are evaluated in order
+            fail, error = True, (i, e)
+        if fail:
+            failed = i
+    if error is not None and error[0] == failed:
+        raise error[1]
+    if failed == len(FILTER_CHECKS):
         return None
+    else:
+        return FILTER_CHECKS[failed][0]
+
+
+# Metrics table columns, counts from which the DocumentMetrics values
+# are derived. lang-fi is 1 for Finnish, 0 for other languages and -1 if
+# language was not identified.
+METRIC_COLUMNS = [
+    'sents', 'toks', 'chars', 'upper', 'digit', 'punct', 'foreign',
+    'words', 'no-word-sents', 'frequent-words', 'lang-fi',
+]
+
+METRICS_FORMAT = 'filter-metrics-1'
+
+
+def metrics_filename(fn):
+    return '{}.metrics'.format(fn)
+
+
+def metric_values(metrics, options, identify=True):
+    """Return values of METRIC_COLUMNS for DocumentMetrics, identifying
+    language only if options.langdetect. If identify is false, language
+    is only included if already identified."""
+    upper, digit, punct, foreign = metrics.char_classes()
+    words = metrics.words()
+    if options.langdetect and (identify or metrics._lang is not None):
+        lang_fi = int(metrics.detect_lang(options) == 'fi')
+    else:
+        lang_fi = -1
+    return (
+        metrics.num_sents(), metrics.num_toks(), metrics.char_count(),
+        upper, digit, punct, foreign, metrics.num_words(),
+        sum(1 for w in words if not w),
+        sum(w in FREQUENT_FI_WORDS for ws in words for w in ws),
+        lang_fi,
+    )
+
+
+def metric_settings(options):
+    # settings that metric_values() depend on
+    return (options.langid_backend, model_key(options),
+            options.langid_max_chars, options.langid_sentences)
+
+
+class CountMetrics(object):
+    """DocumentMetrics given values of METRIC_COLUMNS. Language is
+    identified from sentences if not included in values."""
+
+    def __init__(self, values, sentences=None, stats=None):
+        self.values = dict(zip(METRIC_COLUMNS, values))
+        self.sentences = sentences
+        self.stats = stats
+
+    def num_sents(self):
+        return self.values['sents']
+
+    def num_toks(self):
+        return self.values['toks']
+
+    def char_count(self):
+        return self.values['chars']
+
+    def uppercase_ratio(self):
+        return self.values['upper']/self.char_count()
+
+    def digit_ratio(self):
+        return self.values['digit']/self.char_count()
+
+    def punctuation_ratio(self):
+        return self.values['punct']/self.char_count()
+
+    def foreign_ratio(self):
+        return self.values['foreign']/self.char_count()
+
+    def num_words(self):
+        return self.values['words']
+
+    def avg_len(self):
+        return self.num_words() / self.num_sents()
+
+    def no_word_ratio(self):
+        return self.values['no-word-sents']/self.num_sents()
+
+    def frequent_ratio(self):
+        return self.values['frequent-words']/self.num_words()
 
+    def detect_lang(self, options=None):
+        if self.values['lang-fi'] < 0:
+            lang = detect_lang(self.sentences, options, self.stats)
+            self.values['lang-fi'] = int(lang == 'fi')
+        return 'fi' if self.values['lang-fi'] == 1 else ''
 
-def filter_sentences(sentences, options):
-    if options.avg_len is not None and avg_len(sentences) < options.avg_len:
-        return 'avg-len'
-    if options.min_sents is not None and len(sentences) < options.min_sents:
-        return 'min-sents'
-    if options.max_sents is not None and len(sentences) > options.max_sents:
-        return 'max-sents'
-    if options.min_toks is not None and num_toks(sentences) < options.min_toks:
-        return 'min-toks'
-    if options.max_toks is not None and num_toks(sentences) > options.max_toks:
-        return 'max-toks'
-    if (options.no_word_ratio is not None and
-        no_word_ratio(sentences) > options.no_word_ratio):
-        return 'no-word-ratio'
-    if (options.punct_ratio is not None and 
-        punctuation_ratio(sentences) > options.punct_ratio):
-        return 'punct-ratio'
-    if (options.upper_ratio is not None and 
-        uppercase_ratio(sentences) > options.upper_ratio):
-        return 'upper-ratio'
-    if (options.digit_ratio is not None and 
-        digit_ratio(sentences) > options.digit_ratio):
-        return 'digit-ratio'
-    if (options.foreign_ratio is not None and
-        foreign_ratio(sentences) > options.foreign_ratio):
-        return 'foreign-ratio'
-    if (options.min_words is not None and 
-        num_words(sentences) < options.min_words):
-        return 'min-words'
-    if (options.frequent_ratio is not None and
-        frequent_ratio(sentences) < options.frequent_ratio):
-        return 'frequent-ratio'
-    if options.langdetect and detect_lang(sentences) != 'fi':
-        return 'langdetect'
-    return None
-
-
-def process_document(sentences, stats, options):
-    fail = filter_sentences(sentences, options)
+    def metric_values(self):
+        return tuple(self.values[c] for c in METRIC_COLUMNS)
+
+
+def save_metrics_table(fn, rows, meta=None):
+    import numpy as np
+    from common import save_arrays
+    table = np.array(rows, dtype=np.int64).reshape(-1, len(METRIC_COLUMNS))
+    arrays = { c: table[:,i] for i, c in enumerate(METRIC_COLUMNS) }
+    meta = dict(meta or {}, format=METRICS_FORMAT)
+    save_arrays(fn, arrays, meta)
+    return len(table)
+
+
+def load_metrics_table(fn):
+    from common import load_arrays
+    columns, meta = load_arrays(fn)
+    if (meta or {}).get('format') != METRICS_FORMAT:
+        raise ValueError('{}: not a metrics table'.format(fn))
+    return columns
+
+
+class TableMetrics(object):
+    """DocumentMetrics of all documents in metrics tables, with methods
+    returning NumPy arrays of values.
+
+    Ratios with a zero denominator, for which the filter raises
+    ZeroDivisionError, are given values that fail the check."""
+
+    def __init__(self, *filenames):
+        import numpy as np
+        tables = [load_metrics_table(fn) for fn in filenames]
+        self.columns = {
+            c: np.concatenate([t[c] for t in tables]) for c in METRIC_COLUMNS
+        }
+        self._ratios = {}
+
+    def __len__(self):
+        return len(self.columns['sents'])
+
+    def _ratio(self, numerator, denominator, fail_value):
+        import numpy as np
+        key = (numerator, denominator)
+        if key not in self._ratios:
+            n, d = self.columns[numerator], self.columns[denominator]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ratio = n / d
+            ratio[d == 0] = fail_value
+            self._ratios[key] = ratio
+        return self._ratios[key]
+
+    def num_sents(self):
+        return self.columns['sents']
+
+    def num_toks(self):
+        return self.columns['toks']
+
+    def uppercase_ratio(self):
+        return self._ratio('upper', 'chars', float('inf'))
+
+    def digit_ratio(self):
+        return self._ratio('digit', 'chars', float('inf'))
+
+    def punctuation_ratio(self):
+        return self._ratio('punct', 'chars', float('inf'))
+
+    def foreign_ratio(self):
+        return self._ratio('foreign', 'chars', float('inf'))
+
+    def num_words(self):
+        return self.columns['words']
+
+    def avg_len(self):
+        return self._ratio('words', 'sents', float('-inf'))
+
+    def no_word_ratio(self):
+        return self._ratio('no-word-sents', 'sents', float('inf'))
+
+    def frequent_ratio(self):
+        return self._ratio('frequent-words', 'words', float('-inf'))
+
+    def detect_lang(self, options=None):
+        import numpy as np
+        lang_fi = self.columns['lang-fi']
+        if (lang_fi < 0).any():
+            raise ValueError('language not identified in metrics table'
+                             ' (see filtermetrics.py --langdetect)')
+        return np.where(lang_fi == 1, 'fi', '')
+
+
+def filter_table(metrics, options):
+    """Return index in FILTER_CHECKS of first failing check for each
+    document of TableMetrics, len(FILTER_CHECKS) if all pass."""
+    import numpy as np
+    failed = np.full(len(metrics), len(FILTER_CHECKS), dtype=np.int64)
+    # in reverse so that earlier checks override later ones
+    for i in reversed(range(len(FILTER_CHECKS))):
+        label, cost, check = FILTER_CHECKS[i]
+        fail = check(metrics, options)
+        if fail is not False:
+            failed[fail] = i
+    return failed
+
+
+def table_results(fn, failed):
+    """Yield label of first failing check or None for each document of
+    fn given failed from filter_table()."""
+    labels = [label for label, cost, check in FILTER_CHECKS] + [None]
+    for i in failed.tolist():
+        yield labels[i]
+    raise ValueError('{}: more documents than in {}'.format(
+        fn, metrics_filename(fn)))
+
+
+def check_table_size(fn, count, failed, options):
+    if options.limit is None and count != len(failed):
+        raise ValueError('{}: {} documents, {} in {}'.format(
+            fn, count, len(failed), metrics_filename(fn)))
+
+
+def document_result(fail, stats):
+    """Return result label and whether to skip document for label of
+    first failing check or None."""
     if fail is None:
         result = 'pass-all'
         skip = False
@@ -259,6 +588,15 @@ def process_document(sentences, stats, options):
         result = 'fail-{}'.format(fail)
         skip = True
     stats[result] += 1
+    return result, skip
+
+
+def process_document(sentences, stats, options, results=None):
+    if results is None:
+        fail = filter_sentences(sentences, options, stats=stats)
+    else:
+        fail = next(results)
+    result, skip = document_result(fail, stats)
     if options.invert:
         skip = not skip
     if not skip:
@@ -271,7 +609,11 @@ def process_document(sentences, stats, options):
 def process(fn, options):
     doc_count = 0
     stats = defaultdict(int)
-    with open(fn) as f:
+    results = None
+    if options.metrics:
+        failed = filter_table(TableMetrics(metrics_filename(fn)), options)
+        results = table_results(fn, failed)
+    with open_input(fn) as f:
         sentences = []
         for ln, l in enumerate(f, start=1):
             l = l.rstrip()
@@ -279,7 +621,7 @@ def process(fn, options):
                 sentences.append(l)
             else:
                 if sentences:
-                    process_document(sentences, stats, options)
+                    process_document(sentences, stats, options, results)
                     doc_count += 1
                 sentences = []
                 if options.limit is not None and doc_count >= options.limit:
@@ -287,17 +629,26 @@ def process(fn, options):
             if ln % 10000 == 0:
                 print('processed {} ...'.format(ln), file=sys.stderr)
         if sentences:
-            process_document(sentences, stats, options)
+            process_document(sentences, stats, options, results)
+            doc_count += 1
+    if options.metrics:
+        check_table_size(fn, doc_count, failed, options)
+    print_cache_stats(fn, stats)
 
 
 def main(argv):
-    args = argparser().parse_args(argv[1:])
-    for fn in args.file:
-        print('processing {} ...'.format(os.path.basename(fn)),
-              file=sys.stderr)
-        process(fn, args)
-        print('completed {}.'.format(os.path.basename(fn)),
-              file=sys.stderr)
+    ap = argparser()
+    args = ap.parse_args(argv[1:])
+    check_langid_arguments(ap, args)
+    if args.output_dir is not None:
+        return run_files(process, args.file, args, (args,))
+    with redirect_output(args):
+        for fn in args.file:
+            print('processing {} ...'.format(os.path.basename(fn)),
+                  file=sys.stderr)
+            process(fn, args)
+            print('completed {}.'.format(os.path.basename(fn)),
+                  file=sys.stderr)
     return 0
 
 
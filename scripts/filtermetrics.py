@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+# Compute document metrics used by filterdocs.py and filteruddocs.py
+# once and save them in a metrics table DATA.metrics, from which
+# sweepfilter.py evaluates filter configurations and filterdocs.py -m
+# writes the output of one.
+
+import sys
+import os
+
+from collections import defaultdict
+
+from common import iter_conllu, open_input, batches, parallel_map
+from filterdocs import DocumentMetrics, metric_values, metrics_filename
+from filterdocs import save_metrics_table
+from filteruddocs import get_sentence_texts, add_worker_arguments
+from languageid import add_langid_arguments, print_cache_stats
+from languageid import check_langid_arguments
+
+
+def argparser():
+    from argparse import ArgumentParser
+    ap = ArgumentParser(description='Compute document filter metrics')
+    ap.add_argument('-c', '--conllu', default=False, action='store_true',
+                    help='data is CoNLL-U (as for filteruddocs.py)')
+    ap.add_argument('-l', '--langdetect', default=False, action='store_true',
+                    help='identify language (required for sweeps with'
+                    ' --langdetect)')
+    add_langid_arguments(ap)
+    add_worker_arguments(ap)
+    ap.add_argument('data', nargs='+')
+    return ap
+
+
+def iter_text_documents(f):
+    # documents as read by filterdocs.py
+    sentences = []
+    for l in f:
+        l = l.rstrip()
+        if l and not l.isspace():
+            sentences.append(l)
+        elif sentences:
+            yield sentences
+            sentences = []
+    if sentences:
+        yield sentences
+
+
+def document_texts(f, options):
+    if not options.conllu:
+        return iter_text_documents(f)
+    else:
+        return (
+            get_sentence_texts(sentences, options)
+            for sentences in iter_conllu(f, lazy=True)
+        )
+
+
+_worker_state = {}
+
+
+def init_worker(options):
+    _worker_state['options'] = options
+
+
+def metrics_batch(documents):
+    # Run in worker process; return metric rows and stats
+    options = _worker_state['options']
+    stats = defaultdict(int)
+    rows = [
+        metric_values(DocumentMetrics(texts, stats), options)
+        for texts in documents
+    ]
+    return rows, stats
+
+
+def process(fn, options):
+    rows, stats = [], defaultdict(int)
+    with open_input(fn) as f:
+        documents = batches(document_texts(f, options), options.batch_size)
+        if not options.workers:
+            init_worker(options)
+            results = map(metrics_batch, documents)
+        else:
+            results = parallel_map(metrics_batch, documents,
+                                   options.workers, init_worker, (options,))
+        for batch_rows, batch_stats in results:
+            rows.extend(batch_rows)
+            for k, v in batch_stats.items():
+                stats[k] += v
+            if len(rows) % 10000 < len(batch_rows):
+                print('{}: {} documents ...'.format(
+                    os.path.basename(fn), len(rows)),
+                      file=sys.stderr, flush=True)
+    print_cache_stats(fn, stats)
+    meta = {
+        'input': os.path.basename(fn),
+        'langdetect': options.langdetect,
+    }
+    count = save_metrics_table(metrics_filename(fn), rows, meta)
+    print('saved metrics of {} documents to {}.'.format(
+        count, metrics_filename(fn)), file=sys.stderr, flush=True)
+
+
+def main(argv):
+    ap = argparser()
+    args = ap.parse_args(argv[1:])
+    check_langid_arguments(ap, args)
+    for fn in args.data:
+        process(fn, args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -6,11 +6,12 @@ import fileinput
 import re
 
 from string import punctuation
+from collections import defaultdict
 
-from langdetect import detect, DetectorFactory
-
-# Make langdetect deterministic
-DetectorFactory.seed = 0
+from common import open_input, add_output_arguments, redirect_output
+from common import add_driver_arguments, run_files
+from languageid import add_langid_arguments, identify_text, print_cache_stats
+from languageid import check_langid_arguments
 
 FI_WORD_RE = re.compile(r'\b[a-zA-ZåäöÅÄÖ][a-zåäö]+\b')
 
@@ -30,7 +31,7 @@ def argparser():
     ap.add_argument('-i', '--invert', default=False, action='store_true',
                     help='invert filter criteria')
     ap.add_argument('-l', '--langdetect', default=False, action='store_true',
-                    help='run langdetect to filter to Finnish')
+                    help='run language identification to filter to Finnish')
     ap.add_argument('-L', '--limit', default=None, type=int,
                     help='limit number of documents to process')    
     ap.add_argument('-p', '--punct-ratio', default=None, type=float,
@@ -45,6 +46,9 @@ def argparser():
                     help='maximum number of Finnish words')
     ap.add_argument('-u', '--upper-ratio', default=None, type=float,
                     help='maximum ratio of uppercase characters')
+    add_langid_arguments(ap)
+    add_output_arguments(ap)
+    add_driver_arguments(ap)
     ap.add_argument('file', nargs='*')
     return ap
 
@@ -73,60 +77,111 @@ def foreign_ratio(sentence):
     return len(NON_FI_LETTER.findall(sentence))/len(sentence)
 
 
-def filter_sentence(sentence, options):
-    if (options.punct_ratio is not None and
-        punctuation_ratio(sentence) > options.punct_ratio):
-        return True
-    if (options.upper_ratio is not None and
-        uppercase_ratio(sentence) > options.upper_ratio):
-        return True
-    if (options.digit_ratio is not None and
-        digit_ratio(sentence) > options.digit_ratio):
-        return True
-    if (options.foreign_ratio is not None and
-        foreign_ratio(sentence) > options.foreign_ratio):
-        return True
-    if (options.min_toks is not None and 
-        num_toks(sentence) < options.min_toks):
-        return True
-    if (options.max_toks is not None and 
-        num_toks(sentence) > options.max_toks):
-        return True
-    if (options.min_words is not None and 
-        num_words(sentence) < options.min_words):
+# Counts that the checks of filter_sentence() are based on
+SENTENCE_COUNTS = [
+    ('chars', len),
+    ('punct', lambda s: sum(c in PUNCT for c in s)),
+    ('upper', lambda s: sum(c.isupper() for c in s)),
+    ('digit', lambda s: sum(c.isdigit() for c in s)),
+    ('foreign', lambda s: len(NON_FI_LETTER.findall(s))),
+    ('toks', num_toks),
+    ('words', num_words),
+]
+
+SENTENCE_COUNT_FUNCTIONS = dict(SENTENCE_COUNTS)
+
+# Checks of filter_sentence() in order as (option, check), where check
+# is applied to SentenceCounts and the option value if it is not None
+SENTENCE_CHECKS = [
+    ('punct_ratio', lambda c, v: c['punct']/c['chars'] > v),
+    ('upper_ratio', lambda c, v: c['upper']/c['chars'] > v),
+    ('digit_ratio', lambda c, v: c['digit']/c['chars'] > v),
+    ('foreign_ratio', lambda c, v: c['foreign']/c['chars'] > v),
+    ('min_toks', lambda c, v: c['toks'] < v),
+    ('max_toks', lambda c, v: c['toks'] > v),
+    ('min_words', lambda c, v: c['words'] < v),
+    ('max_words', lambda c, v: c['words'] > v),
+]
+
+
+class SentenceCounts(dict):
+    """SENTENCE_COUNTS of sentence by name, computed when first accessed
+    unless given as sentence_counts() values."""
+
+    def __init__(self, sentence, values=None):
+        if values is not None:
+            super(SentenceCounts, self).__init__(
+                zip((n for n, f in SENTENCE_COUNTS), values))
+        self.sentence = sentence
+
+    def __missing__(self, name):
+        value = self[name] = SENTENCE_COUNT_FUNCTIONS[name](self.sentence)
+        return value
+
+
+def check_counts(counts, options):
+    """Return True if a SENTENCE_CHECKS check fails for SentenceCounts."""
+    for name, check in SENTENCE_CHECKS:
+        value = getattr(options, name)
+        if value is not None and check(counts, value):
+            return True
+    return False
+
+
+def filter_sentence(sentence, options, stats=None):
+    if check_counts(SentenceCounts(sentence), options):
         return True
-    if (options.max_words is not None and 
-        num_words(sentence) > options.max_words):
+    if options.langdetect and identify_text(sentence, options, stats) != 'fi':
         return True
-    if options.langdetect:
-        try:
-            lang = detect(sentence)
-        except:
-            lang = None
-        if lang != "fi":
-            return True
     return False
 
 
+def sentence_counts(sentence):
+    """Return counts that filter_sentence() checks are based on, see
+    filter_sentence_counts()."""
+    return [f(sentence) for n, f in SENTENCE_COUNTS]
+
+
+def filter_sentence_counts(counts, lang, sentence, options, stats=None):
+    """Return filter_sentence() result and language given counts from
+    sentence_counts() and language, or None if not yet identified."""
+    if check_counts(SentenceCounts(sentence, counts), options):
+        return True, lang
+    if options.langdetect:
+        if lang is None:
+            # not identified is stored as ''
+            lang = identify_text(sentence, options, stats) or ''
+        if lang != 'fi':
+            return True, lang
+    return False, lang
+
+
 def process(fn, options):
-    with open(fn) as f:
+    stats = defaultdict(int)
+    with open_input(fn) as f:
         for l in f:
             l = l.rstrip()
-            skip = filter_sentence(l, options)
+            skip = filter_sentence(l, options, stats)
             if options.invert:
                 skip = not skip
             if not skip:
                 print(l)
+    print_cache_stats(fn, stats)
 
 
 def main(argv):
-    args = argparser().parse_args(argv[1:])
+    ap = argparser()
+    args = ap.parse_args(argv[1:])
+    check_langid_arguments(ap, args)
     if args.limit is not None:
         raise NotImplementedError
-    for fn in args.file:
-        process(fn, args)
-    if len(args.file) == 0:
-        process('/dev/stdin', args)    # sorry
+    if args.output_dir is not None:
+        return run_files(process, args.file, args, (args,))
+    with redirect_output(args):
+        for fn in args.file:
+            process(fn, args)
+        if len(args.file) == 0:
+            process('/dev/stdin', args)    # sorry
     return 0
 
 
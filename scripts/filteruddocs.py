@@ -4,18 +4,47 @@
 
 import sys
 import os
-import gzip
 import re
+import io
 
+from itertools import islice
 from collections import Counter, defaultdict
 from logging import warning, error
 
-from common import Word
-from filterdocs import argparser, filter_sentences
+from common import iter_conllu, print_document, batches, parallel_map
+from common import open_input, add_output_arguments, redirect_output
+from common import run_files, check_driver_arguments
+from filterdocs import filter_sentences, document_result, filter_table
+from filterdocs import TableMetrics, metrics_filename, table_results
+from filterdocs import check_table_size, DocumentMetrics, CountMetrics
+from filterdocs import metric_values, metric_settings
+from languageid import print_cache_stats, check_langid_arguments
+from metricstore import add_metric_store_arguments, stage_key
+from metricstore import load_metrics, save_metrics, count_reuse
+from metricstore import prefetch_metrics, flush_metrics, print_store_stats
 
 
 TEXT_COMMENT = '# text = '
 
+# Numbers of documents with values reused from and computed for
+# --metric-store, kept apart from the filter result stats
+_store_stats = Counter()
+
+
+def argparser():
+    from filterdocs import argparser as fd_argparser
+    ap = fd_argparser()
+    add_worker_arguments(ap)
+    add_metric_store_arguments(ap)
+    return ap
+
+
+def add_worker_arguments(ap):
+    ap.add_argument('--workers', default=None, type=int,
+                    help='number of worker processes (default no workers)')
+    ap.add_argument('--batch-size', default=100, type=int,
+                    help='number of documents per worker batch')
+
 
 def get_raw_text(comments):
     text_lines = [c for c in comments if c.startswith(TEXT_COMMENT)]
@@ -35,88 +64,172 @@ def get_sentence_texts(sentences, options):
     return texts
 
 
-def process_document(sentences, stats, options):
+def filter_document(sentences, stats, options):
     sentence_texts = get_sentence_texts(sentences, options)
-    fail = filter_sentences(sentence_texts, options)
-    if fail is None:
-        result = 'pass-all'
-        skip = False
+    if getattr(options, 'metric_store', None) is None:
+        fail = filter_sentences(sentence_texts, options, stats=stats)
     else:
-        result = 'fail-{}'.format(fail)
-        skip = True
-    stats[result] += 1
+        fail = filter_stored(sentences, sentence_texts, stats, options)
+    return document_result(fail, stats)
+
+
+def count_stored(reused):
+    count_reuse(_store_stats, reused)
+
+
+def take_store_stats():
+    """Return and reset counts of count_stored() in this process."""
+    stats = Counter(_store_stats)
+    _store_stats.clear()
+    return stats
+
+
+def filter_stored(sentences, sentence_texts, stats, options):
+    # filter_sentences() reusing metrics from --metric-store
+    stage = stage_key('filterdocs', metric_settings(options))
+    values, key = load_metrics(options, stage, sentences, sentence_texts)
+    count_stored(values is not None)
+    if values is not None:
+        # language is identified if needed and missing
+        metrics = CountMetrics(values, sentence_texts, stats)
+        fail = filter_sentences(sentence_texts, options, metrics)
+        if metrics.metric_values() != tuple(values):
+            save_metrics(options, stage, key, metrics.metric_values())
+        return fail
+    metrics = DocumentMetrics(sentence_texts, stats)
+    fail = filter_sentences(sentence_texts, options, metrics)
+    save_metrics(options, stage, key,
+                 metric_values(metrics, options, identify=False))
+    return fail
+
+
+def process_document(sentences, stats, options, out=None):
+    result, skip = filter_document(sentences, stats, options)
+    return output_document(sentences, result, skip, options, out)
+
+
+def process_table_document(document, stats, options, out=None):
+    # document is (sentences, label) with label from table_results()
+    sentences, fail = document
+    result, skip = document_result(fail, stats)
+    return output_document(sentences, result, skip, options, out)
+
+
+def output_document(sentences, result, skip, options, out=None):
     if options.invert:
         skip = not skip
     if skip:
         return 0
     else:
-        print('# filter_result = {}'.format(result))
-        for comments, words in sentences:
-            for c in comments:
-                print(c)
-            for w in words:
-                print('\t'.join(w))
-            print()
+        print_document(sentences, out,
+                       ['# filter_result = {}'.format(result)])
         return 1
 
 
-def is_document_boundary(comment):
-    return (comment.startswith('# doc_id = ') or
-            comment.startswith('# <doc '))
+_worker_state = {}
+
+
+def init_worker(process_document, options):
+    _worker_state['process_document'] = process_document
+    _worker_state['options'] = options
 
 
-def process_stream(f, name, options):
+def process_batch(documents):
+    # Run in worker process; return output, document and output counts,
+    # stats and --metric-store stats
+    process_document = _worker_state['process_document']
+    options = _worker_state['options']
     stats = defaultdict(int)
+    out = io.StringIO()
+    output_count = 0
+    prefetch_stored(documents, options)
+    for sentences in documents:
+        output_count += process_document(sentences, stats, options, out)
+    flush_metrics(options)
+    return (out.getvalue(), len(documents), output_count, stats,
+            take_store_stats())
+
+
+def prefetch_stored(documents, options):
+    # read --metric-store values of a batch of documents in one query
+    if (getattr(options, 'metric_store', None) is not None and
+            not getattr(options, 'metrics', False)):
+        prefetch_metrics(options, documents)
+
+
+def process_documents(documents, stats, options, process_document):
+    """Process documents, optionally in worker processes, yielding the
+    number of documents processed and output so far."""
     total_count, output_count = 0, 0
-    document_id, document_info, sentences = None, None, []
-    comments, words = [], []
-    for ln, l in enumerate(f, start=1):
-        l = l.rstrip('\n')
-        if not l or l.isspace():
-            sentences.append((comments, words))
-            comments, words = [], []
-        elif l.startswith('#'):
-            if is_document_boundary(l):
-                if sentences:
-                    output_count += process_document(sentences, stats, options)
-                    total_count += 1
-                sentences = []
-                if options.limit is not None and total_count >= options.limit:
-                    break
-            comments.append(l)
-        else:
-            words.append(Word(*l.split('\t')))
-        if ln % 100000 == 0:
-            print('processed {} lines ({} docs) ...'.format(ln, total_count),
-                  file=sys.stderr, flush=True)
-    if sentences:
-        output_count += process_document(sentences, stats, options)
-        total_count += 1
+    if not options.workers:
+        for batch in batches(documents, options.batch_size):
+            prefetch_stored(batch, options)
+            for sentences in batch:
+                output_count += process_document(sentences, stats, options)
+            total_count += len(batch)
+            yield total_count, output_count
+    else:
+        results = parallel_map(
+            process_batch, batches(documents, options.batch_size),
+            options.workers, init_worker, (process_document, options))
+        for output, size, count, batch_stats, store_stats in results:
+            sys.stdout.write(output)
+            for k, v in batch_stats.items():
+                stats[k] += v
+            _store_stats.update(store_stats)
+            total_count += size
+            output_count += count
+            yield total_count, output_count
+
+
+def process_stream(f, name, options, process_document=process_document):
+    stats = defaultdict(int)
+    total_count, output_count = 0, 0
+    def report(reader_stats):
+        print('processed {} lines ({} docs) ...'.format(
+            reader_stats['lines'], total_count), file=sys.stderr, flush=True)
+    documents = iter_conllu(f, lazy=True, report=report, raw=True)
+    if options.limit is not None:
+        documents = islice(documents, options.limit)
+    if getattr(options, 'metrics', False):
+        failed = filter_table(TableMetrics(metrics_filename(name)), options)
+        documents = zip(documents, table_results(name, failed))
+        process_document = process_table_document
+    for total_count, output_count in process_documents(
+            documents, stats, options, process_document):
+        pass
+    flush_metrics(options)
+    if getattr(options, 'metrics', False):
+        check_table_size(name, total_count, failed, options)
     for k, v in stats.items():
         print('{}:{}\t{}'.format(os.path.basename(name), k, v),
               file=sys.stderr, flush=True)
+    print_cache_stats(name, stats)
+    print_store_stats(name, take_store_stats())
     print('{}: output {}/{} ({:.1%})'.format(
         os.path.basename(name), output_count, total_count,
-        output_count/total_count), file=sys.stderr, flush=True)
+        output_count/max(total_count, 1)), file=sys.stderr, flush=True)
 
 
 def process(fn, *args):
-    if not fn.endswith('.gz'):
-        with open(fn) as f:
-            return process_stream(f, fn, *args)
-    else:
-        with gzip.open(fn, 'rt') as f:
-            return process_stream(f, fn, *args)
+    with open_input(fn) as f:
+        return process_stream(f, fn, *args)
 
 
 def main(argv):
-    args = argparser().parse_args(argv[1:])
-    for fn in args.file:
-        print('processing {} ...'.format(os.path.basename(fn)),
-              file=sys.stderr, flush=True)
-        process(fn, args)
-        print('completed {}.'.format(os.path.basename(fn)),
-              file=sys.stderr, flush=True)
+    ap = argparser()
+    args = ap.parse_args(argv[1:])
+    check_langid_arguments(ap, args)
+    check_driver_arguments(ap, args)
+    if args.output_dir is not None:
+        return run_files(process, args.file, args, (args,))
+    with redirect_output(args):
+        for fn in args.file:
+            print('processing {} ...'.format(os.path.basename(fn)),
+                  file=sys.stderr, flush=True)
+            process(fn, args)
+            print('completed {}.'.format(os.path.basename(fn)),
+                  file=sys.stderr, flush=True)
     return 0
 
 
@@ -4,15 +4,23 @@
 
 import sys
 import os
-import gzip
 import re
 
 from collections import Counter, defaultdict
 from logging import warning, error
 
-from common import Word, is_document_boundary
-from filtersents import filter_sentence
-from filteruddocs import get_sentence_texts
+import filteruddocs
+
+from common import print_document, open_input, add_output_arguments
+from common import mark_modified, run_files, check_driver_arguments
+from common import redirect_output
+from filtersents import filter_sentence, sentence_counts
+from filtersents import filter_sentence_counts
+from filteruddocs import get_sentence_texts, add_worker_arguments
+from filteruddocs import count_stored
+from languageid import model_key, check_langid_arguments
+from metricstore import add_metric_store_arguments, stage_key
+from metricstore import load_metrics, save_metrics
 
 
 NOUN_UPOS = set(['NOUN', 'PROPN'])
@@ -31,6 +39,8 @@ def argparser():
                     help='minimum number of nouns')
     ap.add_argument('-v', '--min-verbs', default=None, type=int,
                     help='minimum number of verbs')
+    add_worker_arguments(ap)
+    add_metric_store_arguments(ap)
     return ap
 
 
@@ -48,20 +58,79 @@ def filter_on_parse(words, options):
     return False
 
 
-def process_document(sentences, stats, options):
+def filter_on_upos_counts(nouns, verbs, options):
+    if options.min_nouns is not None and nouns < options.min_nouns:
+        return True
+    if options.min_verbs is not None and verbs < options.min_verbs:
+        return True
+    return False
+
+
+def sentence_rejects(sentences, sentence_texts, stats, options):
+    # "text", "parse" or None for each sentence
+    rejects = []
+    for (comments, words), sentence_text in zip(sentences, sentence_texts):
+        if filter_sentence(sentence_text, options, stats):
+            rejects.append('text')
+        elif filter_on_parse(words, options):
+            rejects.append('parse')
+        else:
+            rejects.append(None)
+    return rejects
+
+
+def stored_sentence_rejects(sentences, sentence_texts, stats, options):
+    # sentence_rejects() reusing counts from --metric-store, stored as
+    # sentence_counts() + [nouns, verbs, language] for each sentence
+    stage = stage_key('filtersents', options.langid_backend,
+                      model_key(options), options.langid_max_chars)
+    upos = [' '.join(w.upos for w in words) for comments, words in sentences]
+    values, key = load_metrics(options, stage, sentences,
+                               sentence_texts + upos)
+    count_stored(values is not None)
+    changed = values is None
+    if values is None:
+        values = [
+            sentence_counts(sentence_text) + [
+                upos_count(words, NOUN_UPOS), upos_count(words, VERB_UPOS),
+                None
+            ]
+            for (comments, words), sentence_text
+            in zip(sentences, sentence_texts)
+        ]
+    rejects = []
+    for v, sentence_text in zip(values, sentence_texts):
+        counts, nouns, verbs, lang = v[:7], v[7], v[8], v[9]
+        reject, v[9] = filter_sentence_counts(counts, lang, sentence_text,
+                                              options, stats)
+        changed = changed or v[9] != lang
+        if reject:
+            rejects.append('text')
+        elif filter_on_upos_counts(nouns, verbs, options):
+            rejects.append('parse')
+        else:
+            rejects.append(None)
+    if changed:
+        save_metrics(options, stage, key, values)
+    return rejects
+
+
+def filter_document(sentences, stats, options):
     sentence_texts = get_sentence_texts(sentences, options)
+    if getattr(options, 'metric_store', None) is None:
+        rejects = sentence_rejects(sentences, sentence_texts, stats, options)
+    else:
+        rejects = stored_sentence_rejects(sentences, sentence_texts, stats,
+                                          options)
     failed, passed = 0, 0
-    for sentence, sentence_text in zip(sentences, sentence_texts):
-        comments, words = sentence
-        if filter_sentence(sentence_text, options):
-            comments.append('# sentfilter = reject-text')
-            failed += 1
-        elif filter_on_parse(words, options):
-            comments.append('# sentfilter = reject-parse')
+    for (comments, words), reject in zip(sentences, rejects):
+        if reject is not None:
+            comments.append('# sentfilter = reject-{}'.format(reject))
             failed += 1
         else:
             comments.append('# sentfilter = pass')
             passed += 1
+    mark_modified(sentences)
     ratio = failed / (failed+passed)
     if ((ratio < options.reject_ratio) and
         (options.max_reject is None or failed < options.max_reject)):
@@ -71,74 +140,45 @@ def process_document(sentences, stats, options):
         result = 'fail'
         skip = True
     stats[result] += 1
+    comment = '# sentfilter_result = {} ({}/{} = {:.1%})'.format(
+        result, failed, failed+passed, ratio)
+    return comment, skip
+
+
+def process_document(sentences, stats, options, out=None):
+    comment, skip = filter_document(sentences, stats, options)
     if options.invert:
         skip = not skip
     if skip:
         return 0
     else:
-        print('# sentfilter_result = {} ({}/{} = {:.1%})'.format(
-                result, failed, failed+passed, ratio))
-        for comments, words in sentences:
-            for c in comments:
-                print(c)
-            for w in words:
-                print('\t'.join(w))
-            print()
+        print_document(sentences, out, [comment])
         return 1
 
 
 def process_stream(f, name, options):
-    stats = defaultdict(int)
-    total_count, output_count = 0, 0
-    document_id, document_info, sentences = None, None, []
-    comments, words = [], []
-    for ln, l in enumerate(f, start=1):
-        l = l.rstrip('\n')
-        if not l or l.isspace():
-            sentences.append((comments, words))
-            comments, words = [], []
-        elif l.startswith('#'):
-            if is_document_boundary(l):
-                if sentences:
-                    output_count += process_document(sentences, stats, options)
-                    total_count += 1
-                sentences = []
-                if options.limit is not None and total_count >= options.limit:
-                    break
-            comments.append(l)
-        else:
-            words.append(Word(*l.split('\t')))
-        if ln % 100000 == 0:
-            print('processed {} lines ({} docs) ...'.format(ln, total_count),
-                  file=sys.stderr, flush=True)
-    if sentences:
-        output_count += process_document(sentences, stats, options)
-        total_count += 1
-    for k, v in stats.items():
-        print('{}:{}\t{}'.format(os.path.basename(name), k, v),
-              file=sys.stderr, flush=True)
-    print('{}: output {}/{} ({:.1%})'.format(
-        os.path.basename(name), output_count, total_count,
-        output_count/total_count), file=sys.stderr, flush=True)
+    return filteruddocs.process_stream(f, name, options, process_document)
 
 
 def process(fn, *args):
-    if not fn.endswith('.gz'):
-        with open(fn) as f:
-            return process_stream(f, fn, *args)
-    else:
-        with gzip.open(fn, 'rt') as f:
-            return process_stream(f, fn, *args)
+    with open_input(fn) as f:
+        return process_stream(f, fn, *args)
 
 
 def main(argv):
-    args = argparser().parse_args(argv[1:])
-    for fn in args.file:
-        print('processing {} ...'.format(os.path.basename(fn)),
-              file=sys.stderr, flush=True)
-        process(fn, args)
-        print('completed {}.'.format(os.path.basename(fn)),
-              file=sys.stderr, flush=True)
+    ap = argparser()
+    args = ap.parse_args(argv[1:])
+    check_langid_arguments(ap, args)
+    check_driver_arguments(ap, args)
+    if args.output_dir is not None:
+        return run_files(process, args.file, args, (args,))
+    with redirect_output(args):
+        for fn in args.file:
+            print('processing {} ...'.format(os.path.basename(fn)),
+                  file=sys.stderr, flush=True)
+            process(fn, args)
+            print('completed {}.'.format(os.path.basename(fn)),
+                  file=sys.stderr, flush=True)
     return 0
 
 
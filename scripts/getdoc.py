@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+
+# Fetch CoNLL-U documents by doc_id using an index from indexconllu.py.
+
+import sys
+
+from indexconllu import DocumentReader, lookup, index_filename
+
+
+def argparser():
+    from argparse import ArgumentParser
+    ap = ArgumentParser(description='Get CoNLL-U documents by doc_id')
+    ap.add_argument('-i', '--index', default=None,
+                    help='index file (default DATA.idx)')
+    ap.add_argument('data')
+    ap.add_argument('doc_id', nargs='+')
+    return ap
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+    index = args.index if args.index is not None else index_filename(args.data)
+    reader = DocumentReader(args.data)
+    missing = 0
+    try:
+        for doc_id in args.doc_id:
+            entries = lookup(index, doc_id)
+            if not entries:
+                print('{} not found'.format(doc_id), file=sys.stderr)
+                missing += 1
+            for e in entries:
+                sys.stdout.buffer.write(reader.read(e))
+    finally:
+        reader.close()
+    return 1 if missing else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -4,12 +4,16 @@
 
 import sys
 import os
-import gzip
 import re
 
-from collections import Counter, namedtuple
+from collections import Counter
 from logging import warning, error
 
+from common import iter_conllu, add_dedup_arguments, drop_seen_sentences
+from common import check_dedup_arguments, close_bloom_filters
+from common import open_input, add_output_arguments, redirect_output
+from common import add_driver_arguments, run_files
+
 
 TEXT_COMMENT = '# text = '
 
@@ -22,24 +26,6 @@ DOC_CRAWL2_RE = re.compile(r'^#\s+<doc\b.*\bfile="([^"]+)".*\burn="<(.*?)>".*>')
 
 DOC_CRAWL3_RE = re.compile(r'^#\s+<doc\b.*\burn="<(.*?)>".*\bfile="([^"]+)".*>')
 
-# https://universaldependencies.org/format.html
-CONLLU_FIELDS = [
-    'id',
-    'form',
-    'lemma',
-    'upos',
-    'xpos',
-    'feats',
-    'head',
-    'deprel',
-    'deps',
-    'misc',
-]
-
-
-Word = namedtuple('Word', CONLLU_FIELDS)
-
-
 LABEL_COMMENTS = [
     '# filter_result =',
     '# sentfilter_result =',
@@ -56,6 +42,9 @@ def argparser():
                     help='include document label comments')
     ap.add_argument('-t', '--tokenized', default=False, action='store_true',
                     help='get tokenized text (default raw)')
+    add_dedup_arguments(ap)
+    add_output_arguments(ap)
+    add_driver_arguments(ap)
     ap.add_argument('data', nargs='+')
     return ap
 
@@ -74,60 +63,54 @@ def get_label_comments(comments):
         if any(c.startswith(l) for l in LABEL_COMMENTS)
     ]
 
-def process_document(sentences, options):
+def get_document_lines(sentences, options):
+    labels, texts = [], []
     for i, (comments, words) in enumerate(sentences):
         if options.labels and i == 0:
-            for c in get_label_comments(comments):
-                print(c)
+            labels.extend(get_label_comments(comments))
         if options.tokenized:
             raise NotImplementedError
         else:
-            print(get_text(comments))
-    print()
+            texts.append(get_text(comments))
+    texts = drop_seen_sentences(texts, options)
+    if not texts:
+        return []
+    return labels + texts
 
 
-def is_document_boundary(comment):
-    return (comment.startswith('# doc_id = ') or
-            comment.startswith('# <doc '))
+def process_document(sentences, options):
+    lines = get_document_lines(sentences, options)
+    if not lines:
+        return
+    sys.stdout.write('\n'.join(lines) + '\n\n')
 
 
 def process_stream(f, options):
-    document_id, document_info, sentences = None, None, []
-    comments, words = [], []
-    for ln, l in enumerate(f, start=1):
-        l = l.rstrip('\n')
-        if not l or l.isspace():
-            sentences.append((comments, words))
-            comments, words = [], []
-        elif l.startswith('#'):
-            if is_document_boundary(l):
-                if sentences:
-                    process_document(sentences, options)
-                sentences = []
-            comments.append(l)
-        else:
-            words.append(Word(*l.split('\t')))
-    if sentences:
+    for sentences in iter_conllu(f, lazy=True):
         process_document(sentences, options)
 
 
 def process(fn, options):
-    if not fn.endswith('.gz'):
-        with open(fn) as f:
-            return process_stream(f, options)
-    else:
-        with gzip.open(fn, 'rt') as f:
-            return process_stream(f, options)
+    with open_input(fn) as f:
+        return process_stream(f, options)
 
 
 def main(argv):
-    args = argparser().parse_args(argv[1:])
-    for fn in args.data:
-        print('processing {} ...'.format(os.path.basename(fn)),
-              file=sys.stderr)
-        process(fn, args)
-        print('completed {}.'.format(os.path.basename(fn)),
-              file=sys.stderr)
+    ap = argparser()
+    args = ap.parse_args(argv[1:])
+    check_dedup_arguments(ap, args, args.jobs)
+    try:
+        if args.output_dir is not None:
+            return run_files(process, args.data, args, (args,))
+        with redirect_output(args):
+            for fn in args.data:
+                print('processing {} ...'.format(os.path.basename(fn)),
+                      file=sys.stderr)
+                process(fn, args)
+                print('completed {}.'.format(os.path.basename(fn)),
+                      file=sys.stderr)
+    finally:
+        close_bloom_filters()
     return 0
 
 
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+# Index CoNLL-U documents by doc_id for random access.
+#
+# Gzipped data is (re)written as "block gzip", i.e. a sequence of gzip
+# members that each start at a document boundary. The result is a valid
+# gzip file, but a document can be read by decompressing only the member
+# containing it. The index is a TSV file (DATA.idx by default) with
+# lines "DOC_ID ORDINAL BLOCK OFFSET LENGTH" sorted by doc_id (as UTF-8
+# bytes, the order in which lookup() compares them) and ordinal, where
+# BLOCK is the byte offset of the gzip member (of the document for
+# uncompressed data), OFFSET the offset of the document in the
+# decompressed member (0 for uncompressed data) and LENGTH its length
+# in bytes.
+
+import sys
+import os
+import re
+import gzip
+import zlib
+
+from collections import namedtuple
+
+from common import is_document_boundary, parse_document_comment
+from common import DOC_ID_COMMENT
+
+
+IndexEntry = namedtuple('IndexEntry', 'doc_id ordinal block offset length')
+
+# Blank lines containing whitespace, which common.iter_conllu() treats
+# as sentence separators and outputs as empty lines
+SPACE_LINE_RE = re.compile(r'^[^\S\n]+$', re.M)
+
+ASCII_SPACE = frozenset(b' \t\r\x0b\x0c')
+
+
+def argparser():
+    from argparse import ArgumentParser
+    ap = ArgumentParser(description='Index CoNLL-U documents by doc_id')
+    ap.add_argument('-o', '--output', default=None,
+                    help='write data to OUTPUT (block gzip if .gz) and index'
+                    ' it (required for .gz input)')
+    ap.add_argument('-b', '--block-size', default=2**18, type=int,
+                    help='uncompressed size of gzip blocks in bytes')
+    ap.add_argument('-l', '--compresslevel', default=6, type=int,
+                    help='gzip compression level')
+    ap.add_argument('data')
+    return ap
+
+
+def index_filename(fn):
+    return '{}.idx'.format(fn)
+
+
+def boundary_doc_id(comment):
+    if comment.startswith(DOC_ID_COMMENT):
+        return comment[len(DOC_ID_COMMENT):]
+    else:
+        return parse_document_comment(comment)[0]
+
+
+def is_blank(line):
+    """Return whether binary line is blank as in common.iter_conllu()."""
+    line = line.rstrip(b'\n')
+    if not line:
+        return True
+    elif line[0] in ASCII_SPACE or line[0] >= 0x80:
+        return line.decode('utf-8').isspace()
+    else:
+        return False
+
+
+def normalize_document(text):
+    """Return document text with blank lines as in common.iter_conllu()
+    output, i.e. whitespace-only lines replaced with empty lines."""
+    terminated = text.endswith('\n')
+    text, count = SPACE_LINE_RE.subn('', text)
+    if count and not terminated:
+        text += '\n'
+    return text
+
+
+def iter_raw_documents(f):
+    """Generate (doc_id, data) for documents in binary CoNLL-U file f,
+    splitting documents as common.iter_conllu() does."""
+    lines, sentence_start, has_sentences = [], 0, False
+    doc_id = '<UNKNOWN>'
+    for l in f:
+        if is_blank(l):
+            has_sentences = True
+            lines.append(l)
+            sentence_start = len(lines)
+            continue
+        if l.startswith(b'#'):
+            comment = l.decode('utf-8').rstrip('\n')
+            if is_document_boundary(comment):
+                if has_sentences:
+                    yield doc_id, b''.join(lines[:sentence_start])
+                    lines = lines[sentence_start:]
+                    sentence_start, has_sentences = 0, False
+                doc_id = boundary_doc_id(comment)
+        lines.append(l)
+    if lines:
+        yield doc_id, b''.join(lines)
+
+
+class BlockGzipWriter(object):
+    def __init__(self, f, block_size, compresslevel):
+        self.f = f
+        self.block_size = block_size
+        self.compresslevel = compresslevel
+        self.block = self.f.tell()
+        self.buffer = []
+        self.buffer_size = 0
+
+    def write(self, data):
+        """Write data, return (block, offset) where it starts."""
+        if self.buffer_size >= self.block_size:
+            self.flush()
+        offset = self.buffer_size
+        self.buffer.append(data)
+        self.buffer_size += len(data)
+        return self.block, offset
+
+    def flush(self):
+        if self.buffer:
+            self.f.write(gzip.compress(b''.join(self.buffer),
+                                       self.compresslevel))
+        self.block = self.f.tell()
+        self.buffer = []
+        self.buffer_size = 0
+
+
+def index_key(doc_id):
+    # lines of doc_id in the index start with this
+    return doc_id.encode('utf-8') + b'\t'
+
+
+def write_index(fn, entries):
+    entries.sort(key=lambda e: (index_key(e.doc_id), e.ordinal))
+    with open(fn, 'w', encoding='utf-8') as f:
+        for e in entries:
+            print('\t'.join(str(v) for v in e), file=f)
+
+
+def parse_index_line(line):
+    doc_id, ordinal, block, offset, length = line.rstrip('\n').split('\t')
+    return IndexEntry(doc_id, int(ordinal), int(block), int(offset),
+                      int(length))
+
+
+def load_index(fn):
+    with open(fn, encoding='utf-8') as f:
+        return [parse_index_line(l) for l in f]
+
+
+def lookup(fn, doc_id):
+    """Return index entries for doc_id by binary search in index file."""
+    key = index_key(doc_id)
+    with open(fn, 'rb') as f:
+        # lo is a line start with all lines before it < key, and all
+        # lines starting at or after hi are >= key
+        lo, hi = 0, os.path.getsize(fn)
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            f.seek(mid - 1)
+            f.readline()    # to first line start >= mid
+            line = f.readline()
+            if line and line < key:
+                lo = f.tell()
+            else:
+                hi = mid
+        f.seek(lo)
+        entries = []
+        for line in f:
+            if line < key:
+                continue
+            elif not line.startswith(key):
+                break
+            entries.append(parse_index_line(line.decode('utf-8')))
+    return entries
+
+
+class DocumentReader(object):
+    """Read indexed documents, caching the last decompressed block."""
+
+    def __init__(self, fn):
+        self.f = open(fn, 'rb')
+        self.gzipped = fn.endswith('.gz')
+        self.cached_block, self.cached_data = None, None
+
+    def read_block(self, block):
+        if block != self.cached_block:
+            self.f.seek(block)
+            d = zlib.decompressobj(wbits=31)
+            data = []
+            while not d.eof:
+                chunk = self.f.read(2**16)
+                if not chunk:
+                    break
+                data.append(d.decompress(chunk))
+            self.cached_block, self.cached_data = block, b''.join(data)
+        return self.cached_data
+
+    def read(self, entry):
+        if not self.gzipped:
+            self.f.seek(entry.block)
+            return self.f.read(entry.length)
+        data = self.read_block(entry.block)
+        return data[entry.offset:entry.offset+entry.length]
+
+    def close(self):
+        self.f.close()
+
+
+def index_plain(fn):
+    entries, position = [], 0
+    with open(fn, 'rb') as f:
+        for ordinal, (doc_id, data) in enumerate(iter_raw_documents(f)):
+            entries.append(IndexEntry(doc_id.replace('\t', ' '), ordinal,
+                                      position, 0, len(data)))
+            position += len(data)
+    return entries
+
+
+def index_copy(fn, output, options):
+    entries = []
+    opener = gzip.open if fn.endswith('.gz') else open
+    with opener(fn, 'rb') as f, open(output, 'wb') as out:
+        if output.endswith('.gz'):
+            writer = BlockGzipWriter(out, options.block_size,
+                                     options.compresslevel)
+        else:
+            writer = None
+        for ordinal, (doc_id, data) in enumerate(iter_raw_documents(f)):
+            if writer is not None:
+                block, offset = writer.write(data)
+            else:
+                block, offset = out.tell(), 0
+                out.write(data)
+            entries.append(IndexEntry(doc_id.replace('\t', ' '), ordinal,
+                                      block, offset, len(data)))
+            if (ordinal+1) % 100000 == 0:
+                print('indexed {} docs ...'.format(ordinal+1),
+                      file=sys.stderr, flush=True)
+        if writer is not None:
+            writer.flush()
+    return entries
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+    if args.output is None:
+        if args.data.endswith('.gz'):
+            print('gzipped data must be written as block gzip with -o',
+                  file=sys.stderr)
+            return 1
+        output = args.data
+        entries = index_plain(args.data)
+    else:
+        output = args.output
+        entries = index_copy(args.data, output, args)
+    write_index(index_filename(output), entries)
+    print('indexed {} documents in {}'.format(len(entries), output),
+          file=sys.stderr, flush=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+
+# Language identification backends for the --langdetect filters.
+#
+# The "langdetect" backend runs langdetect (slow, non-deterministic
+# unless seeded). The "nb" backend is a character n-gram Naive Bayes
+# classifier trained with trainlangid.py and saved with save_arrays().
+# Results can be cached on disk with --langid-cache.
+
+import sys
+import os
+
+import numpy as np
+
+from collections import Counter
+from functools import lru_cache
+from hashlib import md5
+from time import time
+
+from common import save_arrays, load_arrays
+
+
+LANGID_BACKENDS = ['langdetect', 'nb']
+
+
+def add_langid_arguments(ap):
+    ap.add_argument('--langid-backend', choices=LANGID_BACKENDS,
+                    default='langdetect',
+                    help='language identification backend for --langdetect')
+    ap.add_argument('--langid-model', default=None,
+                    help='model for nb backend (see trainlangid.py)')
+    ap.add_argument('--langid-max-chars', default=None, type=int,
+                    help='identify language from at most this many chars')
+    ap.add_argument('--langid-sentences', default=None, type=int,
+                    help='identify document language from at most this many'
+                    ' sentences')
+    ap.add_argument('--langid-cache', default=None, metavar='FILE',
+                    help='cache language identification results in FILE')
+    ap.add_argument('--langid-cache-size', default=10000000, type=int,
+                    help='maximum number of cached results')
+
+
+def check_langid_arguments(ap, args):
+    """Report invalid add_langid_arguments() combinations with ap.error()."""
+    if args.langid_backend == 'nb' and args.langid_model is None:
+        ap.error('--langid-model required for --langid-backend nb')
+
+
+class LangdetectIdentifier(object):
+    def __init__(self):
+        from langdetect import detect, DetectorFactory
+        # Make langdetect deterministic
+        DetectorFactory.seed = 0
+        self.detect = detect
+
+    def identify(self, text):
+        try:
+            return self.detect(text)
+        except:
+            return None
+
+
+def char_ngrams(text, ngram_range):
+    """Return Counter of character n-grams of normalized text."""
+    text = ' {} '.format(' '.join(text.lower().split()))
+    min_n, max_n = ngram_range
+    counts = Counter()
+    for n in range(min_n, max_n+1):
+        counts.update(text[i:i+n] for i in range(len(text)-n+1))
+    return counts
+
+
+class NaiveBayesIdentifier(object):
+    """Multinomial Naive Bayes over character n-grams."""
+
+    def __init__(self, fn):
+        arrays, meta = load_arrays(fn)
+        self.prior = arrays['prior']
+        self.logprob = arrays['logprob']
+        self.classes = meta['classes']
+        self.ngram_range = tuple(meta['ngram_range'])
+        self.vocabulary = { g: i for i, g in enumerate(meta['ngrams']) }
+
+    def identify(self, text):
+        indices, counts = [], []
+        for g, c in char_ngrams(text, self.ngram_range).items():
+            i = self.vocabulary.get(g)
+            if i is not None:
+                indices.append(i)
+                counts.append(c)
+        if not indices:
+            return None
+        scores = self.prior + np.dot(counts, self.logprob[indices])
+        return self.classes[int(np.argmax(scores))]
+
+
+def save_nb_model(fn, classes, prior, logprob, ngrams, ngram_range):
+    meta = {
+        'classes': classes,
+        'ngrams': ngrams,
+        'ngram_range': list(ngram_range),
+    }
+    save_arrays(fn, { 'prior': prior, 'logprob': logprob }, meta)
+
+
+_identifiers = {}
+
+
+def get_identifier(backend='langdetect', model=None):
+    key = (backend, model)
+    if key not in _identifiers:
+        if backend == 'langdetect':
+            _identifiers[key] = LangdetectIdentifier()
+        elif backend == 'nb':
+            if model is None:
+                raise ValueError('--langid-model required for nb backend')
+            _identifiers[key] = NaiveBayesIdentifier(model)
+        else:
+            raise ValueError('unknown backend {}'.format(backend))
+    return _identifiers[key]
+
+
+class LangidCache(object):
+    """Persistent language identification cache in an sqlite file.
+
+    New results are committed immediately so that they survive worker
+    processes being terminated. Access times of hits are written in
+    batches and used to evict the least recently used entries when
+    the cache grows past max_size. The size is counted once when opened
+    and then tracked from inserts (an upper bound, as replaced keys and
+    other processes are not accounted for), counting again only before
+    evicting."""
+
+    def __init__(self, fn, max_size, update_interval=1000):
+        import sqlite3
+        self.db = sqlite3.connect(fn, timeout=600, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=OFF')
+        self.db.execute('CREATE TABLE IF NOT EXISTS langid '
+                        '(key BLOB PRIMARY KEY, lang TEXT, used REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS langid_used '
+                        'ON langid (used)')
+        self.max_size = max_size
+        self.update_interval = update_interval
+        self.used = {}
+        self.inserts = 0
+        self.size = self.count()
+
+    def get(self, key):
+        """Return (True, lang) if key is cached, (False, None) if not."""
+        row = self.db.execute('SELECT lang FROM langid WHERE key = ?',
+                              (key,)).fetchone()
+        if row is None:
+            return False, None
+        self.used[key] = time()
+        if len(self.used) >= self.update_interval:
+            self.flush()
+        return True, row[0]
+
+    def put(self, key, lang):
+        self.db.execute('INSERT OR REPLACE INTO langid VALUES (?, ?, ?)',
+                        (key, lang, time()))
+        self.inserts += 1
+        self.size += 1
+        if self.inserts % self.update_interval == 0:
+            self.evict()
+
+    def flush(self):
+        self.db.execute('BEGIN')
+        self.db.executemany('UPDATE langid SET used = ? WHERE key = ?',
+                            [(t, k) for k, t in self.used.items()])
+        self.db.execute('COMMIT')
+        self.used = {}
+
+    def count(self):
+        return self.db.execute('SELECT COUNT(*) FROM langid').fetchone()[0]
+
+    def evict(self):
+        if self.size <= self.max_size:
+            return
+        self.size = self.count()
+        if self.size > self.max_size:
+            self.flush()
+            # evict down to 90% of max_size to avoid evicting on every check
+            evicted = self.size - int(0.9 * self.max_size)
+            self.db.execute('DELETE FROM langid WHERE key IN (SELECT key '
+                            'FROM langid ORDER BY used LIMIT ?)',
+                            (evicted,))
+            self.size -= evicted
+
+    def close(self):
+        if self.used:
+            self.flush()
+        self.evict()
+        self.db.close()
+
+
+_caches = {}
+
+
+def get_cache(fn, max_size):
+    if fn not in _caches:
+        import atexit
+        _caches[fn] = LangidCache(fn, max_size)
+        atexit.register(_caches[fn].close)
+    return _caches[fn]
+
+
+def model_key(options):
+    # path and modification time of --langid-model
+    if options.langid_model is None:
+        return None
+    else:
+        return model_file_key(options.langid_model)
+
+
+@lru_cache(maxsize=None)
+def model_file_key(fn):
+    # once per process, the model is not expected to change during a run
+    return '{}:{}'.format(os.path.abspath(fn), os.path.getmtime(fn))
+
+
+def cache_key(text, options):
+    # hash of backend, model and whitespace-normalized text
+    model = model_key(options)
+    text = ' '.join(text.split())
+    key = '{}\t{}\t{}'.format(options.langid_backend, model, text)
+    return md5(key.encode('utf-8')).digest()
+
+
+def sample_sentences(sentences, count):
+    # evenly spaced sentences starting from the first
+    if count is None or len(sentences) <= count:
+        return sentences
+    step = len(sentences) / count
+    return [sentences[int(i*step)] for i in range(count)]
+
+
+def sample_text(text, max_chars):
+    # prefix of text, cut at a space if possible
+    if max_chars is None or len(text) <= max_chars:
+        return text
+    cut = text.rfind(' ', 0, max_chars+1)
+    return text[:cut if cut > 0 else max_chars]
+
+
+def identify_text(text, options=None, stats=None):
+    """Return language of text, or None if not identified.
+
+    If stats is given, cache hits and misses are counted in it."""
+    if options is None:
+        return get_identifier().identify(text)
+    identifier = get_identifier(options.langid_backend, options.langid_model)
+    text = sample_text(text, options.langid_max_chars)
+    if options.langid_cache is None:
+        return identifier.identify(text)
+    cache = get_cache(options.langid_cache, options.langid_cache_size)
+    key = cache_key(text, options)
+    found, lang = cache.get(key)
+    if not found:
+        lang = identifier.identify(text)
+        cache.put(key, lang)
+    if stats is not None:
+        stats['langid-cache-hit' if found else 'langid-cache-miss'] += 1
+    return lang
+
+
+def identify_document(sentences, options=None, stats=None):
+    if options is not None:
+        sentences = sample_sentences(sentences, options.langid_sentences)
+    return identify_text(' '.join(sentences), options, stats)
+
+
+def print_cache_stats(name, stats):
+    hits = stats.get('langid-cache-hit', 0)
+    total = hits + stats.get('langid-cache-miss', 0)
+    if total:
+        print('{}: langid cache hits {}/{} ({:.1%})'.format(
+            os.path.basename(name), hits, total, hits/total),
+              file=sys.stderr, flush=True)
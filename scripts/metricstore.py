@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+# Persistent store of per-document metrics for --metric-store.
+#
+# Filters and classifiers save the values their decisions are based on
+# (metric counts, language labels, decision function values without
+# bias) keyed by stage, document id and a hash of the document content
+# the values depend on. Reruns with different thresholds or bias reuse
+# stored values and only compute those that are missing or stale.
+
+import sys
+import os
+import json
+
+from hashlib import md5
+
+from common import get_document_id
+
+
+def add_metric_store_arguments(ap):
+    ap.add_argument('--metric-store', default=None, metavar='FILE',
+                    help='store per-document metrics in FILE and reuse'
+                    ' them for unchanged documents')
+
+
+class MetricStore(object):
+    """Per-document values in an sqlite file.
+
+    Values of a batch of documents can be read with one query with
+    prefetch(). New values are written in transactions of up to
+    write_interval values by flush(), which processes call at the end
+    of each batch and file so that the values survive worker processes
+    being terminated (cf. languageid.LangidCache)."""
+
+    # maximum number of ids per query (SQLITE_MAX_VARIABLE_NUMBER is 999
+    # in older SQLite versions)
+    query_size = 500
+
+    def __init__(self, fn, write_interval=1000):
+        import sqlite3
+        self.db = sqlite3.connect(fn, timeout=600, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=OFF')
+        self.db.execute('CREATE TABLE IF NOT EXISTS metrics '
+                        '(stage TEXT, doc_id TEXT, hash BLOB, value TEXT, '
+                        'PRIMARY KEY (stage, doc_id))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS metrics_doc_id '
+                        'ON metrics (doc_id)')
+        self.write_interval = write_interval
+        self.prefetched_ids = set()
+        self.prefetched = {}
+        self.pending = {}
+
+    def prefetch(self, doc_ids):
+        """Read stored values of doc_ids in all stages for get(),
+        replacing values read by previous calls."""
+        self.prefetched_ids = set(doc_ids)
+        self.prefetched = {}
+        doc_ids = sorted(self.prefetched_ids)
+        for i in range(0, len(doc_ids), self.query_size):
+            chunk = doc_ids[i:i+self.query_size]
+            rows = self.db.execute(
+                'SELECT stage, doc_id, hash, value FROM metrics WHERE '
+                'doc_id IN ({})'.format(','.join('?' * len(chunk))), chunk)
+            for stage, doc_id, hash_, value in rows:
+                self.prefetched[(stage, doc_id)] = (hash_, value)
+
+    def get(self, stage, doc_id, hash_):
+        """Return stored value, or None if missing or stale."""
+        key = (stage, doc_id)
+        if key in self.pending:
+            row = self.pending[key]
+        elif doc_id in self.prefetched_ids:
+            row = self.prefetched.get(key)
+        else:
+            row = self.db.execute('SELECT hash, value FROM metrics WHERE '
+                                  'stage = ? AND doc_id = ?', key).fetchone()
+        if row is None or row[0] != hash_:
+            return None
+        return json.loads(row[1])
+
+    def put(self, stage, doc_id, hash_, value):
+        self.pending[(stage, doc_id)] = (hash_, json.dumps(value))
+        if len(self.pending) >= self.write_interval:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        self.db.execute('BEGIN')
+        self.db.executemany('INSERT OR REPLACE INTO metrics '
+                            'VALUES (?, ?, ?, ?)',
+                            [k + v for k, v in self.pending.items()])
+        self.db.execute('COMMIT')
+        self.pending = {}
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+
+_stores = {}
+
+
+def get_store(fn):
+    if fn not in _stores:
+        import atexit
+        _stores[fn] = MetricStore(fn)
+        atexit.register(_stores[fn].close)
+    return _stores[fn]
+
+
+def stage_key(name, *values):
+    # name and hash of settings that the stored values depend on
+    return '{}:{}'.format(name, md5(repr(values).encode('utf-8')).hexdigest())
+
+
+def content_hash(texts):
+    return md5('\n'.join(texts).encode('utf-8')).digest()
+
+
+def document_key(sentences, texts):
+    """Return (document id, content hash) for document with texts that
+    metrics are computed from. Documents without an id are keyed by
+    content only."""
+    hash_ = content_hash(texts)
+    doc_id = get_document_id(sentences)
+    if doc_id == '<UNKNOWN>':
+        doc_id = hash_.hex()
+    return doc_id, hash_
+
+
+def load_metrics(options, stage, sentences, texts):
+    """Return (value or None, key) for document from --metric-store."""
+    key = document_key(sentences, texts)
+    return get_store(options.metric_store).get(stage, *key), key
+
+
+def save_metrics(options, stage, key, value):
+    get_store(options.metric_store).put(stage, key[0], key[1], value)
+
+
+def prefetch_metrics(options, documents):
+    """Read --metric-store values of documents with ids for load_metrics()
+    in one query."""
+    doc_ids = [get_document_id(sentences) for sentences in documents]
+    get_store(options.metric_store).prefetch(
+        [d for d in doc_ids if d != '<UNKNOWN>'])
+
+
+def flush_metrics(options):
+    """Write values saved with save_metrics() to --metric-store, if any."""
+    if getattr(options, 'metric_store', None) is not None:
+        get_store(options.metric_store).flush()
+
+
+def count_reuse(stats, reused):
+    stats['metric-store-hit' if reused else 'metric-store-miss'] += 1
+
+
+def print_store_stats(name, stats):
+    hits = stats.get('metric-store-hit', 0)
+    total = hits + stats.get('metric-store-miss', 0)
+    if total:
+        print('{}: metric store hits {}/{} ({:.1%})'.format(
+            os.path.basename(name), hits, total, hits/total),
+              file=sys.stderr, flush=True)
@@ -4,22 +4,22 @@
 
 import sys
 import os
-import gzip
 import re
 import json
-import urllib.parse
-
-from collections import Counter, namedtuple
-from logging import warning, error
 
+import numpy as np
 
-DOC_COLLECTION_RE = re.compile(r'^#\s+<doc\s+collection="([^"]+)"\s+url="(.*)">')
-
-DOC_CRAWL_RE = re.compile(r'^#\s+<doc\s+id="([^"]+)"\s.*?\burl="(.*?)"\s+langdiff="([^"]+)"\s*>')
+from collections import Counter
+from logging import warning, error
 
-DOC_CRAWL2_RE = re.compile(r'^#\s+<doc\b.*\bfile="([^"]+)".*\burn="<(.*?)>".*>')
+from common import iter_conllu, is_document_boundary, FormClassifier
+from common import parse_document_comment, open_input, parallel_map
+from common import DOC_COLLECTION_RE, DOC_CRAWL_RE, DOC_CRAWL2_RE
+from common import DOC_CRAWL3_RE
+from common import add_output_arguments, redirect_output
+from common import add_driver_arguments, run_files
+from conllucache import is_conllu_cache, ConlluCache
 
-DOC_CRAWL3_RE = re.compile(r'^#\s+<doc\b.*\burn="<(.*?)>".*\bfile="([^"]+)".*>')
 
 URL_RE = re.compile(r'^s?http://', re.U)
 
@@ -33,27 +33,37 @@ WORDNUM_RE = re.compile(r'^[a-zA-ZäöÄ0-9-][a-zA-ZäöÄÖ0-9,.-]*$', re.U)
 
 PUNCT_RE = re.compile(r'^[.,:;()\[\]%]+$', re.U)
 
-# https://universaldependencies.org/format.html
-CONLLU_FIELDS = [
-    'id',
-    'form',
-    'lemma',
-    'upos',
-    'xpos',
-    'feats',
-    'head',
-    'deprel',
-    'deps',
-    'misc',
-]
+FORM_CLASSIFIER = FormClassifier([
+    ('url', URL_RE),
+    ('tag', TAG_RE),
+    ('word', WORD_RE),
+    ('number', NUMBER_RE),
+    ('wordnum', WORDNUM_RE),
+    ('punct', PUNCT_RE),
+])
 
+FORM_COUNT_KEYS = {
+    k: '{}-count'.format(k)
+    for k in ('url', 'tag', 'word', 'number', 'wordnum', 'punct', 'other')
+}
 
-Word = namedtuple('Word', CONLLU_FIELDS)
+FORM_CLASSES = sorted(FORM_COUNT_KEYS)
+
+FORM_CLASS_ID = { k: i for i, k in enumerate(FORM_CLASSES) }
+
+# Group of all documents in aggregate statistics
+ALL_GROUP = 'all'
 
 
 def argparser():
     from argparse import ArgumentParser
     ap = ArgumentParser(description='Take statistics from CoNLL-U data')
+    ap.add_argument('-A', '--aggregate', default=False, action='store_true',
+                    help='output statistics per collection and crawl')
+    ap.add_argument('-m', '--merge', default=False, action='store_true',
+                    help='merge aggregate statistics given as data')
+    add_output_arguments(ap)
+    add_driver_arguments(ap)
     ap.add_argument('data', nargs='+')
     return ap
 
@@ -71,20 +81,7 @@ def sentence_statistics(sentences):
             stats['word-len'][len(w.form)] += 1
             stats['upos-count'][w.upos] += 1
             stats['dep-count'][w.deprel] += 1
-            if URL_RE.match(w.form):
-                stats['url-count'] += 1
-            elif TAG_RE.match(w.form):
-                stats['tag-count'] += 1
-            elif WORD_RE.match(w.form):
-                stats['word-count'] += 1
-            elif NUMBER_RE.match(w.form):
-                stats['number-count'] += 1
-            elif WORDNUM_RE.match(w.form):
-                stats['wordnum-count'] += 1
-            elif PUNCT_RE.match(w.form):
-                stats['punct-count'] += 1
-            else:
-                stats['other-count'] += 1
+            stats[FORM_COUNT_KEYS[FORM_CLASSIFIER(w.form)]] += 1
     return stats
 
 
@@ -96,73 +93,244 @@ def process_document(document_id, document_info, sentences):
                               json.dumps(stats, sort_keys=True)))
 
 
-def is_document_boundary(comment):
-    return comment.startswith('# <doc ') or comment.startswith('# doc_id = ')
-
-
-def parse_document_comment(comment):
-    m = DOC_COLLECTION_RE.match(comment)
-    if m:
-        coll, page = m.group(1), m.group(2)
-        if coll == 'wiki':
-            page = urllib.parse.quote(page.replace(' ', '_'))
-        id_ = '{}/{}'.format(coll, page)
-        langdiff = '_'
-        return id_, langdiff
-    m = DOC_CRAWL_RE.match(comment)
-    if m:
-        id_, langdiff = '{}/{}'.format(m.group(1), m.group(2)), m.group(3)
-        return id_, langdiff
-    m = DOC_CRAWL2_RE.match(comment)
-    if m:
-        id_, langdiff = '{}/{}'.format(m.group(1), m.group(2)), '_'
-        return id_, langdiff
-    m = DOC_CRAWL3_RE.match(comment)
-    if m:
-        id_, langdiff = '{}/{}'.format(m.group(2), m.group(1)), '_'
-        return id_, langdiff
-    error('Failed to parse document comment: "{}"'.format(comment))
-    return '<UNKNOWN>', '<UNKNOWN>'
+def document_group(comments):
+    """Return collection name, "crawl" or "other" for document."""
+    group = 'other'
+    for c in comments:
+        if not is_document_boundary(c):
+            continue
+        m = DOC_COLLECTION_RE.match(c)
+        if m:
+            group = m.group(1)
+        elif (DOC_CRAWL_RE.match(c) or DOC_CRAWL2_RE.match(c) or
+              DOC_CRAWL3_RE.match(c)):
+            group = 'crawl'
+        else:
+            group = 'other'
+    return group
+
+
+class Interner(dict):
+    def ids(self, values):
+        return np.array([self.setdefault(v, len(self)) for v in values],
+                        dtype=np.int64)
+
+
+class StatsAggregate(object):
+    """Statistics of sentence_statistics() summed per document group,
+    kept as arrays of counts indexed by group and value ids."""
+
+    def __init__(self):
+        self.groups = Interner()
+        self.values = { k: Interner() for k in ('upos-count', 'dep-count') }
+        self.counts = {}
+
+    def add(self, key, groups, values=None):
+        """Count items with given group and value ids."""
+        if values is None:
+            values = np.zeros(len(groups), dtype=np.int64)
+        if not len(groups):
+            return
+        counts = self.counts.get(key, np.zeros((0, 0), dtype=np.int64))
+        rows = max(len(self.groups), counts.shape[0])
+        cols = max(int(values.max())+1, counts.shape[1])
+        if counts.shape != (rows, cols):
+            counts = np.pad(counts, ((0, rows-counts.shape[0]),
+                                     (0, cols-counts.shape[1])), 'constant')
+        counts += np.bincount(groups*cols + values,
+                              minlength=rows*cols).reshape(rows, cols)
+        self.counts[key] = counts
+
+    def add_arrays(self, doc_groups, sentence_docs, token_sentences,
+                   upos, dep, form_lengths, form_classes):
+        """Add documents given as arrays of group ids per document,
+        document per sentence, sentence per token, and value ids per
+        token."""
+        sentence_groups = doc_groups[sentence_docs]
+        token_groups = sentence_groups[token_sentences]
+        sentence_lengths = np.bincount(token_sentences,
+                                       minlength=len(sentence_docs))
+        self.add('documents', doc_groups)
+        self.add('sent-num', sentence_groups)
+        self.add('token-count', token_groups)
+        self.add('sent-len', sentence_groups, sentence_lengths)
+        self.add('word-len', token_groups, form_lengths)
+        self.add('upos-count', token_groups, upos)
+        self.add('dep-count', token_groups, dep)
+        self.add('form', token_groups, form_classes)
+
+    def add_documents(self, documents):
+        groups, sentence_docs, token_sentences = [], [], []
+        upos, dep, forms = [], [], []
+        for sentences in documents:
+            groups.append(document_group(sentences[0][0]))
+            for comments, words in sentences:
+                token_sentences.extend([len(sentence_docs)] * len(words))
+                sentence_docs.append(len(groups)-1)
+                for w in words:
+                    upos.append(w.upos)
+                    dep.append(w.deprel)
+                    forms.append(w.form)
+        self.add_arrays(
+            self.groups.ids(groups),
+            np.array(sentence_docs, dtype=np.int64),
+            np.array(token_sentences, dtype=np.int64),
+            self.values['upos-count'].ids(upos),
+            self.values['dep-count'].ids(dep),
+            np.array([len(f) for f in forms], dtype=np.int64),
+            np.array([FORM_CLASS_ID[FORM_CLASSIFIER(f)] for f in forms],
+                     dtype=np.int64))
+
+    def add_cache(self, cache):
+        """Add documents of ConlluCache using its value id columns."""
+        for part in cache.parts:
+            first_sentences = part.document_sentences[:-1]
+            groups = [
+                document_group([part.comments[i] for i in range(s, e)])
+                for s, e in zip(part.sentence_comments[first_sentences],
+                                part.sentence_comments[first_sentences+1])
+            ]
+            forms = part.vocabulary('form')
+            form_ids = part.column('form')
+            self.add_arrays(
+                self.groups.ids(groups),
+                np.repeat(np.arange(len(part)),
+                          np.diff(part.document_sentences)),
+                np.repeat(np.arange(len(part.sentence_tokens)-1),
+                          np.diff(part.sentence_tokens)),
+                self.values['upos-count'].ids(
+                    part.vocabulary('upos'))[part.column('upos')],
+                self.values['dep-count'].ids(
+                    part.vocabulary('deprel'))[part.column('deprel')],
+                np.array([len(f) for f in forms], dtype=np.int64)[form_ids],
+                np.array([FORM_CLASS_ID[FORM_CLASSIFIER(f)] for f in forms],
+                         dtype=np.int64)[form_ids])
+
+    def to_dict(self):
+        """Return {group: statistics} with keys of sentence_statistics()
+        and "documents"."""
+        names = { 'sent-len': str, 'word-len': str }
+        for key, interner in self.values.items():
+            names[key] = sorted(interner, key=interner.get).__getitem__
+        result = {}
+        for group, g in self.groups.items():
+            stats = {}
+            for key, counts in self.counts.items():
+                if g < counts.shape[0]:
+                    row = counts[g]
+                else:
+                    row = np.zeros(counts.shape[1], dtype=np.int64)
+                if key in ('documents', 'sent-num', 'token-count'):
+                    stats[key] = int(row.sum())
+                elif key == 'form':
+                    for i in np.flatnonzero(row):
+                        stats[FORM_COUNT_KEYS[FORM_CLASSES[i]]] = int(row[i])
+                else:
+                    stats[key] = {
+                        names[key](int(i)): int(row[i])
+                        for i in np.flatnonzero(row)
+                    }
+            result[group] = stats
+        if result:
+            result[ALL_GROUP] = merge_stats({}, *result.values())
+        return result
+
+
+def merge_stats(merged, *stats):
+    """Sum nested dicts of counts into merged."""
+    for s in stats:
+        for k, v in s.items():
+            if isinstance(v, dict):
+                merge_stats(merged.setdefault(k, {}), v)
+            else:
+                merged[k] = merged.get(k, 0) + v
+    return merged
 
 
-def process_stream(f, options):
-    document_id, document_info, sentences = None, None, []
-    comments, words = [], []
-    for ln, l in enumerate(f, start=1):
-        l = l.rstrip('\n')
-        if not l or l.isspace():
-            sentences.append((comments, words))
-            comments, words = [], []
-        elif l.startswith('#'):
-            if is_document_boundary(l):
-                if sentences:
-                    process_document(document_id, document_info, sentences)
-                document_id, document_info = parse_document_comment(l)
-                sentences = []
-            comments.append(l)
-        else:
-            words.append(Word(*l.split('\t')))
-    if sentences:
+def merge_aggregates(merged, aggregate):
+    """Merge {group: statistics} dicts."""
+    for group, stats in aggregate.items():
+        merge_stats(merged.setdefault(group, {}), stats)
+    return merged
+
+
+def aggregate_file(fn, batch_size=10000):
+    """Return aggregate statistics for file as a dict."""
+    aggregate = StatsAggregate()
+    if is_conllu_cache(fn):
+        aggregate.add_cache(ConlluCache(fn))
+    else:
+        with open_input(fn) as f:
+            batch = []
+            for sentences in iter_conllu(f, lazy=True):
+                batch.append(sentences)
+                if len(batch) >= batch_size:
+                    aggregate.add_documents(batch)
+                    batch = []
+            aggregate.add_documents(batch)
+    return aggregate.to_dict()
+
+
+def aggregate_files(filenames, options):
+    if options.jobs and options.jobs > 1:
+        results = parallel_map(aggregate_file, filenames, options.jobs)
+    else:
+        results = (aggregate_file(fn) for fn in filenames)
+    merged = {}
+    for fn, aggregate in zip(filenames, results):
+        print('completed {}.'.format(os.path.basename(fn)),
+              file=sys.stderr, flush=True)
+        merge_aggregates(merged, aggregate)
+    return merged
+
+
+def merge_files(filenames):
+    merged = {}
+    for fn in filenames:
+        with open_input(fn) as f:
+            merge_aggregates(merged, json.load(f))
+    return merged
+
+
+def process_documents(documents, options):
+    for sentences in documents:
+        document_id, document_info = '<UNKNOWN>', '<UNKNOWN>'
+        for c in sentences[0][0]:
+            if is_document_boundary(c):
+                document_id, document_info = parse_document_comment(c)
         process_document(document_id, document_info, sentences)
 
 
+def process_stream(f, options):
+    return process_documents(iter_conllu(f, lazy=True), options)
+
+
 def process(fn, options):
-    if not fn.endswith('.gz'):
-        with open(fn) as f:
-            return process_stream(f, options)
-    else:
-        with gzip.open(fn, 'rt') as f:
-            return process_stream(f, options)
+    if is_conllu_cache(fn):
+        return process_documents(ConlluCache(fn), options)
+    with open_input(fn) as f:
+        return process_stream(f, options)
 
 
 def main(argv):
     args = argparser().parse_args(argv[1:])
-    for fn in args.data:
-        print('processing {} ...'.format(os.path.basename(fn)),
-              file=sys.stderr)
-        process(fn, args)
-        print('completed {}.'.format(os.path.basename(fn)),
-              file=sys.stderr)
+    if args.aggregate or args.merge:
+        if args.merge:
+            aggregate = merge_files(args.data)
+        else:
+            aggregate = aggregate_files(args.data, args)
+        with redirect_output(args):
+            print(json.dumps(aggregate, sort_keys=True))
+        return 0
+    if args.output_dir is not None:
+        return run_files(process, args.data, args, (args,))
+    with redirect_output(args):
+        for fn in args.data:
+            print('processing {} ...'.format(os.path.basename(fn)),
+                  file=sys.stderr)
+            process(fn, args)
+            print('completed {}.'.format(os.path.basename(fn)),
+                  file=sys.stderr)
     return 0
 
 
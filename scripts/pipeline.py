@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+
+# Run the mtgen -> filter -> sentfilter -> delex -> gettext chain over
+# CoNLL-U data in a single pass, parsing each input file only once.
+
+import sys
+import os
+import shlex
+
+from collections import defaultdict
+from contextlib import ExitStack
+from logging import error
+
+import predictud
+import filteruddocs
+import filterudsents
+import getsentences
+
+from common import iter_conllu, load_model, print_document
+from common import open_input, atomic_output, prepend_comments
+from common import add_driver_arguments, run_files, MANIFEST_FILENAME
+from common import check_dedup_arguments, close_bloom_filters
+from languageid import check_langid_arguments
+from metricstore import flush_metrics, print_store_stats
+
+
+STAGES = ['mtgen', 'filter', 'sentfilter', 'delex', 'gettext']
+
+# Output directories relative to the data root (cf. config/*.sh). The
+# first directory of each pair receives the documents that the stage
+# removes, the second those that are passed on to the next stage.
+OUTPUT_DIRS = {
+    'mtgen': ('mtgen_out/generated', 'mtgen_out/nongenerated'),
+    'filter': ('filter_out/filtered', 'filter_out/nonfiltered'),
+    'sentfilter': ('sentfilter_out/filtered', 'sentfilter_out/nonfiltered'),
+    'delex': ('delex_out/filtered', 'delex_out/nonfiltered'),
+    'gettext': ('extracted_texts',),
+}
+
+# Classes passed on and removed by the classifier stages, as given to
+# predictud.py --filter in scripts/run-{mtgen,delex}-classifiers.sh.
+PREDICT_CLASSES = {
+    'mtgen': ('Nongenerated', 'Generated'),
+    'delex': ('pos', 'neg'),
+}
+
+
+def argparser():
+    from argparse import ArgumentParser
+    ap = ArgumentParser(description='Run CoNLL-U processing stages in one pass')
+    ap.add_argument('-s', '--stages', default=','.join(STAGES),
+                    help='comma-separated stages to run (default all)')
+    ap.add_argument('--mtgen-model', default=None,
+                    help='model for mtgen stage (cf. MTGEN_MODEL)')
+    ap.add_argument('--mtgen-options', default='',
+                    help='predictud.py options for mtgen stage')
+    ap.add_argument('--filter-options', default='',
+                    help='filteruddocs.py options (cf. FILTER_OPTIONS)')
+    ap.add_argument('--sentfilter-options', default='',
+                    help='filterudsents.py options (cf. SFILTER_OPTIONS)')
+    ap.add_argument('--delex-model', default=None,
+                    help='model for delex stage (cf. DELEX_MODEL)')
+    ap.add_argument('--delex-options', default='',
+                    help='predictud.py options (cf. DELEX_OPTIONS)')
+    ap.add_argument('--gettext-options', default='',
+                    help='getsentences.py options (cf. GETTEXT_OPTIONS)')
+    ap.add_argument('-z', '--gzip', default=False, action='store_true',
+                    help='write gzipped outputs')
+    ap.add_argument('--compresslevel', default=6, type=int,
+                    help='gzip compression level for outputs')
+    ap.add_argument('--compress-threads', default=None, type=int,
+                    help='compression threads for outputs (pigz)')
+    add_driver_arguments(ap, output_dir=False)
+    ap.add_argument('root', help='output data root (cf. DATA_ROOT)')
+    ap.add_argument('data', nargs='+')
+    return ap
+
+
+class Stage(object):
+    def __init__(self, name, options):
+        self.name = name
+        self.options = options
+        self.stats = defaultdict(int)
+
+    def process(self, sentences, outputs):
+        """Process document, write to outputs, return True if passed on."""
+        raise NotImplementedError
+
+    def report(self, name):
+        for k, v in self.stats.items():
+            print('{}:{}:{}\t{}'.format(name, self.name, k, v),
+                  file=sys.stderr, flush=True)
+
+
+class PredictStage(Stage):
+    def __init__(self, name, model, options):
+        super(PredictStage, self).__init__(name, options)
+        print('loading model from {} ...'.format(model),
+              file=sys.stderr, flush=True)
+        self.clf, self.vecf = load_model(model, compiled=options.compiled)
+        self.pass_class, self.reject_class = PREDICT_CLASSES[name]
+
+    def process(self, sentences, outputs):
+        class_, value = predictud.predict_document(
+            sentences, self.clf, self.vecf, self.options)
+        comments = predictud.prediction_comments(class_, value, self.options)
+        prepend_comments(sentences, comments)
+        passed = not predictud.is_filtered(
+            class_, value, self.reject_class, self.options)
+        removed = not predictud.is_filtered(
+            class_, value, self.pass_class, self.options)
+        if removed:
+            print_document(sentences, outputs[0])
+            self.stats['removed'] += 1
+        if passed:
+            print_document(sentences, outputs[1])
+            self.stats['passed'] += 1
+        return passed
+
+
+class FilterStage(Stage):
+    def process(self, sentences, outputs):
+        result, skip = filteruddocs.filter_document(
+            sentences, self.stats, self.options)
+        prepend_comments(sentences, ['# filter_result = {}'.format(result)])
+        print_document(sentences, outputs[0 if skip else 1])
+        return not skip
+
+
+class SentFilterStage(Stage):
+    def process(self, sentences, outputs):
+        comment, skip = filterudsents.filter_document(
+            sentences, self.stats, self.options)
+        prepend_comments(sentences, [comment])
+        print_document(sentences, outputs[0 if skip else 1])
+        return not skip
+
+
+class GetTextStage(Stage):
+    def process(self, sentences, outputs):
+        lines = getsentences.get_document_lines(sentences, self.options)
+        if not lines:
+            return True
+        outputs[0].write('\n'.join(lines) + '\n\n')
+        self.stats['output'] += 1
+        return True
+
+
+def parse_stage_options(parser, options, positional, disallowed):
+    args = shlex.split(options)
+    for a in disallowed:
+        if a in args:
+            raise ValueError('{} is set by the pipeline'.format(a))
+    options = parser.parse_args(args + positional)
+    if hasattr(options, 'langid_backend'):
+        check_langid_arguments(parser, options)
+    return options
+
+
+def make_stages(args):
+    stages = []
+    for name in args.stages.split(','):
+        if name in ('mtgen', 'delex'):
+            model = getattr(args, '{}_model'.format(name))
+            if model is None:
+                raise ValueError('missing --{}-model'.format(name))
+            options = parse_stage_options(
+                predictud.argparser(), getattr(args, '{}_options'.format(name)),
+                [model] + args.data, ['-f', '--filter'])
+            stages.append(PredictStage(name, model, options))
+        elif name == 'filter':
+            options = parse_stage_options(
+                filteruddocs.argparser(), args.filter_options, args.data,
+                ['-i', '--invert'])
+            stages.append(FilterStage(name, options))
+        elif name == 'sentfilter':
+            options = parse_stage_options(
+                filterudsents.argparser(), args.sentfilter_options, args.data,
+                ['-i', '--invert'])
+            stages.append(SentFilterStage(name, options))
+        elif name == 'gettext':
+            parser = getsentences.argparser()
+            options = parse_stage_options(
+                parser, args.gettext_options, args.data, [])
+            check_dedup_arguments(parser, options, args.jobs)
+            stages.append(GetTextStage(name, options))
+        else:
+            raise ValueError('unknown stage "{}"'.format(name))
+    return stages
+
+
+def output_filenames(fn, stage, options):
+    base = os.path.basename(fn)
+    if base.endswith('.gz'):
+        base = base[:-len('.gz')]
+    if stage.name == 'gettext':
+        if base.endswith('.conllu'):
+            base = base[:-len('.conllu')]
+        if not base.endswith('.txt'):
+            base = base + '.txt'
+    if options.gzip:
+        base = base + '.gz'
+    return [
+        os.path.join(options.root, d, base)
+        for d in OUTPUT_DIRS[stage.name]
+    ]
+
+
+def pipeline_output_filenames(fn, stages, options):
+    return [
+        ofn for stage in stages for ofn in output_filenames(fn, stage, options)
+    ]
+
+
+def process_document(sentences, stages, outputs):
+    for stage, stage_outputs in zip(stages, outputs):
+        if not stage.process(sentences, stage_outputs):
+            return 0
+    return 1
+
+
+def process_stream(f, name, stages, outputs):
+    total_count, output_count = 0, 0
+    def report(stats):
+        print('processed {} lines ({} docs) ...'.format(
+            stats['lines'], total_count), file=sys.stderr, flush=True)
+    for sentences in iter_conllu(f, lazy=True, report=report,
+                                 raw=True):
+        output_count += process_document(sentences, stages, outputs)
+        total_count += 1
+    for stage in stages:
+        flush_metrics(stage.options)
+        stage.report(os.path.basename(name))
+    print_store_stats(name, filteruddocs.take_store_stats())
+    print('{}: output {}/{} ({:.1%})'.format(
+        os.path.basename(name), output_count, total_count,
+        output_count/max(total_count, 1)), file=sys.stderr, flush=True)
+
+
+def process(fn, stages, options):
+    outputs = []
+    with ExitStack() as stack:
+        for stage in stages:
+            stage.stats.clear()
+            stage_outputs = []
+            for ofn in output_filenames(fn, stage, options):
+                os.makedirs(os.path.dirname(ofn), exist_ok=True)
+                stage_outputs.append(stack.enter_context(atomic_output(
+                    ofn, options.compresslevel, options.compress_threads)))
+            outputs.append(stage_outputs)
+        with open_input(fn) as f:
+            return process_stream(f, fn, stages, outputs)
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+    try:
+        stages = make_stages(args)
+    except ValueError as e:
+        error(str(e))
+        return 1
+    manifest = args.manifest
+    if manifest is None:
+        manifest = os.path.join(args.root, MANIFEST_FILENAME)
+    os.makedirs(args.root, exist_ok=True)
+    try:
+        return run_files(process, args.data, args, (stages, args),
+                         pipeline_output_filenames, manifest)
+    finally:
+        close_bloom_filters()
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
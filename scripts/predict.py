@@ -10,6 +10,8 @@ def argparser():
     from argparse import ArgumentParser
     ap = ArgumentParser(description='Predict classes for text with SVM')
     ap.add_argument('-t', '--truncate', metavar='LEN', default=None, type=int)
+    ap.add_argument('-c', '--compiled', default=False, action='store_true',
+                    help='use compiled model (see compiledmodel.py)')
     ap.add_argument('data')
     ap.add_argument('model')
     return ap
@@ -18,7 +20,7 @@ def argparser():
 def main(argv):
     args = argparser().parse_args(argv[1:])
     examples = load_examples(args.data)
-    clf, vecf = load_model(args.model)
+    clf, vecf = load_model(args.model, compiled=args.compiled)
     X = vecf.transform([e.text for e in examples])
     for e, c, s in zip(examples, clf.predict(X), clf.decision_function(X)):
         text = e.text if args.truncate is None else e.text[:args.truncate]
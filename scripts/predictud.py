@@ -4,15 +4,21 @@
 
 import sys
 import os
-import gzip
 import re
 
 import numpy as np
 
 from collections import Counter
+from functools import lru_cache
 from logging import warning, error
 
-from common import Word, load_model, featurize_document
+from common import iter_conllu, load_model, print_document
+from common import batches, DelexFeaturizer, LazyWord
+from common import open_input, add_output_arguments, redirect_output
+from common import add_driver_arguments, run_files
+from metricstore import add_metric_store_arguments, stage_key
+from metricstore import load_metrics, save_metrics, count_reuse
+from metricstore import prefetch_metrics, flush_metrics, print_store_stats
 
 
 TEXT_COMMENT = '# text = '
@@ -33,6 +39,13 @@ def argparser():
                     help='use delexicalized features (default raw text)')
     ap.add_argument('-p', '--prefix', default=None,
                     help='prefix to attach to result comments')
+    ap.add_argument('-B', '--batch-size', default=100, type=int,
+                    help='number of documents to predict together')
+    ap.add_argument('-c', '--compiled', default=False, action='store_true',
+                    help='use compiled model (see compiledmodel.py)')
+    add_metric_store_arguments(ap)
+    add_output_arguments(ap)
+    add_driver_arguments(ap)
     ap.add_argument('model')
     ap.add_argument('data', nargs='+')
     return ap
@@ -56,109 +69,185 @@ def get_document_text(sentences, options):
     return ' '.join(texts)
 
 
+def is_linear(clf):
+    return clf.__class__.__name__ in ('LinearSVC', 'CompiledClassifier')
+
+
 def predict_with_bias(X, clf, options):
-    if clf.__class__.__name__ != 'LinearSVC':
+    if not is_linear(clf):
         if options.bias is not None:
             raise NotImplementedError
         else:
             return clf.predict(X), clf.decision_function(X)
     else:
-        # LinearSVC with optional bias, modifying SKLearn code
-        s = clf.decision_function(X)
-        if options.bias:
-            s += options.bias
-        if len(s.shape) == 1:
-            i = (s > 0).astype(np.int)
-        else:
-            i = s.argmax(axis=1)
-        c = clf.classes_[i]
-        return c, s
+        return apply_bias(clf.decision_function(X), clf, options)
 
 
-def process_document(sentences, clf, vecf, options):
+def apply_bias(s, clf, options):
+    # LinearSVC with optional bias, modifying SKLearn code
+    if options.bias:
+        s += options.bias
+    if len(s.shape) == 1:
+        i = (s > 0).astype(int)
+    else:
+        i = s.argmax(axis=1)
+    c = clf.classes_[i]
+    return c, s
+
+
+@lru_cache(maxsize=None)
+def delex_featurizer(vecf):
+    return DelexFeaturizer(vecf.vocabulary_)
+
+
+def featurize_documents(documents, vecf, options):
     if not options.delex:
-        text = get_document_text(sentences, options)
-        X = vecf.transform([text])
+        texts = [get_document_text(s, options) for s in documents]
+        X = vecf.transform(texts)
     else:
-        feats = featurize_document(sentences)
-        X = vecf.transform([feats])
+        X = delex_featurizer(vecf).transform(documents)
+        if vecf.__class__.__name__ != 'DictVectorizer':
+            # compiled vectorizer, takes matrix with original columns
+            X = vecf.transform(X)
+    return X
+
+
+def predict_documents(documents, clf, vecf, options):
+    X = featurize_documents(documents, vecf, options)
     #class_ = clf.predict(X)
     #value = clf.decision_function(X)
-    class_ , value = predict_with_bias(X, clf, options)
-    if ((options.filter is not None and options.filter == class_) and
-        (options.threshold is None or abs(value) > options.threshold)):
+    return predict_with_bias(X, clf, options)
+
+
+def document_content(sentences, options):
+    # text that features are computed from
+    if not options.delex:
+        return [get_document_text(sentences, options)]
+    else:
+        # same as '\t'.join(w), without splitting LazyWord lines
+        return [
+            w.line if type(w) is LazyWord else '\t'.join(w)
+            for comments, words in sentences for w in words
+        ]
+
+
+def predict_stored(documents, clf, vecf, options, stats):
+    """predict_documents() reusing decision function values without bias
+    from --metric-store."""
+    if not is_linear(clf):
+        raise NotImplementedError
+    # model files as in common.load_model()
+    model_fn = '{}.{}'.format(options.model,
+                              'compiled' if options.compiled else 'clf')
+    model = '{}:{}'.format(os.path.abspath(model_fn),
+                           os.path.getmtime(model_fn))
+    stage = stage_key('predict', model, options.compiled,
+                      options.tokenized, options.delex)
+    prefetch_metrics(options, documents)
+    values, keys = [], []
+    for sentences in documents:
+        value, key = load_metrics(options, stage, sentences,
+                                  document_content(sentences, options))
+        count_reuse(stats, value is not None)
+        values.append(value)
+        keys.append(key)
+    missing = [i for i, v in enumerate(values) if v is None]
+    if missing:
+        X = featurize_documents([documents[i] for i in missing], vecf,
+                                options)
+        s = clf.decision_function(X)
+        for i, v in zip(missing, s.tolist()):
+            save_metrics(options, stage, keys[i], v)
+            values[i] = v
+    return apply_bias(np.array(values, dtype=np.float64), clf, options)
+
+
+def predict_document(sentences, clf, vecf, options):
+    return predict_documents([sentences], clf, vecf, options)
+
+
+def is_filtered(class_, value, filter_class, options):
+    return ((filter_class is not None and filter_class == class_) and
+            (options.threshold is None or abs(value) > options.threshold))
+
+
+def prediction_comments(class_, value, options):
+    prefix = options.prefix if options.prefix is not None else ''
+    return [
+        '# {}predicted_class = {}'.format(prefix, class_),
+        '# {}predicted_value = {}'.format(prefix, value),
+    ]
+
+
+def output_document(sentences, class_, value, options):
+    if is_filtered(class_, value, options.filter, options):
         return 0
     else:
-        prefix = options.prefix if options.prefix is not None else ''
-        print('# {}predicted_class = {}'.format(prefix, class_))
-        print('# {}predicted_value = {}'.format(prefix, value))
-        for comments, words in sentences:
-            for c in comments:
-                print(c)
-            for w in words:
-                print('\t'.join(w))
-            print()
+        print_document(sentences,
+                       comments=prediction_comments(class_, value, options))
         return 1
 
 
-def is_document_boundary(comment):
-    return (comment.startswith('# doc_id = ') or
-            comment.startswith('# <doc '))
+def process_document(sentences, clf, vecf, options):
+    class_ , value = predict_document(sentences, clf, vecf, options)
+    return output_document(sentences, class_, value, options)
+
+
+def process_batch(documents, clf, vecf, options, stats=None):
+    if options.metric_store is None:
+        classes, values = predict_documents(documents, clf, vecf, options)
+    else:
+        classes, values = predict_stored(documents, clf, vecf, options,
+                                         stats)
+    output_count = 0
+    for i, sentences in enumerate(documents):
+        # slice to keep per-document class and value formatting
+        output_count += output_document(
+            sentences, classes[i:i+1], values[i:i+1], options)
+    return output_count
 
 
-def process_stream(f, name, *args):
+def process_stream(f, name, clf, vecf, options):
     total_count, output_count = 0, 0
-    document_id, document_info, sentences = None, None, []
-    comments, words = [], []
-    for ln, l in enumerate(f, start=1):
-        l = l.rstrip('\n')
-        if not l or l.isspace():
-            sentences.append((comments, words))
-            comments, words = [], []
-        elif l.startswith('#'):
-            if is_document_boundary(l):
-                if sentences:
-                    output_count += process_document(sentences, *args)
-                    total_count += 1
-                sentences = []
-            comments.append(l)
-        else:
-            words.append(Word(*l.split('\t')))
-        if ln % 100000 == 0:
-            print('processed {} lines, output {}/{} ({:.1%}) documents ...'.\
-                      format(ln, output_count, total_count,
-                             output_count/total_count),
-                  file=sys.stderr, flush=True)
-    if sentences:
-        output_count += process_document(sentences, *args)
-        total_count += 1
+    store_stats = Counter()
+    def report(stats):
+        print('processed {} lines, output {}/{} ({:.1%}) documents ...'.\
+                  format(stats['lines'], output_count, total_count,
+                         output_count/max(total_count, 1)),
+              file=sys.stderr, flush=True)
+    documents = iter_conllu(f, lazy=True, report=report, raw=True)
+    for batch in batches(documents, options.batch_size):
+        output_count += process_batch(batch, clf, vecf, options,
+                                      store_stats)
+        total_count += len(batch)
+    flush_metrics(options)
+    print_store_stats(name, store_stats)
     print('{}: output {}/{} ({:.1%})'.format(
         os.path.basename(name), output_count, total_count,
-        output_count/total_count), file=sys.stderr, flush=True)
+        output_count/max(total_count, 1)), file=sys.stderr, flush=True)
 
 
 def process(fn, *args):
-    if not fn.endswith('.gz'):
-        with open(fn) as f:
-            return process_stream(f, fn, *args)
-    else:
-        with gzip.open(fn, 'rt') as f:
-            return process_stream(f, fn, *args)
+    with open_input(fn) as f:
+        return process_stream(f, fn, *args)
 
 
 def main(argv):
     args = argparser().parse_args(argv[1:])
     print('loading model from {} ...'.format(args.model),
           file=sys.stderr, flush=True)
-    clf, vecf = load_model(args.model)
+    clf, vecf = load_model(args.model, compiled=args.compiled)
     print('loaded model from {} ...'.format(args.model),
           file=sys.stderr, flush=True)
-    for fn in args.data:
-        print('processing {} ...'.format(os.path.basename(fn)),
-              file=sys.stderr, flush=True)
-        process(fn, clf, vecf, args)
-        print('completed {}.'.format(os.path.basename(fn)),
-              file=sys.stderr, flush=True)
+    if args.output_dir is not None:
+        return run_files(process, args.data, args, (clf, vecf, args))
+    with redirect_output(args):
+        for fn in args.data:
+            print('processing {} ...'.format(os.path.basename(fn)),
+                  file=sys.stderr, flush=True)
+            process(fn, clf, vecf, args)
+            print('completed {}.'.format(os.path.basename(fn)),
+                  file=sys.stderr, flush=True)
     return 0
 
 
@@ -0,0 +1,58 @@
+#!/bin/bash
+
+set -euo pipefail
+
+# https://stackoverflow.com/a/246128
+SCRIPTDIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" >/dev/null 2>&1 && pwd )"
+
+PIPELINE="$SCRIPTDIR/pipeline.py"
+
+CONFIGDIR="$SCRIPTDIR/../config"
+
+for c in mtgen filter sentfilter delex gettext; do
+    CONFIG="$CONFIGDIR/$c.sh"
+    if [ ! -e "$CONFIG" ]; then
+	echo "$0:ERROR:missing config file $CONFIG" >&2
+	exit 1
+    fi
+    source "$CONFIG"
+done
+
+for f in "$MTGEN_MODEL".{clf,vecf} "$DELEX_MODEL".{clf,vecf}; do
+    if [ ! -e "$f" ]; then
+	echo "$0:ERROR:missing model file $f (not trained?)" >&2
+	exit 1
+    fi
+done
+
+if [[ ! -n $(find "$MTGEN_INDIR" -maxdepth 1 \
+    \( -name '*.conllu' -or -name '*.conllu.gz' \)) ]]; then
+    echo "$0:ERROR:no .conllu files found in $MTGEN_INDIR" >&2
+    exit 1
+fi
+
+for f in $(find "$MTGEN_INDIR" -maxdepth 1 \
+    \( -name '*.conllu' -or -name '*.conllu.gz' \)); do
+    b="$(basename "$f" .gz)"
+    o="$GETTEXT_OUTDIR/${b%.conllu}"
+    if [[ ! "$o" =~ \.txt$ ]]; then
+	o="$o.txt"
+    fi
+    if [ -s "$o" ]; then
+    	echo "$0:$o exists, skipping ..." >&2
+    else
+    	echo "$0:BATCH:$PIPELINE $MTGEN_DATA_ROOT $f" >&2
+    	sbatch "$SCRIPTDIR/runpipeline.sh" \
+	    "$PIPELINE" \
+	    --mtgen-model "$MTGEN_MODEL" \
+	    --mtgen-options "-t -b $MTGEN_BIAS" \
+	    --filter-options "$FILTER_OPTIONS" \
+	    --sentfilter-options "$SFILTER_OPTIONS" \
+	    --delex-model "$DELEX_MODEL" \
+	    --delex-options "$DELEX_OPTIONS" \
+	    --gettext-options "$GETTEXT_OPTIONS" \
+	    "$MTGEN_DATA_ROOT" "$f"
+    	echo "$0:BATCHED:$PIPELINE $MTGEN_DATA_ROOT $f" >&2
+    	sleep 60
+    fi
+done
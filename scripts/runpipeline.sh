@@ -0,0 +1,18 @@
+#!/bin/bash
+#SBATCH --ntasks=1
+#SBATCH --time=72:00:00
+#SBATCH --mem=8192
+#SBATCH --partition=parallel
+#SBATCH --output=/homeappl/home/pyysalos/sbatch-out/stdout/%j.txt
+#SBATCH --error=/homeappl/home/pyysalos/sbatch-out/stderr/%j.txt
+
+module load python-env/3.5.3
+
+if [ "$#" -lt 3 ]; then
+    echo "Usage: $0 SCRIPT [OPTIONS] ROOT IN"
+    exit 1
+fi
+
+echo "RUN:$@"
+python3 "$@"
+echo "DONE:$@"
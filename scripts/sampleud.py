@@ -2,16 +2,24 @@
 
 import sys
 import os
-import gzip
 
 from random import random
 
-from common import Word, is_document_boundary
+from common import iter_conllu, print_document, open_input
+from common import add_output_arguments, redirect_output
+from common import add_driver_arguments, run_files
+from indexconllu import DocumentReader, load_index, index_filename
+from indexconllu import normalize_document
 
 
 def argparser():
     from argparse import ArgumentParser
     ap = ArgumentParser(description='Sample CoNLL-U data')
+    ap.add_argument('-i', '--index', default=False, action='store_true',
+                    help='read only sampled documents using DATA.idx'
+                    ' (see indexconllu.py)')
+    add_output_arguments(ap)
+    add_driver_arguments(ap)
     ap.add_argument('ratio', type=float)
     ap.add_argument('data', nargs='+')
     return ap
@@ -20,46 +28,41 @@ def argparser():
 def process_document(sentences, options):
     if random() > options.ratio:
         return
-    for comments, words in sentences:
-        for c in comments:
-            print(c)
-        for w in words:
-            print('\t'.join(w))
-        print()
+    print_document(sentences)
 
 
 def sample_stream(f, fn, options):
-    sentences, comments, words = [], [], []
-    for ln, l in enumerate(f, start=1):
-        l = l.rstrip('\n')
-        if not l or l.isspace():
-            sentences.append((comments, words))
-            comments, words = [], []
-        elif l.startswith('#'):
-            if is_document_boundary(l):
-                if sentences:
-                    process_document(sentences, options)
-                sentences = []
-            comments.append(l)
-        else:
-            words.append(Word(*l.split('\t')))
-    if sentences:
+    for sentences in iter_conllu(f, lazy=True, raw=True):
         process_document(sentences, options)
         
 
+def sample_indexed(fn, options):
+    entries = sorted(load_index(index_filename(fn)), key=lambda e: e.ordinal)
+    entries = [e for e in entries if random() <= options.ratio]
+    reader = DocumentReader(fn)
+    try:
+        for e in entries:
+            text = reader.read(e).decode('utf-8')
+            sys.stdout.write(normalize_document(text))
+    finally:
+        reader.close()
+
+
 def sample(fn, options):
-    if not fn.endswith('.gz'):
-        with open(fn) as f:
-            return sample_stream(f, fn, options)
+    if options.index:
+        return sample_indexed(fn, options)
     else:
-        with gzip.open(fn, 'rt') as f:
+        with open_input(fn) as f:
             return sample_stream(f, fn, options)
 
 
 def main(argv):
     args = argparser().parse_args(argv[1:])
-    for fn in args.data:
-        sample(fn, args)
+    if args.output_dir is not None:
+        return run_files(sample, args.data, args, (args,))
+    with redirect_output(args):
+        for fn in args.data:
+            sample(fn, args)
     return 0
 
 
@@ -5,6 +5,8 @@
 import sys
 import os
 
+from common import open_input
+
 
 def argparser():
     from argparse import ArgumentParser
@@ -29,7 +31,7 @@ def output_filename(fn, part, options):
 def process(fn, options):
     part, out = 1, None
     documents, sentences, tokens = 0, 0, 0
-    with open(fn) as f:
+    with open_input(fn) as f:
         for l in f:
             if out is None:
                 outfn = output_filename(fn, part, options)
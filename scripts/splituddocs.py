@@ -6,7 +6,7 @@
 import sys
 import os
 
-from common import is_document_boundary
+from common import is_document_boundary, open_input
 
 
 def argparser():
@@ -29,7 +29,7 @@ def output_filename(fn, part, options):
 
 def process(fn, options):
     part, out, documents = 1, None, 0
-    with open(fn) as f:
+    with open_input(fn) as f:
         for l in f:
             l = l.rstrip()
             if is_document_boundary(l):
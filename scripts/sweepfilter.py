@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+# Evaluate a grid of filterdocs.py/filteruddocs.py configurations on
+# metrics tables (see filtermetrics.py), giving the numbers of documents
+# that pass and that fail each check, as reported by the filter.
+
+import sys
+import shlex
+
+from argparse import Namespace
+from itertools import product
+
+import numpy as np
+
+from common import add_output_arguments, redirect_output
+from filterdocs import TableMetrics, FILTER_CHECKS, filter_table
+from filterdocs import metrics_filename
+
+
+# Options that can be varied, i.e. thresholds of checks and --langdetect
+GRID_OPTIONS = set(l.replace('-', '_') for l, c, f in FILTER_CHECKS)
+
+
+def argparser():
+    from argparse import ArgumentParser
+    ap = ArgumentParser(description='Evaluate filter configurations')
+    ap.add_argument('-O', '--options', default='',
+                    help='filterdocs.py options common to all configurations')
+    ap.add_argument('-g', '--grid', metavar='OPTION=VALUE,...',
+                    default=[], action='append',
+                    help='values of filterdocs.py check option to try,'
+                    ' e.g. min-words=5,10 ("none" disables check)')
+    add_output_arguments(ap)
+    ap.add_argument('data', nargs='+',
+                    help='data with metrics table DATA.metrics')
+    return ap
+
+
+def parse_grid(grid, parser):
+    """Return [(dest, values), ...] for --grid arguments."""
+    actions = { a.dest: a for a in parser._actions }
+    parsed = []
+    for g in grid:
+        name, sep, values = g.partition('=')
+        dest = name.lstrip('-').replace('-', '_')
+        if not sep or dest not in GRID_OPTIONS or dest not in actions:
+            raise ValueError('invalid grid option "{}"'.format(g))
+        action = actions[dest]
+        converted = []
+        for v in values.split(','):
+            if isinstance(action.default, bool):
+                converted.append(v.lower() in ('1', 'true', 'yes'))
+            elif v.lower() == 'none':
+                converted.append(None)
+            else:
+                converted.append(action.type(v))
+        parsed.append((dest, converted))
+    return parsed
+
+
+def configurations(base, grid):
+    dests = [d for d, values in grid]
+    for values in product(*[v for d, v in grid]):
+        options = Namespace(**vars(base))
+        for d, v in zip(dests, values):
+            setattr(options, d, v)
+        yield values, options
+
+
+def main(argv):
+    from filterdocs import argparser as fd_argparser
+    args = argparser().parse_args(argv[1:])
+    parser = fd_argparser()
+    base = parser.parse_args(shlex.split(args.options) + ['-'])
+    try:
+        grid = parse_grid(args.grid, parser)
+    except ValueError as e:
+        print('error: {}'.format(e), file=sys.stderr)
+        return 1
+    metrics = TableMetrics(*[metrics_filename(fn) for fn in args.data])
+    print('loaded metrics of {} documents'.format(len(metrics)),
+          file=sys.stderr, flush=True)
+    labels = ['fail-{}'.format(l) for l, c, f in FILTER_CHECKS]
+    with redirect_output(args):
+        header = [d.replace('_', '-') for d, v in grid]
+        header += ['pass-all', 'pass-ratio'] + labels
+        print('\t'.join(header))
+        for values, options in configurations(base, grid):
+            failed = filter_table(metrics, options)
+            counts = np.bincount(failed, minlength=len(FILTER_CHECKS)+1)
+            passed = int(counts[len(FILTER_CHECKS)])
+            row = [str(v) for v in values]
+            row += [str(passed), '{:.4f}'.format(passed/max(len(metrics), 1))]
+            row += [str(int(c)) for c in counts[:len(FILTER_CHECKS)]]
+            print('\t'.join(row))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -14,6 +14,8 @@ def argparser():
     from argparse import ArgumentParser
     ap = ArgumentParser(description='Train SVM for text classification')
     ap.add_argument('data')
+    ap.add_argument('-c', '--compiled', default=False, action='store_true',
+                    help='also save compiled model (see compiledmodel.py)')
     ap.add_argument('model')
     return ap
 
@@ -32,7 +34,7 @@ def main(argv):
     clf = LinearSVC(C=1.0)
     clf.fit(X, Y)
 
-    save_model(args.model, clf, vecf)
+    save_model(args.model, clf, vecf, compiled=args.compiled)
     
     return 0
 
@@ -6,10 +6,9 @@ import pickle
 
 from collections import defaultdict
 
-from sklearn.feature_extraction import DictVectorizer
 from sklearn.svm import LinearSVC
 
-from common import load_conllu, featurize_documents, save_model
+from common import load_conllu, DelexFeaturizer, save_model
 
 
 def argparser():
@@ -17,6 +16,8 @@ def argparser():
     ap = ArgumentParser(description='Train SVM using delexicalized features')
     ap.add_argument('positive')
     ap.add_argument('negative')
+    ap.add_argument('-c', '--compiled', default=False, action='store_true',
+                    help='also save compiled model (see compiledmodel.py)')
     ap.add_argument('model')
     return ap
 
@@ -26,17 +27,19 @@ def main(argv):
 
     positive = load_conllu(args.positive)
     negative = load_conllu(args.negative)
-    posf = featurize_documents(positive)
-    negf = featurize_documents(negative)
-    vecf = DictVectorizer()
+    if type(positive) != type(negative):
+        # CoNLL-U cache and text data
+        positive, negative = list(positive), list(negative)
+    featurizer = DelexFeaturizer()
 
-    X = vecf.fit_transform(posf + negf)
-    Y = ['pos'] * len(posf) + ['neg'] * len(negf)
+    X = featurizer.fit_transform(positive + negative)
+    Y = ['pos'] * len(positive) + ['neg'] * len(negative)
+    vecf = featurizer.dict_vectorizer()
 
     clf = LinearSVC(C=1.0)
     clf.fit(X, Y)
 
-    save_model(args.model, clf, vecf)
+    save_model(args.model, clf, vecf, compiled=args.compiled)
     return 0
 
 
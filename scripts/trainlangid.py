@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+# Train character n-gram Naive Bayes model for languageid.py nb backend.
+
+import sys
+
+import numpy as np
+
+from collections import Counter
+
+from common import load_examples
+from languageid import char_ngrams, save_nb_model
+
+
+def argparser():
+    from argparse import ArgumentParser
+    ap = ArgumentParser(description='Train language identification model')
+    ap.add_argument('-a', '--alpha', default=1.0, type=float,
+                    help='additive smoothing')
+    ap.add_argument('-c', '--min-count', default=2, type=int,
+                    help='minimum total count of n-grams to include')
+    ap.add_argument('-n', '--min-n', default=1, type=int,
+                    help='minimum n-gram length')
+    ap.add_argument('-N', '--max-n', default=4, type=int,
+                    help='maximum n-gram length')
+    ap.add_argument('data', help='TSV with id, language (e.g. "fi"), text')
+    ap.add_argument('model')
+    return ap
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+    ngram_range = (args.min_n, args.max_n)
+
+    examples = load_examples(args.data)
+    class_counts, ngram_counts = Counter(), {}
+    for e in examples:
+        class_counts[e.class_] += 1
+        if e.class_ not in ngram_counts:
+            ngram_counts[e.class_] = Counter()
+        ngram_counts[e.class_].update(char_ngrams(e.text, ngram_range))
+
+    classes = sorted(class_counts)
+    total = Counter()
+    for c in classes:
+        total.update(ngram_counts[c])
+    ngrams = sorted(g for g, n in total.items() if n >= args.min_count)
+
+    counts = np.zeros((len(ngrams), len(classes)))
+    for j, c in enumerate(classes):
+        counts[:, j] = [ngram_counts[c][g] for g in ngrams]
+    counts += args.alpha
+    logprob = np.log(counts) - np.log(counts.sum(axis=0))
+    prior = np.log([class_counts[c] for c in classes])
+    prior -= np.log(len(examples))
+
+    save_nb_model(args.model, classes, prior, logprob, ngrams, ngram_range)
+    print('saved model with {} n-grams for {} to {}'.format(
+        len(ngrams), ', '.join(classes), args.model),
+          file=sys.stderr, flush=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))